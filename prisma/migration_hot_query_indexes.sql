@@ -0,0 +1,29 @@
+-- Migration: Partial and composite indexes for the referral and commission scripts
+-- Date: 2026-10-18
+-- Description: Index the access paths the scripts/ tools filter on; apply with
+--   python scripts/migrate.py (builds each index CONCURRENTLY) and check with
+--   python scripts/verify_indexes.py
+
+-- Open reservations, newest first: check_missing_referrals.py (--stream), add_*_referral*.py
+CREATE INDEX IF NOT EXISTS "reservations_open_referral_createdAt_idx"
+  ON "reservations"("createdAt" DESC)
+  WHERE "referrerId" IS NULL;
+
+-- Open reservations changed since a checkpoint: check_missing_referrals.py --incremental
+CREATE INDEX IF NOT EXISTS "reservations_open_referral_updatedAt_id_idx"
+  ON "reservations"("updatedAt", "id")
+  WHERE "referrerId" IS NULL;
+
+-- Completed, attributed, unpaid commissions in claim order: payout_commissions.py
+CREATE INDEX IF NOT EXISTS "reservations_unpaid_commission_idx"
+  ON "reservations"("completedAt" NULLS FIRST, "id")
+  WHERE "status" = 'completed' AND NOT "commissionPaid" AND "referrerId" IS NOT NULL;
+
+-- A user's ledger, newest first: add_drw_corp_referral.py, reconcile_commissions.py, recompute_loyalty.py
+CREATE INDEX IF NOT EXISTS "transactions_userId_createdAt_idx"
+  ON "transactions"("userId", "createdAt" DESC);
+
+-- Ledger rows for a reservation/voucher
+CREATE INDEX IF NOT EXISTS "transactions_referenceId_idx"
+  ON "transactions"("referenceId")
+  WHERE "referenceId" IS NOT NULL;
@@ -0,0 +1,11 @@
+-- Migration: Extended statistics for correlated reservation columns
+-- Date: 2026-10-18
+-- Description: commissionPaid is only set on completed reservations, so the
+--   planner's independence assumption halves row estimates that filter on both
+--   (the estimated statistics in scripts/verify_all_referrals.py); an MCV list
+--   over the pair keeps them accurate. Apply with python scripts/migrate.py
+
+CREATE STATISTICS IF NOT EXISTS "reservations_status_commissionPaid_stats" (mcv)
+  ON "status", "commissionPaid" FROM "reservations";
+
+ANALYZE "reservations";
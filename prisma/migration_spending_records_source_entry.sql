@@ -0,0 +1,11 @@
+-- Migration: Link imported spending records to their daily spending entry
+-- Date: 2026-10-18
+-- Description: spending_records."sourceEntryId" (unique) remembers the
+--   daily_spending_entries row a source = 'import' record was created from, so
+--   scripts/link_spending_members.py never credits a visit twice. Apply with
+--   python scripts/migrate.py
+
+ALTER TABLE "spending_records" ADD COLUMN IF NOT EXISTS "sourceEntryId" TEXT;
+
+CREATE UNIQUE INDEX IF NOT EXISTS "spending_records_sourceEntryId_key"
+  ON "spending_records"("sourceEntryId");
@@ -0,0 +1,35 @@
+-- Migration: Balance ledger for affiliate payouts, withdrawals and points
+-- Date: 2026-10-18
+-- Description: Payouts, withdrawals and spending points append a row to
+--   user_balance_deltas instead of updating the users row; the app's balance
+--   folder (src/lib/balances.ts) and scripts/earnings_ledger.py fold pending
+--   deltas into users in batches. Balances are read from the user_balances
+--   view, which adds pending deltas to the stored counters. Apply with
+--   python scripts/migrate.py
+
+CREATE TABLE IF NOT EXISTS "user_balance_deltas" (
+  "id" BIGSERIAL PRIMARY KEY,
+  "userId" TEXT NOT NULL,
+  "earnings" DECIMAL(12,2) NOT NULL DEFAULT 0,
+  "referrals" INTEGER NOT NULL DEFAULT 0,
+  "points" INTEGER NOT NULL DEFAULT 0,
+  "transactionId" TEXT,
+  "createdAt" TIMESTAMP(3) NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS "user_balance_deltas_userId_idx" ON "user_balance_deltas"("userId");
+
+CREATE OR REPLACE VIEW "user_balances" AS
+SELECT
+  u.id,
+  u."totalEarnings" + COALESCE(d.earnings, 0) AS "totalEarnings",
+  u."totalReferrals" + COALESCE(d.referrals, 0)::INTEGER AS "totalReferrals",
+  u.points + COALESCE(d.points, 0)::INTEGER AS points,
+  COALESCE(d.deltas, 0) AS "pendingDeltas"
+FROM "users" u
+LEFT JOIN (
+  SELECT "userId", SUM(earnings) AS earnings, SUM(referrals) AS referrals, SUM(points) AS points,
+         COUNT(*) AS deltas
+  FROM "user_balance_deltas"
+  GROUP BY "userId"
+) d ON d."userId" = u.id;
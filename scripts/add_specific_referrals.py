@@ -1,175 +1,428 @@
 """
 Script to add specific referrals to reservations
-"""
-import os
-import psycopg2
-from psycopg2.extras import RealDictCursor
-from dotenv import load_dotenv
 
-# Load environment variables
-load_dotenv()
+Usage:
+    python scripts/add_specific_referrals.py                      # built-in list
+    python scripts/add_specific_referrals.py --file referrals.csv # bulk mode
+    python scripts/add_specific_referrals.py --file referrals.json --dry-run
+    python scripts/add_specific_referrals.py --verify patients.txt  # verify only
+
+Bulk files hold (patient_name, affiliate_code) pairs: a CSV with those two
+header columns, or a JSON list of objects/pairs. Lines with a blank name or
+code are reported as invalid. Several lines for the same patient take the
+patient's open reservations newest first, one each.
+"""
+import argparse
+import csv
+import io
+import json
 
-def connect_db():
-    """Connect to PostgreSQL database"""
-    database_url = os.getenv('DATABASE_URL')
-    if not database_url:
-        raise ValueError("DATABASE_URL not found in environment variables")
-    
-    conn = psycopg2.connect(database_url)
-    return conn
+import earnings_ledger
+import patient_lookup
+from affiliate_directory import get_directory
+from commission import commission_for, compute_batch, get_rate_table
+from db import transaction
+from ids import cuid, cuids
 
 def add_referrer(patient_name, affiliate_code):
     """Add referrer to a reservation by patient name"""
-    conn = connect_db()
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
-    
     try:
-        # Find reservation by patient name
-        cursor.execute(
-            '''
-            SELECT r.id, r."userId", r."finalPrice", r.status, r."patientName"
-            FROM reservations r
-            WHERE LOWER(r."patientName") = LOWER(%s)
-            AND r."referrerId" IS NULL
-            ORDER BY r."createdAt" DESC
-            LIMIT 1
-            ''',
-            (patient_name,)
-        )
-        reservation = cursor.fetchone()
-        
-        if not reservation:
-            print(f"❌ Reservation for {patient_name} not found or already has referrer")
-            return False
+        with transaction() as cursor:
+            # Find reservation by patient name
+            matches = patient_lookup.search(
+                cursor,
+                patient_name,
+                columns='r.id, r."userId", r."finalPrice", r.status, r."patientName", '
+                        't."categoryId", r."reservationDate"',
+                join='JOIN treatments t ON t.id = r."treatmentId"',
+                where='AND r."referrerId" IS NULL',
+                limit=1,
+            )
+            reservation = matches[0] if matches else None
         
-        # Get referrer by affiliate code
-        cursor.execute(
-            'SELECT id, "firstName", "lastName" FROM users WHERE "affiliateCode" = %s',
-            (affiliate_code.upper(),)
-        )
-        referrer = cursor.fetchone()
+            if not reservation:
+                print(f"❌ Reservation for {patient_name} not found or already has referrer")
+                similar = patient_lookup.suggest(cursor, patient_name)
+                if similar:
+                    print(f"   Did you mean: {', '.join(similar)}")
+                return False
         
-        if not referrer:
-            print(f"❌ Affiliate code {affiliate_code} not found")
-            return False
+            # Resolve affiliate code to its team leader (no round trip)
+            referrer = get_directory(listen=False).resolve(affiliate_code)
         
-        # Check if user trying to use their own code
-        if reservation['userId'] == referrer['id']:
-            print(f"❌ Cannot use own affiliate code")
-            return False
+            if not referrer:
+                print(f"❌ Affiliate code {affiliate_code} not found")
+                return False
         
-        # Calculate commission
-        commission_rate = 0.10
-        commission_amount = float(reservation['finalPrice']) * commission_rate
+            # Check if user trying to use their own code
+            if reservation['userId'] == referrer.id:
+                print(f"❌ Cannot use own affiliate code")
+                return False
         
-        print(f"\n📝 Processing: {patient_name}")
-        print(f"   Reservation ID: {reservation['id'][:12]}...")
-        print(f"   Status: {reservation['status']}")
-        print(f"   Price: Rp {float(reservation['finalPrice']):,.0f}")
-        print(f"   Commission: Rp {commission_amount:,.0f}")
-        print(f"   Referrer: {referrer['firstName']} {referrer['lastName']} ({affiliate_code})")
+            # Calculate commission
+            commission = commission_for(
+                reservation['finalPrice'], referrer.id, reservation['categoryId'], reservation['reservationDate']
+            )
+            commission_amount = commission.amount
         
-        # Update reservation
-        cursor.execute(
-            '''
-            UPDATE reservations 
-            SET "referredBy" = %s, 
-                "referrerId" = %s,
-                "commissionAmount" = %s
-            WHERE id = %s
-            ''',
-            (affiliate_code.upper(), referrer['id'], commission_amount, reservation['id'])
-        )
+            print(f"\n📝 Processing: {patient_name}")
+            print(f"   Reservation ID: {reservation['id'][:12]}...")
+            print(f"   Status: {reservation['status']}")
+            print(f"   Price: Rp {float(reservation['finalPrice']):,.0f}")
+            print(f"   Commission: Rp {commission_amount:,.0f}")
+            print(f"   Referrer: {referrer.name} ({affiliate_code})")
         
-        # If reservation is completed, pay commission immediately
-        if reservation['status'] == 'completed':
-            print(f"   💰 Paying commission (status: completed)...")
-            
-            # Update referrer earnings
+            # Update reservation
             cursor.execute(
                 '''
-                UPDATE users 
-                SET "totalEarnings" = "totalEarnings" + %s,
-                    "totalReferrals" = "totalReferrals" + 1,
-                    points = points + %s
+                UPDATE reservations 
+                SET "referredBy" = %s, 
+                    "referrerId" = %s,
+                    "commissionAmount" = %s,
+                    "updatedAt" = CURRENT_TIMESTAMP
                 WHERE id = %s
                 ''',
-                (commission_amount, int(commission_amount / 100), referrer['id'])
+                (affiliate_code.upper(), referrer.id, commission_amount, reservation['id'])
             )
+        
+            # If reservation is completed, pay commission immediately
+            if reservation['status'] == 'completed':
+                print(f"   💰 Paying commission (status: completed)...")
             
-            # Create transaction
-            cursor.execute(
-                '''
-                INSERT INTO transactions 
-                    ("userId", type, amount, points, description, "referenceId", "createdAt")
-                VALUES (%s, %s, %s, %s, %s, %s, NOW())
-                ''',
-                (
-                    referrer['id'], 
-                    'commission', 
-                    commission_amount,
-                    int(commission_amount / 100),
-                    f"Commission from referral: {patient_name}",
-                    reservation['id']
+                # Queue referrer earnings (folded into users by earnings_ledger)
+                transaction_id = cuid()
+                earnings_ledger.append_one(cursor, referrer.id, commission_amount, 1, commission.points, transaction_id)
+            
+                # Create transaction
+                cursor.execute(
+                    '''
+                    INSERT INTO transactions 
+                        (id, "userId", type, amount, points, description, "referenceId", "createdAt")
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, NOW())
+                    ''',
+                    (
+                        transaction_id,
+                        referrer.id, 
+                        'commission', 
+                        commission_amount,
+                        commission.points,
+                        f"Commission from referral: {patient_name}",
+                        reservation['id']
+                    )
                 )
-            )
             
-            # Mark commission as paid
-            cursor.execute(
-                'UPDATE reservations SET "commissionPaid" = true WHERE id = %s',
-                (reservation['id'],)
-            )
+                # Mark commission as paid
+                cursor.execute(
+                    'UPDATE reservations SET "commissionPaid" = true, "updatedAt" = CURRENT_TIMESTAMP WHERE id = %s',
+                    (reservation['id'],)
+                )
             
-            print(f"   ✅ Commission paid!")
-        else:
-            print(f"   ⏳ Commission will be paid when completed")
+                print(f"   ✅ Commission paid!")
+            else:
+                print(f"   ⏳ Commission will be paid when completed")
         
-        conn.commit()
         print(f"   ✅ Referrer added successfully!\n")
         return True
         
     except Exception as e:
-        conn.rollback()
         print(f"❌ Error: {e}")
         return False
-    finally:
-        cursor.close()
-        conn.close()
 
-def verify_referrals():
-    """Verify all referrals are added correctly"""
-    conn = connect_db()
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
+def load_referral_pairs(path):
+    """Read (patient_name, affiliate_code) pairs from a CSV or JSON file"""
+    if path.lower().endswith('.json'):
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+        pairs = []
+        for item in data:
+            if isinstance(item, dict):
+                pairs.append((item['patient_name'], item['affiliate_code']))
+            else:
+                pairs.append((item[0], item[1]))
+        return pairs
+    
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        reader = csv.DictReader(f)
+        return [(row['patient_name'], row['affiliate_code']) for row in reader]
+
+def price_matches(cursor):
+    """Fill referral_matches commission columns from the rate table, in one batch."""
+    cursor.execute(
+        '''
+        SELECT line_no, price_cents, referrer_id, category_id, reservation_day
+        FROM referral_matches
+        WHERE reservation_id IS NOT NULL
+        '''
+    )
+    rows = cursor.fetchall()
+    if not rows:
+        return
+    _, amounts, points = compute_batch(
+        get_rate_table(),
+        [row['price_cents'] for row in rows],
+        [row['referrer_id'] for row in rows],
+        [row['category_id'] for row in rows],
+        [row['reservation_day'] for row in rows],
+    )
+    cursor.execute(
+        '''
+        UPDATE referral_matches m
+        SET commission_amount = v.amount_cents / 100.0,
+            commission_points = v.points
+        FROM unnest(%s::INTEGER[], %s::BIGINT[], %s::INTEGER[]) AS v(line_no, amount_cents, points)
+        WHERE m.line_no = v.line_no
+        ''',
+        ([row['line_no'] for row in rows], [int(amount) for amount in amounts], [int(p) for p in points]),
+    )
+
+def bulk_add_referrers(pairs, dry_run=False):
+    """Attribute many (patient_name, affiliate_code) pairs in one transaction.
+    
+    Pairs are COPY'd into a temp table and resolved, attributed and paid with
+    a handful of set-based statements. Names are matched like
+    patient_lookup's exact mode; the n-th line for a patient takes the
+    patient's n-th newest open reservation. Returns one result row per input
+    pair.
+    """
+    directory = get_directory(listen=False)
+    pairs = list(pairs)
+    transaction_ids = cuids(len(pairs))
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for line_no, (patient_name, affiliate_code) in enumerate(pairs, 1):
+        patient_name = (patient_name or '').strip()
+        affiliate_code = (affiliate_code or '').strip().upper()
+        # A blank key is written as NULL and reported as invalid
+        patient_key = patient_lookup.normalize(patient_name) if affiliate_code else ''
+        referrer = directory.resolve(affiliate_code) if patient_key else None
+        writer.writerow([
+            line_no,
+            patient_name,
+            patient_key,
+            affiliate_code,
+            referrer.id if referrer else '',
+            transaction_ids[line_no - 1],
+        ])
+    buffer.seek(0)
+    
+    with transaction() as cursor:
+        cursor.execute(
+            '''
+            CREATE TEMP TABLE referral_import (
+                line_no INTEGER PRIMARY KEY,
+                patient_name TEXT NOT NULL,
+                patient_key TEXT,
+                affiliate_code TEXT NOT NULL,
+                referrer_id TEXT,
+                transaction_id TEXT NOT NULL
+            ) ON COMMIT DROP
+            '''
+        )
+        cursor.copy_expert(
+            'COPY referral_import FROM STDIN WITH (FORMAT csv, FORCE_NOT_NULL (patient_name, affiliate_code))',
+            buffer,
+        )
+        
+        # Resolve every pair to an open reservation: lines for the same patient
+        # (and a resolved code) walk down that patient's reservations
+        cursor.execute(
+            f'''
+            CREATE TEMP TABLE referral_matches ON COMMIT DROP AS
+            WITH ranked AS (
+                SELECT
+                    i.*,
+                    ROW_NUMBER() OVER (
+                        PARTITION BY i.patient_key, i.referrer_id IS NULL
+                        ORDER BY i.line_no
+                    ) AS patient_order
+                FROM referral_import i
+            ),
+            resolved AS (
+                SELECT
+                    i.line_no,
+                    i.patient_name,
+                    i.affiliate_code,
+                    i.transaction_id,
+                    res.id AS reservation_id,
+                    res."userId" AS booker_id,
+                    res.status,
+                    res."patientName" AS reservation_patient,
+                    (res."finalPrice" * 100)::BIGINT AS price_cents,
+                    res."categoryId" AS category_id,
+                    res."reservationDate"::DATE - DATE '1970-01-01' AS reservation_day,
+                    i.patient_key,
+                    i.referrer_id
+                FROM ranked i
+                LEFT JOIN LATERAL (
+                    SELECT r.id, r."userId", r.status, r."patientName", r."finalPrice",
+                           r."reservationDate", t."categoryId"
+                    FROM reservations r
+                    JOIN treatments t ON t.id = r."treatmentId"
+                    WHERE {patient_lookup.RESERVATIONS.key} = i.patient_key
+                    AND r."referrerId" IS NULL
+                    ORDER BY {patient_lookup.RESERVATIONS.order}
+                    OFFSET i.patient_order - 1
+                    LIMIT 1
+                ) res ON true
+            )
+            SELECT
+                resolved.*,
+                NULL::NUMERIC(10, 2) AS commission_amount,
+                NULL::INTEGER AS commission_points,
+                CASE
+                    WHEN patient_key IS NULL THEN 'invalid'
+                    WHEN reservation_id IS NULL THEN 'reservation_not_found'
+                    WHEN referrer_id IS NULL THEN 'code_not_found'
+                    WHEN booker_id = referrer_id THEN 'own_code'
+                    ELSE 'ok'
+                END AS result
+            FROM resolved
+            '''
+        )
+        price_matches(cursor)
+        
+        cursor.execute(
+            '''
+            UPDATE reservations r
+            SET "referredBy" = m.affiliate_code,
+                "referrerId" = m.referrer_id,
+                "commissionAmount" = m.commission_amount,
+                "updatedAt" = CURRENT_TIMESTAMP
+            FROM referral_matches m
+            WHERE m.result = 'ok'
+            AND r.id = m.reservation_id
+            '''
+        )
+        
+        # Completed reservations are paid immediately, like the single-row path;
+        # balances are queued as ledger deltas instead of locking referrer rows
+        earnings_ledger.ensure_table(cursor)
+        cursor.execute(
+            '''
+            INSERT INTO user_balance_deltas ("userId", earnings, referrals, points, "transactionId")
+            SELECT referrer_id, commission_amount, 1, commission_points, transaction_id
+            FROM referral_matches
+            WHERE result = 'ok' AND status = 'completed'
+            '''
+        )
+        cursor.execute(
+            '''
+            INSERT INTO transactions
+                (id, "userId", type, amount, points, description, "referenceId", "createdAt")
+            SELECT
+                transaction_id,
+                referrer_id,
+                'commission',
+                commission_amount,
+                commission_points,
+                'Commission from referral: ' || reservation_patient,
+                reservation_id,
+                NOW()
+            FROM referral_matches
+            WHERE result = 'ok' AND status = 'completed'
+            '''
+        )
+        cursor.execute(
+            '''
+            UPDATE reservations r
+            SET "commissionPaid" = true,
+                "updatedAt" = CURRENT_TIMESTAMP
+            FROM referral_matches m
+            WHERE m.result = 'ok'
+            AND m.status = 'completed'
+            AND r.id = m.reservation_id
+            '''
+        )
+        
+        cursor.execute(
+            '''
+            SELECT line_no, patient_name, affiliate_code, reservation_id, status,
+                   commission_amount, result
+            FROM referral_matches
+            ORDER BY line_no
+            '''
+        )
+        results = cursor.fetchall()
+        
+        if dry_run:
+            cursor.connection.rollback()
+    
+    return results
+
+def print_bulk_report(results, dry_run=False):
+    """Print one line per input pair plus a summary"""
+    print(f"\n{'#':>5}  {'PATIENT':30s} {'CODE':10s} {'RESERVATION':14s} {'STATUS':10s} {'COMMISSION':>12s}  RESULT")
+    for row in results:
+        reservation_id = (row['reservation_id'] or '-')[:12]
+        commission = f"{float(row['commission_amount']):,.0f}" if row['commission_amount'] is not None else '-'
+        status = row['status'] or '-'
+        if row['result'] != 'ok':
+            marker = '❌'
+        elif status == 'completed':
+            marker = '💰'
+        else:
+            marker = '⏳'
+        print(
+            f"{row['line_no']:>5}  {row['patient_name'][:30]:30s} {row['affiliate_code']:10s} "
+            f"{reservation_id:14s} {status:10s} {commission:>12s}  {marker} {row['result']}"
+        )
+    
+    counts = {}
+    for row in results:
+        counts[row['result']] = counts.get(row['result'], 0) + 1
     
+    print("\n" + "="*80)
+    ok = counts.pop('ok', 0)
+    suffix = " (dry run, rolled back)" if dry_run else ""
+    print(f"SUMMARY: {ok}/{len(results)} referrals added successfully{suffix}")
+    for result, count in sorted(counts.items()):
+        print(f"   {result}: {count}")
+    print("="*80)
+
+DEFAULT_PATIENTS = ["wildan arif", "Ajeng Disna Wiherdaning", "FIKA"]
+
+def load_patient_names(path):
+    """Read patient names from a text file (one per line), a CSV with a
+    patient_name column, or a JSON list of names/objects"""
+    if path.lower().endswith('.json'):
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+        return [item['patient_name'] if isinstance(item, dict) else item for item in data]
+    
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        if path.lower().endswith('.csv'):
+            return [row['patient_name'] for row in csv.DictReader(f)]
+        return [line.strip() for line in f if line.strip()]
+
+def verify_referrals(patients=None):
+    """Verify all referrals are added correctly"""
     print("\n" + "="*80)
     print("VERIFYING REFERRALS")
     print("="*80 + "\n")
     
-    patients = ["wildan arif", "Ajeng Disna Wiherdaning", "FIKA"]
+    patients = patients or DEFAULT_PATIENTS
     
-    for patient in patients:
-        cursor.execute(
-            '''
-            SELECT 
-                r."patientName",
-                r.status,
-                r."finalPrice",
-                r."referredBy",
-                r."commissionAmount",
-                r."commissionPaid",
-                u."firstName" as referrer_first,
-                u."lastName" as referrer_last,
-                u."affiliateCode" as referrer_code
-            FROM reservations r
-            LEFT JOIN users u ON r."referrerId" = u.id
-            WHERE LOWER(r."patientName") = LOWER(%s)
-            ORDER BY r."createdAt" DESC
-            LIMIT 1
+    with transaction() as cursor:
+        found = patient_lookup.latest(
+            cursor,
+            patients,
+            columns='''
+            r."patientName",
+            r.status,
+            r."finalPrice",
+            r."referredBy",
+            r."commissionAmount",
+            r."commissionPaid",
+            u."firstName" as referrer_first,
+            u."lastName" as referrer_last,
+            u."affiliateCode" as referrer_code
             ''',
-            (patient,)
+            join='LEFT JOIN users u ON r."referrerId" = u.id',
         )
-        
-        result = cursor.fetchone()
+    
+    missing = []
+    for patient in patients:
+        result = found.get(patient_lookup.normalize(patient))
         
         if result:
             print(f"✅ {result['patientName']}")
@@ -183,15 +436,35 @@ def verify_referrals():
             else:
                 print(f"   ⚠️  NO REFERRER DATA!")
             print()
+        else:
+            missing.append(patient)
     
-    cursor.close()
-    conn.close()
+    if missing:
+        print(f"❌ No reservation found for {len(missing)} patient(s): {', '.join(missing)}")
 
 def main():
+    parser = argparse.ArgumentParser(description="Add referrers to reservations by patient name")
+    parser.add_argument('--file', help="CSV/JSON file of patient_name, affiliate_code pairs (bulk mode)")
+    parser.add_argument('--dry-run', action='store_true', help="Resolve and report without saving (bulk mode)")
+    parser.add_argument('--verify', metavar='FILE',
+                        help="Only verify the patients listed in FILE (txt, CSV patient_name column or JSON)")
+    args = parser.parse_args()
+    
+    if args.verify:
+        verify_referrals(load_patient_names(args.verify))
+        return
+    
     print("="*80)
     print("ADDING REFERRALS TO RESERVATIONS")
     print("="*80)
     
+    if args.file:
+        pairs = load_referral_pairs(args.file)
+        print(f"\n📂 Loaded {len(pairs)} referrals from {args.file}")
+        results = bulk_add_referrers(pairs, dry_run=args.dry_run)
+        print_bulk_report(results, dry_run=args.dry_run)
+        return
+    
     # Add referrals
     referrals = [
         ("wildan arif", "WIQGM"),
@@ -0,0 +1,252 @@
+"""In-process affiliate code directory (code -> team leader + members).
+
+Since the team-affiliate migration, ``users."affiliateCode"`` is shared by
+every member of a team, so ``SELECT id FROM users WHERE "affiliateCode" = %s``
+costs a round trip and returns an arbitrary member. The directory loads all codes with one
+query and resolves a code to its team leader (the earliest-created leader,
+falling back to the earliest member) in memory.
+
+It stays fresh through a trigger on ``users`` that publishes row changes
+with ``pg_notify`` and a background thread that LISTENs for them. Install
+the trigger once with::
+
+    python scripts/affiliate_directory.py --install-trigger
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import select
+import sys
+import threading
+from datetime import datetime
+from typing import Dict, List, NamedTuple, Optional
+
+import psycopg2
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+
+from db import get_database_url, transaction
+
+CHANNEL = "affiliate_directory"
+
+NOTIFY_TRIGGER_DDL = [
+    """
+    CREATE OR REPLACE FUNCTION public.notify_affiliate_directory() RETURNS trigger AS $$
+    DECLARE
+      payload JSON;
+    BEGIN
+      IF TG_OP = 'DELETE' THEN
+        payload := json_build_object('op', TG_OP, 'id', OLD.id);
+      ELSE
+        payload := json_build_object(
+          'op', TG_OP,
+          'id', NEW.id,
+          'affiliateCode', NEW."affiliateCode",
+          'isTeamLeader', NEW."isTeamLeader",
+          'firstName', NEW."firstName",
+          'lastName', NEW."lastName",
+          'email', NEW.email,
+          'createdAt', NEW."createdAt"
+        );
+      END IF;
+      PERFORM pg_notify('affiliate_directory', payload::TEXT);
+      RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    """,
+    """
+    DROP TRIGGER IF EXISTS users_affiliate_directory_notify ON public.users;
+    """,
+    """
+    CREATE TRIGGER users_affiliate_directory_notify
+      AFTER INSERT OR DELETE OR UPDATE OF "affiliateCode", "isTeamLeader", "firstName", "lastName", email
+      ON public.users
+      FOR EACH ROW EXECUTE FUNCTION public.notify_affiliate_directory();
+    """,
+]
+
+
+class AffiliateMember(NamedTuple):
+    id: str
+    affiliate_code: str
+    first_name: Optional[str]
+    last_name: Optional[str]
+    email: str
+    is_team_leader: bool
+    created_at: datetime
+
+    @property
+    def name(self) -> str:
+        return f"{self.first_name or ''} {self.last_name or ''}".strip()
+
+
+def _rank(member: AffiliateMember):
+    return (not member.is_team_leader, member.created_at, member.id)
+
+
+class AffiliateDirectory:
+    def __init__(self) -> None:
+        self._lock = threading.RLock()
+        self._teams: Dict[str, List[AffiliateMember]] = {}
+        self._code_by_user: Dict[str, str] = {}
+        self._listener: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def load(self) -> "AffiliateDirectory":
+        with transaction() as cursor:
+            cursor.execute(
+                """
+                SELECT id, "affiliateCode", "firstName", "lastName", email, "isTeamLeader", "createdAt"
+                FROM users
+                """
+            )
+            rows = cursor.fetchall()
+
+        teams: Dict[str, List[AffiliateMember]] = {}
+        code_by_user: Dict[str, str] = {}
+        for row in rows:
+            member = AffiliateMember(
+                row["id"],
+                row["affiliateCode"].upper(),
+                row["firstName"],
+                row["lastName"],
+                row["email"],
+                row["isTeamLeader"],
+                row["createdAt"],
+            )
+            teams.setdefault(member.affiliate_code, []).append(member)
+            code_by_user[member.id] = member.affiliate_code
+        for members in teams.values():
+            members.sort(key=_rank)
+
+        with self._lock:
+            self._teams = teams
+            self._code_by_user = code_by_user
+        return self
+
+    def resolve(self, code: str) -> Optional[AffiliateMember]:
+        """The user credited for referrals made with ``code``, or None."""
+        with self._lock:
+            members = self._teams.get(code.strip().upper())
+            return members[0] if members else None
+
+    def team(self, code: str) -> List[AffiliateMember]:
+        with self._lock:
+            return list(self._teams.get(code.strip().upper(), ()))
+
+    def code_for_user(self, user_id: str) -> Optional[str]:
+        """The affiliate code of the team ``user_id`` belongs to."""
+        with self._lock:
+            return self._code_by_user.get(user_id)
+
+    def codes(self) -> List[str]:
+        with self._lock:
+            return sorted(self._teams)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._teams)
+
+    def apply(self, change: dict) -> None:
+        """Apply one notification payload from the users trigger."""
+        with self._lock:
+            user_id = change["id"]
+            old_code = self._code_by_user.pop(user_id, None)
+            if old_code is not None:
+                remaining = [m for m in self._teams.get(old_code, ()) if m.id != user_id]
+                if remaining:
+                    self._teams[old_code] = remaining
+                else:
+                    self._teams.pop(old_code, None)
+            if change["op"] == "DELETE":
+                return
+
+            member = AffiliateMember(
+                user_id,
+                change["affiliateCode"].upper(),
+                change["firstName"],
+                change["lastName"],
+                change["email"],
+                change["isTeamLeader"],
+                datetime.fromisoformat(change["createdAt"]),
+            )
+            members = self._teams.setdefault(member.affiliate_code, [])
+            members.append(member)
+            members.sort(key=_rank)
+            self._code_by_user[user_id] = member.affiliate_code
+
+    def start_listener(self, poll_seconds: float = 5.0) -> None:
+        """LISTEN for users changes on a dedicated connection in a daemon thread."""
+        if self._listener is not None:
+            return
+        conn = psycopg2.connect(get_database_url())
+        conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+        with conn.cursor() as cursor:
+            cursor.execute(f"LISTEN {CHANNEL};")
+        # Changes committed between load() and LISTEN would otherwise be missed
+        self.load()
+
+        def listen() -> None:
+            try:
+                while not self._stop.is_set():
+                    if select.select([conn], [], [], poll_seconds) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        notify = conn.notifies.pop(0)
+                        self.apply(json.loads(notify.payload))
+            finally:
+                conn.close()
+
+        self._listener = threading.Thread(target=listen, name="affiliate-directory", daemon=True)
+        self._listener.start()
+
+    def stop_listener(self) -> None:
+        self._stop.set()
+
+
+_directory: Optional[AffiliateDirectory] = None
+_directory_lock = threading.Lock()
+
+
+def get_directory(listen: bool = True) -> AffiliateDirectory:
+    """Process-wide directory, loaded on first use and optionally kept fresh."""
+    global _directory
+    with _directory_lock:
+        if _directory is None:
+            _directory = AffiliateDirectory()
+            if listen:
+                _directory.start_listener()
+            else:
+                _directory.load()
+        return _directory
+
+
+def install_trigger() -> None:
+    with transaction() as cursor:
+        for statement in NOTIFY_TRIGGER_DDL:
+            cursor.execute(statement)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Affiliate code directory")
+    parser.add_argument("--install-trigger", action="store_true", help="Create the users NOTIFY trigger")
+    args = parser.parse_args()
+
+    if args.install_trigger:
+        install_trigger()
+        print("SUCCESS: users NOTIFY trigger installed.")
+        return 0
+
+    directory = get_directory(listen=False)
+    print(f"=== {len(directory)} affiliate codes ===")
+    for code in directory.codes():
+        team = directory.team(code)
+        leader = team[0]
+        print(f"{code:10s} leader={leader.name} ({leader.email}) members={len(team)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
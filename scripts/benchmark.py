@@ -0,0 +1,292 @@
+"""Benchmark the ops scripts' query and write paths.
+
+Each case runs in a forked child process so its peak RSS is its own, with
+stdout discarded. For every case the report records wall time, rows
+processed, rows/sec, peak RSS and the server round trips counted by
+``db.stats``. Results are written as JSON, tagged with the git revision,
+so runs against different versions can be compared with ``--compare``.
+
+Load data first with synthetic_data.py; write-path cases roll back or
+clean up after themselves. Like synthetic_data.py, it refuses to run against
+a non-local database unless --allow-remote is given, since the ingest case
+commits synthetic uploads.
+
+Usage:
+    python scripts/synthetic_data.py --scale 1000000
+    python scripts/benchmark.py --output bench-1m.json
+    python scripts/benchmark.py --cases missing_stream,reconcile --compare bench-1m.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import contextlib
+import csv
+import json
+import multiprocessing
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+import db
+import synthetic_data
+from db import close_pool, transaction
+
+BULK_PAIRS = 1000
+LOOKUP_NAMES = 1000
+INGEST_ROWS = 20_000
+INGEST_REPORT_DATE = datetime(2099, 1, 1)
+
+
+class Case(NamedTuple):
+    name: str
+    description: str
+    setup: Callable[[], dict]
+    run: Callable[..., int]
+
+
+def _count(query: str) -> int:
+    with transaction() as cursor:
+        cursor.execute(query)
+        return cursor.fetchone()["count"]
+
+
+def _no_setup() -> dict:
+    return {}
+
+
+def _missing_fetchall() -> int:
+    from check_missing_referrals import get_reservations_without_referrer
+    return len(get_reservations_without_referrer())
+
+
+def _missing_stream() -> int:
+    from check_missing_referrals import stream_reservations_without_referrer
+    return sum(1 for _ in stream_reservations_without_referrer())
+
+
+def _reservations_setup() -> dict:
+    return {"rows": _count("SELECT COUNT(*) FROM reservations")}
+
+
+def _verify_all_stream(rows: int) -> int:
+    from verify_all_referrals import verify_all
+    verify_all(limit=0, use_stream=True)
+    return rows
+
+
+def _users_setup() -> dict:
+    return {"rows": _count("SELECT COUNT(*) FROM users")}
+
+
+def _reconcile(rows: int) -> int:
+    from reconcile_commissions import find_discrepancies
+    find_discrepancies()
+    return rows
+
+
+def _suggest(rows: int) -> int:
+    from suggest_referrers import suggest
+    suggest()
+    return rows
+
+
+def _commission_audit() -> int:
+    from commission import audit
+    return audit()[0]
+
+
+def _bulk_setup() -> dict:
+    with transaction() as cursor:
+        cursor.execute(
+            'SELECT "patientName" FROM reservations WHERE "referrerId" IS NULL ORDER BY id LIMIT %s',
+            (BULK_PAIRS,),
+        )
+        return {"pairs": [(row["patientName"], "DRJJ9") for row in cursor.fetchall()]}
+
+
+def _bulk_dry_run(pairs) -> int:
+    from add_specific_referrals import bulk_add_referrers
+    return len(bulk_add_referrers(pairs, dry_run=True))
+
+
+def _lookup_setup() -> dict:
+    with transaction() as cursor:
+        cursor.execute('SELECT "patientName" FROM reservations ORDER BY id LIMIT %s', (LOOKUP_NAMES,))
+        return {"names": [row["patientName"] for row in cursor.fetchall()]}
+
+
+def _lookup_latest(names) -> int:
+    import patient_lookup
+    with transaction() as cursor:
+        patient_lookup.latest(cursor, names)
+    return len(names)
+
+
+def _ingest_setup() -> dict:
+    handle = tempfile.NamedTemporaryFile("w", suffix=".csv", delete=False, newline="", encoding="utf-8")
+    with handle:
+        writer = csv.writer(handle)
+        writer.writerow(["Nomor Invoice", "Nama Pasien", "Tanggal Kunjungan", "Total Pendapatan", "Keuntungan"])
+        for i in range(INGEST_ROWS):
+            writer.writerow([f"BENCH-{i}", f"Pasien {i % 997}", "01/01/2099", 150000 + i % 10 * 1000, 45000])
+    return {"path": handle.name}
+
+
+def _ingest(path) -> int:
+    from ingest_daily_spending import ingest_file
+    try:
+        return ingest_file(path, report_date=INGEST_REPORT_DATE)["rows"]
+    finally:
+        os.unlink(path)
+        with transaction() as cursor:
+            cursor.execute('DELETE FROM daily_spending_uploads WHERE "reportDate" = %s', (INGEST_REPORT_DATE,))
+
+
+CASES: List[Case] = [
+    Case("missing_fetchall", "check_missing_referrals: fetchall of open reservations", _no_setup, _missing_fetchall),
+    Case("missing_stream", "check_missing_referrals --stream", _no_setup, _missing_stream),
+    Case("verify_all_stream", "verify_all_referrals --stream --limit 0", _reservations_setup, _verify_all_stream),
+    Case("reconcile", "reconcile_commissions scan (4 ranges)", _users_setup, _reconcile),
+    Case("suggest", "suggest_referrers scoring pass", _reservations_setup, _suggest),
+    Case("commission_audit", "commission --audit: reprice referred reservations", _no_setup, _commission_audit),
+    Case("bulk_dry_run", f"add_specific_referrals bulk, {BULK_PAIRS} pairs, rolled back", _bulk_setup, _bulk_dry_run),
+    Case("lookup_latest", f"patient_lookup.latest for {LOOKUP_NAMES} names", _lookup_setup, _lookup_latest),
+    Case("ingest", f"ingest_daily_spending, {INGEST_ROWS} CSV rows", _ingest_setup, _ingest),
+]
+
+
+def _peak_rss_kb() -> int:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _run_child(case: Case, queue) -> None:
+    try:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            args = case.setup()
+            rss_before = _peak_rss_kb()
+            db.stats.reset()
+            started = time.perf_counter()
+            rows = case.run(**args)
+            wall = time.perf_counter() - started
+            counts = db.stats.snapshot()
+        queue.put({
+            "name": case.name,
+            "description": case.description,
+            "wall_seconds": round(wall, 4),
+            "rows": rows,
+            "rows_per_sec": round(rows / wall, 1) if wall > 0 else None,
+            "peak_rss_kb": _peak_rss_kb(),
+            "peak_rss_delta_kb": _peak_rss_kb() - rss_before,
+            "round_trips": counts["round_trips"],
+            "statements": counts.get("statements", 0),
+            "fetches": counts.get("fetches", 0),
+        })
+    except BaseException as exc:
+        queue.put({"name": case.name, "error": f"{type(exc).__name__}: {exc}"})
+        raise
+
+
+def run_case(case: Case) -> dict:
+    # Children must not inherit pooled connections
+    close_pool()
+    context = multiprocessing.get_context("fork")
+    queue = context.Queue()
+    process = context.Process(target=_run_child, args=(case, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment() -> Dict[str, object]:
+    with transaction() as cursor:
+        cursor.execute(
+            """
+            SELECT current_setting('server_version') AS server_version,
+                   (SELECT COUNT(*) FROM users) AS users,
+                   (SELECT COUNT(*) FROM reservations) AS reservations,
+                   (SELECT COUNT(*) FROM transactions) AS transactions,
+                   (SELECT COUNT(*) FROM daily_spending_entries) AS daily_spending_entries
+            """
+        )
+        return dict(cursor.fetchone())
+
+
+def compare(results: List[dict], baseline_path: str) -> None:
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {case["name"]: case for case in json.load(f)["cases"]}
+    print(f"{'CASE':20s} {'WALL':>10s} {'BASE':>10s} {'RATIO':>7s} {'TRIPS':>8s} {'BASE':>8s}", file=sys.stderr)
+    for case in results:
+        base = baseline.get(case["name"])
+        if not base or "error" in case or "error" in base:
+            continue
+        ratio = case["wall_seconds"] / base["wall_seconds"] if base["wall_seconds"] else float("nan")
+        print(
+            f"{case['name']:20s} {case['wall_seconds']:>10.3f} {base['wall_seconds']:>10.3f} {ratio:>6.2f}x "
+            f"{case['round_trips']:>8d} {base['round_trips']:>8d}",
+            file=sys.stderr,
+        )
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark ops script query and write paths")
+    parser.add_argument("--cases", help=f"Comma-separated subset of: {', '.join(case.name for case in CASES)}")
+    parser.add_argument("--output", default="benchmark.json", help="JSON report path (default benchmark.json)")
+    parser.add_argument("--compare", metavar="BASELINE", help="Print wall time/round trip ratios vs an earlier report")
+    parser.add_argument("--allow-remote", action="store_true", help="Allow a non-local DATABASE_URL")
+    args = parser.parse_args()
+
+    synthetic_data.require_local(args.allow_remote)
+
+    selected = CASES
+    if args.cases:
+        wanted = set(args.cases.split(","))
+        unknown = wanted - {case.name for case in CASES}
+        if unknown:
+            parser.error(f"unknown cases: {', '.join(sorted(unknown))}")
+        selected = [case for case in CASES if case.name in wanted]
+
+    report = {
+        "revision": git_revision(),
+        "started": datetime.now().isoformat(timespec="seconds"),
+        "environment": environment(),
+        "cases": [],
+    }
+    for case in selected:
+        result = run_case(case)
+        report["cases"].append(result)
+        if "error" in result:
+            print(f"{case.name:20s} ERROR {result['error']}", file=sys.stderr)
+        else:
+            print(
+                f"{case.name:20s} {result['wall_seconds']:>9.3f}s rows={result['rows']} "
+                f"rows/s={result['rows_per_sec']} rss={result['peak_rss_kb']}KB trips={result['round_trips']}",
+                file=sys.stderr,
+            )
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, default=str)
+    if args.compare:
+        compare(report["cases"], args.compare)
+    print(f"report={args.output}")
+    return 1 if any("error" in case for case in report["cases"]) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
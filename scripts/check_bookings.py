@@ -1,60 +1,58 @@
 """
 Check who booked the reservations
-"""
-import os
-import psycopg2
-from psycopg2.extras import RealDictCursor
-from dotenv import load_dotenv
 
-load_dotenv()
+Usage:
+    python scripts/check_bookings.py                       # built-in list
+    python scripts/check_bookings.py "wildan arif" FIKA    # names as arguments
+    python scripts/check_bookings.py --file patients.txt   # one name per line (or CSV/JSON)
+"""
+import argparse
 
-def connect_db():
-    database_url = os.getenv('DATABASE_URL')
-    conn = psycopg2.connect(database_url)
-    return conn
+import patient_lookup
+from add_specific_referrals import DEFAULT_PATIENTS, load_patient_names
+from db import transaction
 
-def check_bookings():
-    conn = connect_db()
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
-    
-    patients = ["wildan arif", "Ajeng Disna Wiherdaning", "FIKA"]
+def check_bookings(patients=None):
+    patients = patients or DEFAULT_PATIENTS
     
     print("="*80)
     print("CHECKING WHO BOOKED THESE RESERVATIONS")
     print("="*80 + "\n")
     
-    for patient in patients:
-        cursor.execute(
-            '''
-            SELECT 
-                r."patientName",
-                r.status,
-                u.id as user_id,
-                u."firstName" as user_first,
-                u."lastName" as user_last,
-                u.email as user_email,
-                u."affiliateCode" as user_code
-            FROM reservations r
-            JOIN users u ON r."userId" = u.id
-            WHERE LOWER(r."patientName") = LOWER(%s)
-            AND r."referrerId" IS NULL
-            ORDER BY r."createdAt" DESC
-            LIMIT 1
+    with transaction() as cursor:
+        found = patient_lookup.latest(
+            cursor,
+            patients,
+            columns='''
+            r."patientName",
+            r.status,
+            u.id as user_id,
+            u."firstName" as user_first,
+            u."lastName" as user_last,
+            u.email as user_email,
+            u."affiliateCode" as user_code
             ''',
-            (patient,)
+            join='JOIN users u ON r."userId" = u.id',
+            where='AND r."referrerId" IS NULL',
         )
-        
-        result = cursor.fetchone()
-        
+    
+    for patient in patients:
+        result = found.get(patient_lookup.normalize(patient))
+    
         if result:
             print(f"📋 {result['patientName']} ({result['status']})")
             print(f"   Booked by: {result['user_first']} {result['user_last']}")
             print(f"   Email: {result['user_email']}")
             print(f"   Their affiliate code: {result['user_code']}")
             print()
-    
-    cursor.close()
-    conn.close()
 
 if __name__ == "__main__":
-    check_bookings()
+    parser = argparse.ArgumentParser(description="Show who booked the latest unreferred reservation per patient")
+    parser.add_argument('patients', nargs='*', help="Patient names")
+    parser.add_argument('--file', help="File of patient names (txt, CSV patient_name column or JSON)")
+    args = parser.parse_args()
+    
+    names = list(args.patients)
+    if args.file:
+        names.extend(load_patient_names(args.file))
+    check_bookings(names)
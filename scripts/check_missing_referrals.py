@@ -1,30 +1,30 @@
 """
 Script to check and update missing referrals in reservations
+
+Usage:
+    python scripts/check_missing_referrals.py            # list + interactive console
+    python scripts/check_missing_referrals.py --stream   # streamed report, flat memory
+    python scripts/check_missing_referrals.py --incremental [--rebuild]
+                                                         # only rows changed since last run
 """
-import os
-import psycopg2
-from psycopg2.extras import RealDictCursor
-from datetime import datetime
-from dotenv import load_dotenv
+import argparse
+import bisect
+import re
+from datetime import datetime, timedelta
 
-# Load environment variables
-load_dotenv()
+import checkpoints
+import earnings_ledger
+from affiliate_directory import get_directory
+from commission import commission_for
+from db import DEFAULT_ITERSIZE, stream, transaction
+from ids import cuid
 
-def connect_db():
-    """Connect to PostgreSQL database"""
-    database_url = os.getenv('DATABASE_URL')
-    if not database_url:
-        raise ValueError("DATABASE_URL not found in environment variables")
-    
-    conn = psycopg2.connect(database_url)
-    return conn
+CHECKPOINT_NAME = 'check_missing_referrals'
+# Rescanned behind the checkpoint on each incremental run; longer than any
+# transaction that writes reservations
+CHECKPOINT_OVERLAP = timedelta(minutes=5)
 
-def get_reservations_without_referrer():
-    """Get all reservations that don't have a referrer"""
-    conn = connect_db()
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
-    
-    query = """
+RESERVATIONS_WITHOUT_REFERRER_SELECT = """
         SELECT 
             r.id,
             r."patientName",
@@ -37,6 +37,7 @@ def get_reservations_without_referrer():
             r."referredBy",
             r."referrerId",
             r."createdAt",
+            r."updatedAt",
             t.name as treatment_name,
             u."firstName" as user_first_name,
             u."lastName" as user_last_name,
@@ -45,155 +46,301 @@ def get_reservations_without_referrer():
         JOIN treatments t ON r."treatmentId" = t.id
         JOIN users u ON r."userId" = u.id
         WHERE r."referrerId" IS NULL
+    """
+
+RESERVATIONS_WITHOUT_REFERRER_QUERY = RESERVATIONS_WITHOUT_REFERRER_SELECT + """
         ORDER BY r."createdAt" DESC
     """
-    
-    cursor.execute(query)
-    results = cursor.fetchall()
-    
-    cursor.close()
-    conn.close()
-    
-    return results
 
-def get_all_affiliate_codes():
-    """Get all valid affiliate codes from users"""
-    conn = connect_db()
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
-    
-    query = """
-        SELECT 
-            id,
-            "affiliateCode",
-            "firstName",
-            "lastName",
-            email
-        FROM users
-        ORDER BY "affiliateCode"
+# Keyset scan over rows created or updated after the stored checkpoint
+RESERVATIONS_SINCE_CHECKPOINT_QUERY = RESERVATIONS_WITHOUT_REFERRER_SELECT + """
+        AND (r."updatedAt", r.id) > (%s, %s)
+        ORDER BY r."updatedAt", r.id
     """
-    
-    cursor.execute(query)
-    results = cursor.fetchall()
-    
-    cursor.close()
-    conn.close()
-    
-    return results
+
+def get_reservations_without_referrer():
+    """Get all reservations that don't have a referrer"""
+    with transaction() as cursor:
+        cursor.execute(RESERVATIONS_WITHOUT_REFERRER_QUERY)
+        return cursor.fetchall()
+
+def stream_reservations_without_referrer(itersize=DEFAULT_ITERSIZE):
+    """Stream reservations without referrer through a server-side cursor"""
+    return stream(RESERVATIONS_WITHOUT_REFERRER_QUERY, itersize=itersize)
+
+def get_all_affiliate_codes():
+    """Get all valid affiliate codes with the team leader credited for each"""
+    directory = get_directory()
+    return [directory.resolve(code) for code in directory.codes()]
 
 def add_referrer_to_reservation(reservation_id, affiliate_code):
     """Add referrer to a specific reservation"""
-    conn = connect_db()
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
-    
     try:
-        # Get referrer by affiliate code
-        cursor.execute(
-            'SELECT id FROM users WHERE "affiliateCode" = %s',
-            (affiliate_code.upper(),)
-        )
-        referrer = cursor.fetchone()
-        
-        if not referrer:
-            print(f"❌ Affiliate code {affiliate_code} not found")
-            return False
+        with transaction() as cursor:
+            # Resolve affiliate code to its team leader (no round trip)
+            referrer = get_directory().resolve(affiliate_code)
         
-        referrer_id = referrer['id']
+            if not referrer:
+                print(f"❌ Affiliate code {affiliate_code} not found")
+                return False
         
-        # Get reservation to calculate commission
-        cursor.execute(
-            'SELECT "finalPrice", status, "userId" FROM reservations WHERE id = %s',
-            (reservation_id,)
-        )
-        reservation = cursor.fetchone()
+            referrer_id = referrer.id
         
-        if not reservation:
-            print(f"❌ Reservation {reservation_id} not found")
-            return False
+            # Get reservation to calculate commission
+            cursor.execute(
+                '''
+                SELECT r."finalPrice", r.status, r."userId", t."categoryId", r."reservationDate"
+                FROM reservations r
+                JOIN treatments t ON t.id = r."treatmentId"
+                WHERE r.id = %s
+                ''',
+                (reservation_id,)
+            )
+            reservation = cursor.fetchone()
         
-        # Check if user trying to use their own code
-        if reservation['userId'] == referrer_id:
-            print(f"❌ Cannot use own affiliate code")
-            return False
+            if not reservation:
+                print(f"❌ Reservation {reservation_id} not found")
+                return False
         
-        # Calculate commission
-        commission_rate = 0.10
-        commission_amount = float(reservation['finalPrice']) * commission_rate
+            # Check if user trying to use their own code
+            if reservation['userId'] == referrer_id:
+                print(f"❌ Cannot use own affiliate code")
+                return False
         
-        # Update reservation
-        cursor.execute(
-            '''
-            UPDATE reservations 
-            SET "referredBy" = %s, 
-                "referrerId" = %s,
-                "commissionAmount" = %s
-            WHERE id = %s
-            ''',
-            (affiliate_code.upper(), referrer_id, commission_amount, reservation_id)
-        )
+            # Calculate commission
+            commission = commission_for(
+                reservation['finalPrice'], referrer_id, reservation['categoryId'], reservation['reservationDate']
+            )
+            commission_amount = commission.amount
         
-        # If reservation is completed, pay commission immediately
-        if reservation['status'] == 'completed':
-            # Update referrer earnings
+            # Update reservation
             cursor.execute(
                 '''
-                UPDATE users 
-                SET "totalEarnings" = "totalEarnings" + %s,
-                    "totalReferrals" = "totalReferrals" + 1,
-                    points = points + %s
+                UPDATE reservations 
+                SET "referredBy" = %s, 
+                    "referrerId" = %s,
+                    "commissionAmount" = %s,
+                    "updatedAt" = CURRENT_TIMESTAMP
                 WHERE id = %s
                 ''',
-                (commission_amount, int(commission_amount / 100), referrer_id)
+                (affiliate_code.upper(), referrer_id, commission_amount, reservation_id)
             )
+        
+            # If reservation is completed, pay commission immediately
+            if reservation['status'] == 'completed':
+                # Queue referrer earnings (folded into users by earnings_ledger)
+                transaction_id = cuid()
+                earnings_ledger.append_one(cursor, referrer_id, commission_amount, 1, commission.points, transaction_id)
             
-            # Get reservation patient name for transaction
-            cursor.execute(
-                'SELECT "patientName" FROM reservations WHERE id = %s',
-                (reservation_id,)
-            )
-            patient = cursor.fetchone()
+                # Get reservation patient name for transaction
+                cursor.execute(
+                    'SELECT "patientName" FROM reservations WHERE id = %s',
+                    (reservation_id,)
+                )
+                patient = cursor.fetchone()
             
-            # Create transaction
-            cursor.execute(
-                '''
-                INSERT INTO transactions 
-                    ("userId", type, amount, points, description, "referenceId", "createdAt")
-                VALUES (%s, %s, %s, %s, %s, %s, NOW())
-                ''',
-                (
-                    referrer_id, 
-                    'commission', 
-                    commission_amount,
-                    int(commission_amount / 100),
-                    f"Commission from referral: {patient['patientName']}",
-                    reservation_id
+                # Create transaction
+                cursor.execute(
+                    '''
+                    INSERT INTO transactions 
+                        (id, "userId", type, amount, points, description, "referenceId", "createdAt")
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, NOW())
+                    ''',
+                    (
+                        transaction_id,
+                        referrer_id, 
+                        'commission', 
+                        commission_amount,
+                        commission.points,
+                        f"Commission from referral: {patient['patientName']}",
+                        reservation_id
+                    )
                 )
-            )
             
-            # Mark commission as paid
-            cursor.execute(
-                'UPDATE reservations SET "commissionPaid" = true WHERE id = %s',
-                (reservation_id,)
-            )
+                # Mark commission as paid
+                cursor.execute(
+                    'UPDATE reservations SET "commissionPaid" = true, "updatedAt" = CURRENT_TIMESTAMP WHERE id = %s',
+                    (reservation_id,)
+                )
             
-            print(f"✅ Commission paid: Rp {commission_amount:,.0f}")
+                print(f"✅ Commission paid: Rp {commission_amount:,.0f}")
         
-        conn.commit()
         print(f"✅ Referrer added successfully!")
         return True
         
     except Exception as e:
-        conn.rollback()
         print(f"❌ Error: {e}")
         return False
-    finally:
-        cursor.close()
-        conn.close()
+
+def phone_key(phone):
+    """Digits-only phone number, with the +62 country code folded to 0"""
+    digits = re.sub(r'\D', '', phone or '')
+    # 08xx and +628xx are the same number
+    if digits.startswith('62'):
+        digits = '0' + digits[2:]
+    return digits
+
+class ReservationIndex:
+    """In-memory lookup over open reservations for the interactive console.
+    
+    Reservation IDs are kept in a sorted list so an ID prefix resolves with
+    bisect; patient names and phone numbers map to reservation IDs. Attributed
+    reservations are removed in place instead of re-running the query.
+    """
+    
+    def __init__(self, reservations):
+        self._by_id = {}
+        self._by_name = {}
+        self._by_phone = {}
+        for res in reservations:
+            self._by_id[res['id']] = res
+            self._by_name.setdefault(self._name_key(res['patientName']), set()).add(res['id'])
+            phone = self._phone_key(res['patientPhone'])
+            if phone:
+                self._by_phone.setdefault(phone, set()).add(res['id'])
+        self._ids = sorted(self._by_id)
+    
+    @staticmethod
+    def _name_key(name):
+        return ' '.join((name or '').lower().split())
+    
+    @staticmethod
+    def _phone_key(phone):
+        return phone_key(phone)
+    
+    def __len__(self):
+        return len(self._ids)
+    
+    def by_prefix(self, prefix, limit=None):
+        """Reservations whose ID starts with prefix, in ID order"""
+        matches = []
+        i = bisect.bisect_left(self._ids, prefix)
+        while i < len(self._ids) and self._ids[i].startswith(prefix):
+            matches.append(self._by_id[self._ids[i]])
+            if limit and len(matches) >= limit:
+                break
+            i += 1
+        return matches
+    
+    def by_patient(self, query):
+        """Reservations for an exact patient name or phone number"""
+        ids = self._by_name.get(self._name_key(query), set())
+        phone = self._phone_key(query)
+        if phone:
+            ids = ids | self._by_phone.get(phone, set())
+        return [self._by_id[res_id] for res_id in sorted(ids)]
+    
+    def find(self, query, limit=6):
+        """Resolve console input: ID prefix first, then patient name/phone"""
+        if not query:
+            return []
+        return self.by_prefix(query, limit) or self.by_patient(query)[:limit]
+    
+    def remove(self, reservation_id):
+        res = self._by_id.pop(reservation_id, None)
+        if res is None:
+            return
+        i = bisect.bisect_left(self._ids, reservation_id)
+        del self._ids[i]
+        self._discard(self._by_name, self._name_key(res['patientName']), reservation_id)
+        self._discard(self._by_phone, self._phone_key(res['patientPhone']), reservation_id)
+    
+    @staticmethod
+    def _discard(mapping, key, reservation_id):
+        ids = mapping.get(key)
+        if ids is not None:
+            ids.discard(reservation_id)
+            if not ids:
+                del mapping[key]
+
+def print_reservation(i, res):
+    print(f"{i}. ID: {res['id'][:8]}...")
+    print(f"   Patient: {res['patientName']}")
+    print(f"   Email: {res['patientEmail']}")
+    print(f"   Phone: {res['patientPhone']}")
+    print(f"   Treatment: {res['treatment_name']}")
+    print(f"   Status: {res['status']}")
+    print(f"   Date: {res['reservationDate']} {res['reservationTime']}")
+    print(f"   Price: Rp {float(res['finalPrice']):,.0f}")
+    print(f"   Booked by: {res['user_first_name']} {res['user_last_name']} ({res['user_email']})")
+    print(f"   Created: {res['createdAt']}")
+    print()
+
+def stream_report(itersize):
+    """Print reservations without referrer as they arrive, without holding them"""
+    count = 0
+    for count, res in enumerate(stream_reservations_without_referrer(itersize), 1):
+        print_reservation(count, res)
+    
+    if count:
+        print(f"📋 Found {count} reservations without referrer")
+    else:
+        print("\n✅ All reservations have referrers!")
+
+def incremental_report(itersize, rebuild=False):
+    """Print reservations without referrer changed since the last checkpoint
+
+    Keyed on ("updatedAt", id): Prisma's @updatedAt only applies through the
+    client, so raw-SQL writes to reservations must set "updatedAt" themselves
+    or they are never picked up again. "updatedAt" is the writer's
+    transaction start, so a row can commit after a later checkpoint was
+    saved; each run rescans CHECKPOINT_OVERLAP behind the checkpoint to catch
+    those, and rows changed in that window may be reported twice.
+    """
+    with transaction() as cursor:
+        checkpoints.ensure_table(cursor)
+        since = checkpoints.START if rebuild else checkpoints.load(cursor, CHECKPOINT_NAME)
+    
+    if since == checkpoints.START:
+        print("🔖 No checkpoint, scanning from the beginning\n")
+    else:
+        print(f"🔖 Checkpoint: {since.timestamp} ({since.last_id[:8]}...)\n")
+    
+    last_seen = since
+    count = 0
+    start = since
+    if since != checkpoints.START:
+        start = checkpoints.Checkpoint(since.timestamp - CHECKPOINT_OVERLAP, '')
+    rows = stream(RESERVATIONS_SINCE_CHECKPOINT_QUERY, (start.timestamp, start.last_id), itersize=itersize)
+    for count, res in enumerate(rows, 1):
+        print_reservation(count, res)
+        last_seen = max(last_seen, checkpoints.Checkpoint(res['updatedAt'], res['id']))
+    
+    # Only advance once the whole range has been reported
+    with transaction() as cursor:
+        checkpoints.save(cursor, CHECKPOINT_NAME, last_seen)
+    
+    if count:
+        print(f"📋 Found {count} new reservations without referrer since checkpoint (incl. overlap)")
+    else:
+        print("✅ No new reservations without referrer since checkpoint")
 
 def main():
+    parser = argparse.ArgumentParser(description="Check and update missing referrals")
+    parser.add_argument('--stream', action='store_true',
+                        help="Stream the report with a server-side cursor (no interactive console)")
+    parser.add_argument('--itersize', type=int, default=DEFAULT_ITERSIZE,
+                        help=f"Rows fetched per round trip in stream mode (default {DEFAULT_ITERSIZE})")
+    parser.add_argument('--incremental', action='store_true',
+                        help="Only report reservations created/updated since the last checkpoint")
+    parser.add_argument('--rebuild', action='store_true',
+                        help="With --incremental: ignore the checkpoint and rescan from scratch")
+    args = parser.parse_args()
+    
     print("=" * 80)
     print("CHECKING RESERVATIONS WITHOUT REFERRER")
     print("=" * 80)
     
+    if args.incremental:
+        print()
+        incremental_report(args.itersize, rebuild=args.rebuild)
+        return
+    
+    if args.stream:
+        print()
+        stream_report(args.itersize)
+        return
+    
     # Get reservations without referrer
     reservations = get_reservations_without_referrer()
     
@@ -204,17 +351,7 @@ def main():
     print(f"\n📋 Found {len(reservations)} reservations without referrer:\n")
     
     for i, res in enumerate(reservations, 1):
-        print(f"{i}. ID: {res['id'][:8]}...")
-        print(f"   Patient: {res['patientName']}")
-        print(f"   Email: {res['patientEmail']}")
-        print(f"   Phone: {res['patientPhone']}")
-        print(f"   Treatment: {res['treatment_name']}")
-        print(f"   Status: {res['status']}")
-        print(f"   Date: {res['reservationDate']} {res['reservationTime']}")
-        print(f"   Price: Rp {float(res['finalPrice']):,.0f}")
-        print(f"   Booked by: {res['user_first_name']} {res['user_last_name']} ({res['user_email']})")
-        print(f"   Created: {res['createdAt']}")
-        print()
+        print_reservation(i, res)
     
     print("\n" + "=" * 80)
     print("AVAILABLE AFFILIATE CODES")
@@ -224,12 +361,14 @@ def main():
     print(f"\n📋 {len(affiliates)} affiliate codes available:\n")
     
     for aff in affiliates:
-        print(f"  {aff['affiliateCode']:10s} - {aff['firstName']} {aff['lastName']} ({aff['email']})")
+        print(f"  {aff.affiliate_code:10s} - {aff.name} ({aff.email})")
     
     print("\n" + "=" * 80)
     print("ADD REFERRER TO RESERVATIONS")
     print("=" * 80)
     
+    index = ReservationIndex(reservations)
+    
     while True:
         print("\nOptions:")
         print("1. Add referrer to specific reservation")
@@ -241,17 +380,19 @@ def main():
             print("\n👋 Bye!")
             break
         elif choice == '1':
-            res_id = input("Enter reservation ID (or first 8 chars): ").strip()
+            query = input("Enter reservation ID (or first 8 chars), patient name or phone: ").strip()
             
             # Find matching reservation
-            matching = [r for r in reservations if r['id'].startswith(res_id)]
+            matching = index.find(query)
             
             if not matching:
                 print("❌ Reservation not found")
                 continue
             
             if len(matching) > 1:
-                print("⚠️ Multiple matches found, please be more specific")
+                print("⚠️ Multiple matches found, please be more specific:")
+                for r in matching:
+                    print(f"   {r['id'][:12]}  {r['patientName']} ({r['patientPhone']}) - {r['treatment_name']}")
                 continue
             
             reservation = matching[0]
@@ -266,9 +407,8 @@ def main():
             if confirm == 'y':
                 success = add_referrer_to_reservation(reservation['id'], affiliate_code)
                 if success:
-                    # Refresh data
-                    reservations = get_reservations_without_referrer()
-                    if not reservations:
+                    index.remove(reservation['id'])
+                    if not index:
                         print("\n✅ All reservations now have referrers!")
                         break
         else:
@@ -0,0 +1,58 @@
+"""Persistent (timestamp, id) watermarks for incremental script runs.
+
+Checkpoints live in a small ``script_checkpoints`` table keyed by a name
+chosen by each script, so a later run can resume with a keyset predicate
+such as ``("updatedAt", id) > (%s, %s)`` instead of rescanning history.
+"""
+
+from __future__ import annotations
+
+from datetime import datetime
+from typing import NamedTuple
+
+CHECKPOINTS_DDL = """
+CREATE TABLE IF NOT EXISTS public.script_checkpoints (
+  name TEXT PRIMARY KEY,
+  "lastTimestamp" TIMESTAMP(3) NOT NULL,
+  "lastId" TEXT NOT NULL,
+  "updatedAt" TIMESTAMP(3) NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+"""
+
+
+class Checkpoint(NamedTuple):
+    timestamp: datetime
+    last_id: str
+
+
+# Sorts before every real (timestamp, id) pair
+START = Checkpoint(datetime.min, "")
+
+
+def ensure_table(cursor) -> None:
+    cursor.execute(CHECKPOINTS_DDL)
+
+
+def load(cursor, name: str) -> Checkpoint:
+    """Return the stored checkpoint for ``name``, or START if there is none."""
+    with cursor.connection.cursor() as plain:
+        plain.execute(
+            'SELECT "lastTimestamp", "lastId" FROM public.script_checkpoints WHERE name = %s',
+            (name,),
+        )
+        row = plain.fetchone()
+    return Checkpoint(*row) if row else START
+
+
+def save(cursor, name: str, checkpoint: Checkpoint) -> None:
+    cursor.execute(
+        """
+        INSERT INTO public.script_checkpoints (name, "lastTimestamp", "lastId", "updatedAt")
+        VALUES (%s, %s, %s, CURRENT_TIMESTAMP)
+        ON CONFLICT (name) DO UPDATE
+        SET "lastTimestamp" = EXCLUDED."lastTimestamp",
+            "lastId" = EXCLUDED."lastId",
+            "updatedAt" = EXCLUDED."updatedAt"
+        """,
+        (name, checkpoint.timestamp, checkpoint.last_id),
+    )
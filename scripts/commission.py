@@ -0,0 +1,385 @@
+"""Affiliate commission and points in integer cents.
+
+Amounts are integer cents (``Decimal(10,2)`` * 100) and rates are basis
+points, so every result is exact and matches what Postgres stores:
+
+- commission = price * rate, rounded half up to the cent (as
+  ``calculateCommission`` in src/lib/affiliate.ts)
+- points     = one per full Rp 100 of commission
+
+``commission_for()`` prices one reservation; ``compute_batch()`` prices
+whole arrays at once, with NumPy int64 arrays when NumPy is installed and
+the same integer arithmetic in plain Python otherwise, so bulk paths and
+the single-row path cannot disagree.
+
+Rates default to 10%. ``COMMISSION_RATES`` may point at a JSON rate table
+that overrides it per team leader, treatment category and/or date range::
+
+    {
+      "default_rate": "0.10",
+      "rules": [
+        {"code": "DRJJ9", "rate": "0.12"},
+        {"category": "<treatment category id>", "rate": "0.08"},
+        {"code": "DRJJ9", "from": "2026-11-01", "until": "2027-01-01", "rate": "0.15"}
+      ]
+    }
+
+The most specific matching rule wins (leader, category and date range each
+count once); among equally specific rules the later one wins. ``code`` is
+resolved to its team leader through the affiliate directory; ``leader``
+takes a user id directly. ``until`` is exclusive.
+
+Usage:
+    python scripts/commission.py --audit             # stored commissionAmount vs the rate table
+    python scripts/commission.py --audit --apply     # rewrite unpaid commissionAmount values
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import date, datetime
+from decimal import ROUND_HALF_UP, Decimal
+from typing import List, NamedTuple, Optional, Sequence, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - NumPy is optional
+    np = None
+
+DEFAULT_RATE_BP = 1000
+BP_SCALE = 10_000
+POINT_CENTS = 10_000  # Rp 100
+EPOCH = date(1970, 1, 1)
+AUDIT_CHUNK = 200_000
+
+
+def to_cents(amount) -> int:
+    """Exact integer cents of a Decimal/int/str amount (floats go through str)."""
+    if isinstance(amount, float):
+        amount = repr(amount)
+    return int((Decimal(amount) * 100).to_integral_value(ROUND_HALF_UP))
+
+
+def from_cents(cents: int) -> Decimal:
+    return Decimal(int(cents)).scaleb(-2)
+
+
+def to_bp(rate) -> int:
+    bp = Decimal(str(rate)) * BP_SCALE
+    if bp != bp.to_integral_value() or bp < 0:
+        raise ValueError(f"rate {rate} is not a whole number of basis points")
+    return int(bp)
+
+
+def to_day(value) -> Optional[int]:
+    """Days since 1970-01-01 for a date, datetime, ISO string or day number."""
+    if value is None or isinstance(value, int):
+        return value
+    if isinstance(value, str):
+        value = date.fromisoformat(value[:10])
+    if isinstance(value, datetime):
+        value = value.date()
+    return (value - EPOCH).days
+
+
+def commission_cents(price_cents: int, rate_bp: int) -> int:
+    return (price_cents * rate_bp + BP_SCALE // 2) // BP_SCALE
+
+
+def points_for(commission: int) -> int:
+    return commission // POINT_CENTS
+
+
+class RateRule(NamedTuple):
+    rate_bp: int
+    leader_id: Optional[str] = None
+    category_id: Optional[str] = None
+    from_day: Optional[int] = None
+    until_day: Optional[int] = None
+
+    @property
+    def specificity(self) -> int:
+        dated = self.from_day is not None or self.until_day is not None
+        return (self.leader_id is not None) + (self.category_id is not None) + dated
+
+    def matches(self, leader_id: Optional[str], category_id: Optional[str], day: Optional[int]) -> bool:
+        if self.leader_id is not None and self.leader_id != leader_id:
+            return False
+        if self.category_id is not None and self.category_id != category_id:
+            return False
+        if self.from_day is not None and (day is None or day < self.from_day):
+            return False
+        if self.until_day is not None and (day is None or day >= self.until_day):
+            return False
+        return True
+
+
+class Commission(NamedTuple):
+    rate_bp: int
+    amount_cents: int
+    points: int
+
+    @property
+    def amount(self) -> Decimal:
+        return from_cents(self.amount_cents)
+
+    @property
+    def rate_percent(self) -> str:
+        return f"{Decimal(self.rate_bp) / 100:g}%"
+
+
+class RateTable:
+    def __init__(self, rules: Sequence[RateRule] = (), default_bp: int = DEFAULT_RATE_BP) -> None:
+        self.default_bp = default_bp
+        # Least specific first; later (more specific) rules overwrite earlier ones
+        self.rules = [rule for _, rule in sorted(enumerate(rules), key=lambda item: (item[1].specificity, item[0]))]
+
+    @classmethod
+    def from_dict(cls, config: dict, resolve_code=None) -> "RateTable":
+        rules = []
+        for entry in config.get("rules", []):
+            leader_id = entry.get("leader")
+            if entry.get("code"):
+                if resolve_code is None:
+                    from affiliate_directory import get_directory
+                    resolve_code = lambda code: get_directory(listen=False).resolve(code)
+                leader = resolve_code(entry["code"])
+                if leader is None:
+                    raise ValueError(f"rate table: affiliate code {entry['code']} not found")
+                leader_id = leader.id
+            rules.append(RateRule(
+                to_bp(entry["rate"]),
+                leader_id,
+                entry.get("category"),
+                to_day(entry.get("from")),
+                to_day(entry.get("until")),
+            ))
+        return cls(rules, to_bp(config.get("default_rate", Decimal(DEFAULT_RATE_BP) / BP_SCALE)))
+
+    @classmethod
+    def load(cls, path: str) -> "RateTable":
+        with open(path, encoding="utf-8") as f:
+            return cls.from_dict(json.load(f))
+
+    def rate_for(self, leader_id: Optional[str] = None, category_id: Optional[str] = None, on=None) -> int:
+        day = to_day(on)
+        for rule in reversed(self.rules):
+            if rule.matches(leader_id, category_id, day):
+                return rule.rate_bp
+        return self.default_bp
+
+    def commission_for(self, price, leader_id: Optional[str] = None, category_id: Optional[str] = None,
+                       on=None) -> Commission:
+        """Commission for one reservation; ``price`` is a Decimal amount."""
+        rate_bp = self.rate_for(leader_id, category_id, on)
+        amount = commission_cents(to_cents(price), rate_bp)
+        return Commission(rate_bp, amount, points_for(amount))
+
+    def rates(self, n: int, leader_ids: Optional[Sequence] = None, category_ids: Optional[Sequence] = None,
+              days: Optional[Sequence[int]] = None):
+        """Rate in basis points for each of ``n`` rows, as an int64 array."""
+        rates = np.full(n, self.default_bp, dtype=np.int64)
+        if not self.rules:
+            return rates
+        leaders = self._codes(leader_ids, "leader_id", n)
+        categories = self._codes(category_ids, "category_id", n)
+        if days is not None:
+            days = np.asarray(days)
+            # A missing day matches no dated rule, as in RateRule.matches
+            dated = np.not_equal(days, None) if days.dtype == object else np.ones(n, dtype=bool)
+            days = np.where(dated, days, 0).astype(np.int64)
+        for rule in self.rules:
+            mask = np.ones(n, dtype=bool)
+            if rule.leader_id is not None:
+                mask &= leaders[0] == leaders[1][rule.leader_id]
+            if rule.category_id is not None:
+                mask &= categories[0] == categories[1][rule.category_id]
+            if rule.from_day is not None or rule.until_day is not None:
+                if days is None:
+                    continue
+                mask &= dated
+                if rule.from_day is not None:
+                    mask &= days >= rule.from_day
+                if rule.until_day is not None:
+                    mask &= days < rule.until_day
+            rates[mask] = rule.rate_bp
+        return rates
+
+    def _codes(self, values: Optional[Sequence], field: str, n: int):
+        """Integer codes for the ids the rules mention (-1 for everything else)."""
+        wanted = {getattr(rule, field) for rule in self.rules} - {None}
+        index = {value: code for code, value in enumerate(sorted(wanted))}
+        if not index:
+            return None, index
+        codes = np.full(n, -1, dtype=np.int32)
+        if values is not None:
+            values = np.asarray(values, dtype=object)
+            # One vectorized comparison per id a rule names; rules are few
+            for value, code in index.items():
+                codes[values == value] = code
+        return codes, index
+
+
+def compute_batch(table: RateTable, price_cents, leader_ids: Optional[Sequence] = None,
+                  category_ids: Optional[Sequence] = None, days: Optional[Sequence[int]] = None):
+    """(rate_bp, commission_cents, points) for whole columns of reservations.
+
+    ``price_cents`` is an integer sequence or int64 array, ``days`` days
+    since 1970-01-01. With NumPy the results are int64 arrays; without it,
+    lists computed row by row with the same arithmetic.
+    """
+    if np is None:
+        n = len(price_cents)
+        leader_ids = leader_ids if leader_ids is not None else [None] * n
+        category_ids = category_ids if category_ids is not None else [None] * n
+        days = days if days is not None else [None] * n
+        rates, amounts, points = [], [], []
+        for price, leader_id, category_id, day in zip(price_cents, leader_ids, category_ids, days):
+            rate_bp = table.rate_for(leader_id, category_id, day)
+            amount = commission_cents(int(price), rate_bp)
+            rates.append(rate_bp)
+            amounts.append(amount)
+            points.append(points_for(amount))
+        return rates, amounts, points
+
+    prices = np.asarray(price_cents, dtype=np.int64)
+    rates = table.rates(len(prices), leader_ids, category_ids, days)
+    amounts = (prices * rates + BP_SCALE // 2) // BP_SCALE
+    return rates, amounts, amounts // POINT_CENTS
+
+
+_table: Optional[RateTable] = None
+
+
+def get_rate_table() -> RateTable:
+    """Process-wide rate table from ``COMMISSION_RATES``, or the flat default."""
+    global _table
+    if _table is None:
+        path = os.getenv("COMMISSION_RATES")
+        _table = RateTable.load(path) if path else RateTable()
+    return _table
+
+
+def commission_for(price, leader_id: Optional[str] = None, category_id: Optional[str] = None,
+                   on=None) -> Commission:
+    return get_rate_table().commission_for(price, leader_id, category_id, on)
+
+
+AUDIT_QUERY = """
+    SELECT
+        r.id,
+        (r."finalPrice" * 100)::BIGINT AS price_cents,
+        (r."commissionAmount" * 100)::BIGINT AS stored_cents,
+        r."referrerId",
+        t."categoryId",
+        r."reservationDate"::DATE - DATE '1970-01-01' AS day,
+        r."commissionPaid"
+    FROM reservations r
+    JOIN treatments t ON t.id = r."treatmentId"
+    WHERE r."referrerId" IS NOT NULL
+"""
+
+
+def audit(chunk: int = AUDIT_CHUNK) -> Tuple[int, float, List[dict]]:
+    """Reprice every referred reservation; returns (rows, seconds computing, mismatches)."""
+    from db import stream
+
+    table = get_rate_table()
+    mismatches: List[dict] = []
+    rows = 0
+    computing = 0.0
+
+    def check(batch: List[dict]) -> float:
+        started = time.perf_counter()
+        _, amounts, _ = compute_batch(
+            table,
+            [row["price_cents"] for row in batch],
+            [row["referrerId"] for row in batch],
+            [row["categoryId"] for row in batch],
+            [row["day"] for row in batch],
+        )
+        elapsed = time.perf_counter() - started
+        for row, expected in zip(batch, amounts):
+            if row["stored_cents"] != expected:
+                mismatches.append({
+                    "reservation_id": row["id"],
+                    "stored": str(from_cents(row["stored_cents"])),
+                    "expected": str(from_cents(expected)),
+                    "commission_paid": row["commissionPaid"],
+                })
+        return elapsed
+
+    batch: List[dict] = []
+    for row in stream(AUDIT_QUERY, itersize=chunk):
+        batch.append(row)
+        if len(batch) >= chunk:
+            computing += check(batch)
+            rows += len(batch)
+            batch = []
+    if batch:
+        computing += check(batch)
+        rows += len(batch)
+    return rows, computing, mismatches
+
+
+def apply_unpaid(mismatches: List[dict]) -> int:
+    """Rewrite commissionAmount on unpaid reservations; paid ones already have ledger rows."""
+    from db import transaction
+
+    unpaid = [row for row in mismatches if not row["commission_paid"]]
+    if not unpaid:
+        return 0
+    with transaction() as cursor:
+        cursor.execute(
+            """
+            UPDATE reservations r
+            SET "commissionAmount" = v.expected,
+                "updatedAt" = CURRENT_TIMESTAMP
+            FROM unnest(%s::TEXT[], %s::NUMERIC[], %s::NUMERIC[]) AS v(id, stored, expected)
+            WHERE r.id = v.id
+            AND r."commissionAmount" = v.stored
+            AND NOT r."commissionPaid"
+            """,
+            (
+                [row["reservation_id"] for row in unpaid],
+                [row["stored"] for row in unpaid],
+                [row["expected"] for row in unpaid],
+            ),
+        )
+        return cursor.rowcount
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Affiliate commission rate table and audit")
+    parser.add_argument("--audit", action="store_true", help="Compare stored commissionAmount with the rate table")
+    parser.add_argument("--apply", action="store_true", help="With --audit, rewrite unpaid commissionAmount values")
+    parser.add_argument("--output", help="Write audit mismatches as JSON to this file")
+    args = parser.parse_args()
+
+    table = get_rate_table()
+    print(f"default rate: {Decimal(table.default_bp) / 100:g}%  rules: {len(table.rules)}  "
+          f"numpy: {'yes' if np is not None else 'no'}")
+    if not args.audit:
+        for rule in table.rules:
+            print(f"  {Decimal(rule.rate_bp) / 100:g}%  leader={rule.leader_id or '*'} "
+                  f"category={rule.category_id or '*'} days={rule.from_day}..{rule.until_day}")
+        return 0
+
+    rows, computing, mismatches = audit()
+    paid = sum(1 for row in mismatches if row["commission_paid"])
+    print(f"referred_reservations={rows} mismatches={len(mismatches)} paid={paid} "
+          f"compute_seconds={computing:.3f}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(mismatches, f, indent=2)
+    if args.apply:
+        print(f"updated={apply_unpaid(mismatches)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -5,23 +5,51 @@ This script is idempotent:
 - Creates tables if they do not exist
 - Creates indexes/constraints if they do not exist
 - Prints a final verification summary
+
+Options:
+- --partitioned: keep daily_spending_entries range-partitioned by month on
+  "tanggalKunjungan". An existing plain table is migrated in one transaction
+  (writes are blocked while rows are copied); its other indexes and triggers
+  (patient_lookup.py, migrations, --rollups) are recreated on the partitioned
+  table, and a unique index that cannot be stops the migration. Re-run regularly (e.g. daily
+  cron) to create partitions --months-ahead of time. Unique keys must
+  contain the partition key, so the primary key becomes (id,
+  "tanggalKunjungan") and the upload/invoice key ("uploadId",
+  "nomorInvoice", "tanggalKunjungan"); invoices stay unique through the
+  daily_spending_invoices lookup below. These keys differ from
+  prisma/schema.prisma: the Prisma client keeps working against the
+  partitioned table, but do not `prisma db push` / `prisma migrate` over it.
+- Every entry carries "contentHash" (md5 of its columns, written by
+  ingest_daily_spending.py), so re-uploaded invoices are found across
+  uploads and unchanged ones skipped.
+- "nomorInvoice" is unique across uploads: a unique index on the plain
+  table; on the partitioned table (whose unique indexes must include the
+  partition key) a daily_spending_invoices lookup table claimed by a
+  BEFORE INSERT trigger, which skips an invoice stored under another entry
+  (as the app's createMany with skipDuplicates does on the plain table).
+  Invoices already stored twice block this; --dedupe-invoices keeps the
+  earliest copy, deletes the others and recomputes the upload totals.
+- --rollups: maintain daily_spending_rollups (one row per visit day and
+  patient) through statement-level triggers that add each statement's
+  changes from its transition tables, so concurrent ingests into the same day
+  both count. The front-office spending-daily route reads its per-patient
+  summaries from it when the table exists.
+- The verification summary reads row estimates, sizes and dead tuples from
+  the catalog (table_stats.py), so it stays instant on large tables;
+  --exact counts rows with COUNT(*) instead.
 """
 
 from __future__ import annotations
 
-import os
+import argparse
 import sys
-from typing import Iterable, Tuple
+from datetime import date
+from typing import Iterable, List, Tuple
 
-import psycopg2
 from psycopg2 import sql
 
-
-def get_database_url() -> str:
-    database_url = os.getenv("DATABASE_URL")
-    if not database_url:
-        raise RuntimeError("DATABASE_URL is not set in environment")
-    return database_url
+from db import connection, get_database_url
+from table_stats import format_stats, table_stats
 
 
 def run_statements(cursor, statements: Iterable[str]) -> None:
@@ -48,14 +76,513 @@ def count_rows(cursor, table_name: str) -> int:
     return int(cursor.fetchone()[0])
 
 
+ENTRY_COLUMNS = (
+    "id",
+    "uploadId",
+    "nomorInvoice",
+    "nomorRegistrasi",
+    "namaPasien",
+    "dob",
+    "tanggalKunjungan",
+    "dokter",
+    "diagnosa",
+    "status",
+    "totalPendapatan",
+    "pendapatanTindakan",
+    "pendapatanObat",
+    "keuntungan",
+    "contentHash",
+    "createdAt",
+)
+
+PARTITIONED_ENTRIES_DDL = """
+CREATE TABLE public.{table} (
+  id TEXT NOT NULL,
+  "uploadId" TEXT NOT NULL,
+  "nomorInvoice" TEXT NOT NULL,
+  "nomorRegistrasi" TEXT NULL,
+  "namaPasien" TEXT NOT NULL,
+  dob TEXT NULL,
+  "tanggalKunjungan" TIMESTAMP(3) NOT NULL,
+  dokter TEXT NULL,
+  diagnosa TEXT NULL,
+  status TEXT NULL,
+  "totalPendapatan" NUMERIC(14,2) NOT NULL DEFAULT 0,
+  "pendapatanTindakan" NUMERIC(14,2) NOT NULL DEFAULT 0,
+  "pendapatanObat" NUMERIC(14,2) NOT NULL DEFAULT 0,
+  keuntungan NUMERIC(14,2) NOT NULL DEFAULT 0,
+  "contentHash" TEXT NULL,
+  "createdAt" TIMESTAMP(3) NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  CONSTRAINT {table}_pkey PRIMARY KEY (id, "tanggalKunjungan"),
+  CONSTRAINT daily_spending_entries_upload_id_fkey
+    FOREIGN KEY ("uploadId")
+    REFERENCES public.daily_spending_uploads(id)
+    ON DELETE CASCADE
+) PARTITION BY RANGE ("tanggalKunjungan");
+"""
+
+# Unique keys on a partitioned table must contain the partition key; the
+# invoice lookup (INVOICE_LOOKUP_DDL) keeps ("uploadId", "nomorInvoice") unique
+PARTITIONED_INDEX_DDL = [
+    """
+    CREATE UNIQUE INDEX IF NOT EXISTS daily_spending_entries_upload_id_nomor_invoice_key
+      ON public.daily_spending_entries("uploadId", "nomorInvoice", "tanggalKunjungan");
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS daily_spending_entries_tanggal_kunjungan_idx
+      ON public.daily_spending_entries("tanggalKunjungan");
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS daily_spending_entries_nama_pasien_idx
+      ON public.daily_spending_entries("namaPasien");
+    """,
+]
+
+# Invoice lookup for cross-upload dedup; the plain table swaps the index for
+# INVOICE_UNIQUE_DDL
+CONTENT_HASH_DDL = [
+    """
+    ALTER TABLE public.daily_spending_entries ADD COLUMN IF NOT EXISTS "contentHash" TEXT NULL;
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS daily_spending_entries_nomor_invoice_content_hash_idx
+      ON public.daily_spending_entries("nomorInvoice", "contentHash");
+    """,
+]
+
+INVOICE_UNIQUE_INDEX = "daily_spending_entries_nomor_invoice_key"
+
+INVOICE_UNIQUE_DDL = [
+    f"""
+    CREATE UNIQUE INDEX IF NOT EXISTS {INVOICE_UNIQUE_INDEX}
+      ON public.daily_spending_entries("nomorInvoice");
+    """,
+    """
+    DROP INDEX IF EXISTS public.daily_spending_entries_nomor_invoice_content_hash_idx;
+    """,
+]
+
+# Partitioned layout: one row per invoice, owned by the entry that stores it.
+# Rows of deleted entries are not removed but taken over by the next insert.
+INVOICE_LOOKUP_DDL = [
+    """
+    CREATE TABLE IF NOT EXISTS public.daily_spending_invoices (
+      "nomorInvoice" TEXT PRIMARY KEY,
+      "entryId" TEXT NOT NULL
+    );
+    """,
+    """
+    CREATE OR REPLACE FUNCTION public.daily_spending_invoices_claim() RETURNS trigger AS $$
+    DECLARE
+      owner TEXT;
+    BEGIN
+      INSERT INTO public.daily_spending_invoices ("nomorInvoice", "entryId")
+      VALUES (NEW."nomorInvoice", NEW.id)
+      ON CONFLICT ("nomorInvoice") DO NOTHING;
+      IF FOUND THEN
+        RETURN NEW;
+      END IF;
+
+      SELECT "entryId" INTO owner FROM public.daily_spending_invoices
+      WHERE "nomorInvoice" = NEW."nomorInvoice"
+      FOR UPDATE;
+      IF owner = NEW.id OR NOT EXISTS (
+        SELECT 1 FROM public.daily_spending_entries
+        WHERE id = owner AND "nomorInvoice" = NEW."nomorInvoice"
+      ) THEN
+        UPDATE public.daily_spending_invoices SET "entryId" = NEW.id WHERE "nomorInvoice" = NEW."nomorInvoice";
+        RETURN NEW;
+      END IF;
+
+      IF TG_OP = 'UPDATE' THEN
+        RAISE unique_violation USING MESSAGE = format('invoice %s is already stored', NEW."nomorInvoice");
+      END IF;
+      RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    """,
+    """
+    DROP TRIGGER IF EXISTS daily_spending_invoices_insert ON public.daily_spending_entries;
+    CREATE TRIGGER daily_spending_invoices_insert
+      BEFORE INSERT ON public.daily_spending_entries
+      FOR EACH ROW EXECUTE FUNCTION public.daily_spending_invoices_claim();
+    """,
+    """
+    DROP TRIGGER IF EXISTS daily_spending_invoices_update ON public.daily_spending_entries;
+    CREATE TRIGGER daily_spending_invoices_update
+      BEFORE UPDATE OF "nomorInvoice" ON public.daily_spending_entries
+      FOR EACH ROW WHEN (OLD."nomorInvoice" IS DISTINCT FROM NEW."nomorInvoice")
+      EXECUTE FUNCTION public.daily_spending_invoices_claim();
+    """,
+]
+
+UPLOAD_TOTALS_QUERY = """
+    UPDATE public.daily_spending_uploads u
+    SET "totalRows" = t.rows,
+        "totalPendapatan" = t.pendapatan,
+        "totalKeuntungan" = t.keuntungan,
+        "updatedAt" = CURRENT_TIMESTAMP
+    FROM (
+      SELECT up.id, COUNT(e.id) AS rows,
+             COALESCE(SUM(e."totalPendapatan"), 0) AS pendapatan,
+             COALESCE(SUM(e.keuntungan), 0) AS keuntungan
+      FROM public.daily_spending_uploads up
+      LEFT JOIN public.daily_spending_entries e ON e."uploadId" = up.id
+      WHERE up.id = ANY(%s)
+      GROUP BY up.id
+    ) t
+    WHERE u.id = t.id
+    RETURNING u.id, u."totalRows", u."totalPendapatan", u."totalKeuntungan"
+"""
+
+DEFAULT_PARTITION = "daily_spending_entries_pdefault"
+
+# Indexes the partitioned layout creates (or replaces) itself
+OWN_INDEXES = {
+    "daily_spending_entries_upload_id_nomor_invoice_key",
+    "daily_spending_entries_tanggal_kunjungan_idx",
+    "daily_spending_entries_nama_pasien_idx",
+    "daily_spending_entries_nomor_invoice_content_hash_idx",
+    INVOICE_UNIQUE_INDEX,
+}
+
+# Indexes (other than constraints) and triggers that DROP TABLE would take
+# with it: patient_lookup.py's LOWER/trigram indexes, migration indexes,
+# --rollups triggers
+ATTACHED_QUERY = """
+    SELECT 'index', c.relname, pg_get_indexdef(i.indexrelid), i.indisunique
+    FROM pg_index i
+    JOIN pg_class c ON c.oid = i.indexrelid
+    WHERE i.indrelid = 'public.daily_spending_entries'::regclass
+      AND NOT EXISTS (SELECT 1 FROM pg_constraint k WHERE k.conindid = i.indexrelid)
+    UNION ALL
+    SELECT 'trigger', t.tgname, pg_get_triggerdef(t.oid), false
+    FROM pg_trigger t
+    WHERE t.tgrelid = 'public.daily_spending_entries'::regclass AND NOT t.tgisinternal
+    ORDER BY 1, 2
+"""
+
+ROLLUP_DDL = [
+    """
+    CREATE TABLE IF NOT EXISTS public.daily_spending_rollups (
+      "tanggalKunjungan" TIMESTAMP(3) NOT NULL,
+      "patientKey" TEXT NOT NULL,
+      "namaPasien" TEXT NOT NULL,
+      "totalKunjungan" INTEGER NOT NULL,
+      "totalPendapatan" NUMERIC(14,2) NOT NULL,
+      "totalKeuntungan" NUMERIC(14,2) NOT NULL,
+      "updatedAt" TIMESTAMP(3) NOT NULL DEFAULT CURRENT_TIMESTAMP,
+      CONSTRAINT daily_spending_rollups_pkey PRIMARY KEY ("tanggalKunjungan", "patientKey")
+    );
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS daily_spending_rollups_patient_key_idx
+      ON public.daily_spending_rollups("patientKey", "tanggalKunjungan");
+    """,
+    """
+    DROP FUNCTION IF EXISTS public.daily_spending_rollups_refresh_keys(TIMESTAMP[], TEXT[]);
+    """,
+    """
+    CREATE OR REPLACE FUNCTION public.daily_spending_rollups_trigger() RETURNS trigger AS $$
+    DECLARE
+      changed TEXT;
+      empty_days TIMESTAMP[];
+      empty_keys TEXT[];
+    BEGIN
+      -- Rows counted +1 (new) or -1 (old); rollups are adjusted by increments so
+      -- concurrent statements on the same day/patient add up instead of
+      -- overwriting each other's recomputation
+      IF TG_OP = 'INSERT' THEN
+        changed := 'SELECT *, 1 AS sign FROM new_rows';
+      ELSIF TG_OP = 'DELETE' THEN
+        changed := 'SELECT *, -1 AS sign FROM old_rows';
+      ELSE
+        changed := 'SELECT *, 1 AS sign FROM new_rows UNION ALL SELECT *, -1 AS sign FROM old_rows';
+      END IF;
+
+      EXECUTE format($q$
+        WITH applied AS (
+          INSERT INTO public.daily_spending_rollups AS r
+            ("tanggalKunjungan", "patientKey", "namaPasien", "totalKunjungan",
+             "totalPendapatan", "totalKeuntungan", "updatedAt")
+          SELECT date_trunc('day', c."tanggalKunjungan"), lower(btrim(c."namaPasien")), MAX(c."namaPasien"),
+                 SUM(c.sign), SUM(c.sign * c."totalPendapatan"), SUM(c.sign * c.keuntungan), CURRENT_TIMESTAMP
+          FROM (%s) c
+          GROUP BY 1, 2
+          HAVING SUM(c.sign) <> 0 OR SUM(c.sign * c."totalPendapatan") <> 0 OR SUM(c.sign * c.keuntungan) <> 0
+          ORDER BY 1, 2
+          ON CONFLICT ("tanggalKunjungan", "patientKey") DO UPDATE
+            SET "namaPasien" = GREATEST(r."namaPasien", EXCLUDED."namaPasien"),
+                "totalKunjungan" = r."totalKunjungan" + EXCLUDED."totalKunjungan",
+                "totalPendapatan" = r."totalPendapatan" + EXCLUDED."totalPendapatan",
+                "totalKeuntungan" = r."totalKeuntungan" + EXCLUDED."totalKeuntungan",
+                "updatedAt" = EXCLUDED."updatedAt"
+          RETURNING r."tanggalKunjungan", r."patientKey", r."totalKunjungan"
+        )
+        SELECT array_agg("tanggalKunjungan"), array_agg("patientKey") FROM applied WHERE "totalKunjungan" <= 0
+      $q$, changed) INTO empty_days, empty_keys;
+
+      -- Still row-locked by the upsert above, so no other statement can refill them first
+      IF empty_days IS NOT NULL THEN
+        DELETE FROM public.daily_spending_rollups r
+        USING unnest(empty_days, empty_keys) AS e(day, key)
+        WHERE r."tanggalKunjungan" = e.day AND r."patientKey" = e.key AND r."totalKunjungan" <= 0;
+      END IF;
+      RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+    """,
+    """
+    DROP TRIGGER IF EXISTS daily_spending_rollups_insert ON public.daily_spending_entries;
+    CREATE TRIGGER daily_spending_rollups_insert
+      AFTER INSERT ON public.daily_spending_entries
+      REFERENCING NEW TABLE AS new_rows
+      FOR EACH STATEMENT EXECUTE FUNCTION public.daily_spending_rollups_trigger();
+    """,
+    """
+    DROP TRIGGER IF EXISTS daily_spending_rollups_update ON public.daily_spending_entries;
+    CREATE TRIGGER daily_spending_rollups_update
+      AFTER UPDATE ON public.daily_spending_entries
+      REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+      FOR EACH STATEMENT EXECUTE FUNCTION public.daily_spending_rollups_trigger();
+    """,
+    """
+    DROP TRIGGER IF EXISTS daily_spending_rollups_delete ON public.daily_spending_entries;
+    CREATE TRIGGER daily_spending_rollups_delete
+      AFTER DELETE ON public.daily_spending_entries
+      REFERENCING OLD TABLE AS old_rows
+      FOR EACH STATEMENT EXECUTE FUNCTION public.daily_spending_rollups_trigger();
+    """,
+]
+
+
+def is_partitioned(cursor, table_name: str) -> bool:
+    with cursor.connection.cursor() as plain:
+        plain.execute(
+            "SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass(%s)",
+            (f"public.{table_name}",),
+        )
+        row = plain.fetchone()
+    return bool(row and row[0])
+
+
+def add_months(month: date, count: int) -> date:
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def create_month_partition(cursor, month: date) -> bool:
+    """Create the partition for ``month``, moving its rows out of the default partition."""
+    name = f"daily_spending_entries_p{month:%Y%m}"
+    if table_exists(cursor, name):
+        return False
+
+    start, end = month, add_months(month, 1)
+    table = sql.Identifier(name)
+    cursor.execute(
+        sql.SQL("CREATE TABLE public.{} (LIKE public.daily_spending_entries INCLUDING DEFAULTS)").format(table)
+    )
+    cursor.execute(
+        sql.SQL(
+            """
+            WITH moved AS (
+              DELETE FROM public.{default}
+              WHERE "tanggalKunjungan" >= %s AND "tanggalKunjungan" < %s
+              RETURNING *
+            )
+            INSERT INTO public.{table} SELECT * FROM moved
+            """
+        ).format(default=sql.Identifier(DEFAULT_PARTITION), table=table),
+        (start, end),
+    )
+    cursor.execute(
+        sql.SQL(
+            "ALTER TABLE public.daily_spending_entries ATTACH PARTITION public.{} FOR VALUES FROM (%s) TO (%s)"
+        ).format(table),
+        (start, end),
+    )
+    return True
+
+
+def attached_objects(cursor) -> List[Tuple[str, str, str]]:
+    """(kind, name, definition) of the plain table's indexes and triggers to carry over."""
+    cursor.execute(ATTACHED_QUERY)
+    attached = []
+    for kind, name, definition, unique in cursor.fetchall():
+        if name in OWN_INDEXES:
+            continue
+        if unique:
+            raise RuntimeError(
+                f"unique index {name} cannot be recreated on the partitioned table (unique keys must "
+                'include "tanggalKunjungan"); drop or change it before migrating'
+            )
+        attached.append((kind, name, definition))
+    return attached
+
+
+def ensure_partitioned_entries(cursor, months_ahead: int) -> None:
+    """Create or migrate daily_spending_entries as a monthly partitioned table."""
+    this_month = date.today().replace(day=1)
+    first_month = this_month
+
+    if not table_exists(cursor, "daily_spending_entries"):
+        cursor.execute(PARTITIONED_ENTRIES_DDL.format(table="daily_spending_entries"))
+        cursor.execute(
+            f"CREATE TABLE public.{DEFAULT_PARTITION} PARTITION OF public.daily_spending_entries DEFAULT"
+        )
+    elif not is_partitioned(cursor, "daily_spending_entries"):
+        print("Migrating daily_spending_entries to monthly partitions...")
+        cursor.execute("LOCK TABLE public.daily_spending_entries IN EXCLUSIVE MODE")
+        attached = attached_objects(cursor)
+        run_statements(cursor, CONTENT_HASH_DDL[:1])
+        cursor.execute(PARTITIONED_ENTRIES_DDL.format(table="daily_spending_entries_partitioned"))
+        cursor.execute(
+            f"CREATE TABLE public.{DEFAULT_PARTITION} "
+            "PARTITION OF public.daily_spending_entries_partitioned DEFAULT"
+        )
+        columns = sql.SQL(", ").join(map(sql.Identifier, ENTRY_COLUMNS))
+        cursor.execute(
+            sql.SQL(
+                "INSERT INTO public.daily_spending_entries_partitioned ({columns}) "
+                "SELECT {columns} FROM public.daily_spending_entries"
+            ).format(columns=columns)
+        )
+        copied = cursor.rowcount
+        existing = count_rows(cursor, "daily_spending_entries")
+        if copied != existing:
+            raise RuntimeError(f"partition migration copied {copied} of {existing} rows")
+
+        cursor.execute("DROP TABLE public.daily_spending_entries")
+        cursor.execute("ALTER TABLE public.daily_spending_entries_partitioned RENAME TO daily_spending_entries")
+        cursor.execute(
+            "ALTER TABLE public.daily_spending_entries "
+            "RENAME CONSTRAINT daily_spending_entries_partitioned_pkey TO daily_spending_entries_pkey"
+        )
+        # The definitions name public.daily_spending_entries, now the partitioned parent
+        for kind, name, definition in attached:
+            cursor.execute(definition)
+            print(f"{kind}={name} recreated")
+        print(f"Migrated {copied} rows.")
+
+    run_statements(cursor, PARTITIONED_INDEX_DDL)
+    run_statements(cursor, CONTENT_HASH_DDL)
+
+    # Old months landing in the default partition get their own partition too
+    cursor.execute('SELECT MIN("tanggalKunjungan") FROM public.daily_spending_entries')
+    oldest = cursor.fetchone()[0]
+    if oldest:
+        first_month = min(first_month, oldest.date().replace(day=1))
+
+    month = first_month
+    last_month = add_months(this_month, months_ahead)
+    while month <= last_month:
+        if create_month_partition(cursor, month):
+            print(f"partition=daily_spending_entries_p{month:%Y%m} created")
+        month = add_months(month, 1)
+
+
+def refresh_upload_totals(cursor, upload_ids) -> list:
+    """Set the uploads' totals from the entries they actually keep."""
+    cursor.execute(UPLOAD_TOTALS_QUERY, (list(upload_ids),))
+    return cursor.fetchall()
+
+
+def dedupe_invoices(cursor) -> int:
+    """Keep the earliest entry per invoice, delete the rest; returns rows deleted."""
+    cursor.execute(
+        """
+        DELETE FROM public.daily_spending_entries e
+        USING (
+          SELECT id, ROW_NUMBER() OVER (PARTITION BY "nomorInvoice" ORDER BY "createdAt", id) AS copy
+          FROM public.daily_spending_entries
+        ) d
+        WHERE e.id = d.id AND d.copy > 1
+        RETURNING e."uploadId"
+        """
+    )
+    deleted = [row[0] for row in cursor.fetchall()]
+    if deleted:
+        refresh_upload_totals(cursor, set(deleted))
+    return len(deleted)
+
+
+def ensure_unique_invoices(cursor, partitioned: bool, dedupe: bool) -> None:
+    """Enforce one entry per invoice across uploads (index or lookup table)."""
+    marker = "daily_spending_invoices" if partitioned else INVOICE_UNIQUE_INDEX
+    cursor.execute("SELECT to_regclass(%s) IS NOT NULL", (f"public.{marker}",))
+    installed = cursor.fetchone()[0]
+
+    if not installed:
+        cursor.execute(
+            """
+            SELECT COUNT(*) FROM (
+              SELECT 1 FROM public.daily_spending_entries GROUP BY "nomorInvoice" HAVING COUNT(*) > 1
+            ) duplicated
+            """
+        )
+        duplicated = cursor.fetchone()[0]
+        if duplicated and not dedupe:
+            raise RuntimeError(
+                f"{duplicated} invoices are stored more than once; re-run with --dedupe-invoices "
+                "to keep the earliest copy of each"
+            )
+        if duplicated:
+            print(f"Deduplicated {duplicated} invoices, deleted {dedupe_invoices(cursor)} entries.")
+
+    if partitioned:
+        run_statements(cursor, INVOICE_LOOKUP_DDL)
+        if not installed:
+            cursor.execute(
+                """
+                INSERT INTO public.daily_spending_invoices ("nomorInvoice", "entryId")
+                SELECT "nomorInvoice", id FROM public.daily_spending_entries
+                """
+            )
+            print(f"invoice lookup backfilled rows={cursor.rowcount}")
+    else:
+        run_statements(cursor, INVOICE_UNIQUE_DDL)
+
+
+def ensure_rollups(cursor) -> None:
+    """Create the rollup table and triggers; backfill it the first time."""
+    created = not table_exists(cursor, "daily_spending_rollups")
+    run_statements(cursor, ROLLUP_DDL)
+    if created:
+        cursor.execute(
+            """
+            INSERT INTO public.daily_spending_rollups
+              ("tanggalKunjungan", "patientKey", "namaPasien", "totalKunjungan",
+               "totalPendapatan", "totalKeuntungan")
+            SELECT date_trunc('day', "tanggalKunjungan"), lower(btrim("namaPasien")),
+                   MAX("namaPasien"), COUNT(*), SUM("totalPendapatan"), SUM(keuntungan)
+            FROM public.daily_spending_entries
+            GROUP BY 1, 2
+            """
+        )
+        print(f"rollups backfilled rows={cursor.rowcount}")
+
+
 def main() -> int:
+    parser = argparse.ArgumentParser(description="Create daily spending tables")
+    parser.add_argument("--partitioned", action="store_true",
+                        help="Create/migrate daily_spending_entries as monthly range partitions")
+    parser.add_argument("--months-ahead", type=int, default=3,
+                        help="Future monthly partitions to create (default 3)")
+    parser.add_argument("--rollups", action="store_true",
+                        help="Create and maintain the daily_spending_rollups table")
+    parser.add_argument("--dedupe-invoices", action="store_true",
+                        help="Delete all but the earliest entry of invoices stored more than once")
+    parser.add_argument("--exact", action="store_true",
+                        help="Verify with exact row counts (full scans) instead of catalog estimates")
+    args = parser.parse_args()
+
     try:
-        database_url = get_database_url()
+        get_database_url()
     except RuntimeError as exc:
         print(f"ERROR: {exc}")
         return 1
 
-    ddl_statements = [
+    upload_ddl = [
         """
         CREATE TABLE IF NOT EXISTS public.daily_spending_uploads (
                     id TEXT PRIMARY KEY,
@@ -69,6 +596,13 @@ def main() -> int:
                     "updatedAt" TIMESTAMP(3) NOT NULL DEFAULT CURRENT_TIMESTAMP
         );
         """,
+        """
+        CREATE INDEX IF NOT EXISTS daily_spending_uploads_report_date_idx
+                    ON public.daily_spending_uploads("reportDate");
+        """,
+    ]
+
+    entry_ddl = [
         """
         CREATE TABLE IF NOT EXISTS public.daily_spending_entries (
           id TEXT PRIMARY KEY,
@@ -104,43 +638,39 @@ def main() -> int:
         CREATE INDEX IF NOT EXISTS daily_spending_entries_nama_pasien_idx
                     ON public.daily_spending_entries("namaPasien");
         """,
-        """
-        CREATE INDEX IF NOT EXISTS daily_spending_uploads_report_date_idx
-                    ON public.daily_spending_uploads("reportDate");
-        """,
     ]
 
-    conn = None
     try:
-        conn = psycopg2.connect(database_url)
-        conn.autocommit = False
-
-        with conn.cursor() as cursor:
-            run_statements(cursor, ddl_statements)
+        with connection() as conn, conn.cursor() as cursor:
+            run_statements(cursor, upload_ddl)
+            partitioned = args.partitioned or is_partitioned(cursor, "daily_spending_entries")
+            if partitioned:
+                ensure_partitioned_entries(cursor, args.months_ahead)
+            else:
+                run_statements(cursor, entry_ddl)
+                run_statements(cursor, CONTENT_HASH_DDL[:1])
+            ensure_unique_invoices(cursor, partitioned, args.dedupe_invoices)
+            if args.rollups:
+                ensure_rollups(cursor)
             conn.commit()
 
             tables: Tuple[str, ...] = (
                 "daily_spending_uploads",
                 "daily_spending_entries",
             )
+            if args.rollups:
+                tables += ("daily_spending_rollups",)
 
             print("=== Verification ===")
-            for table in tables:
-                exists = table_exists(cursor, table)
-                row_count = count_rows(cursor, table) if exists else 0
-                print(f"table={table} exists={exists} rows={row_count}")
+            for stats in table_stats(cursor, tables, exact=args.exact):
+                print(format_stats(stats))
 
         print("SUCCESS: daily spending tables are ready.")
         return 0
 
     except Exception as exc:  # noqa: BLE001
-        if conn:
-            conn.rollback()
         print(f"ERROR: failed to create/verify tables: {exc}")
         return 1
-    finally:
-        if conn:
-            conn.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,285 @@
+"""Shared PostgreSQL connection layer for the scripts/ tools.
+
+All scripts borrow connections from one process-wide, thread-safe pool
+instead of opening a fresh psycopg2 connection (and TLS handshake) per call.
+
+Pooled connections count their server round trips (statements, named
+cursor fetches, commits and rollbacks) in ``stats`` so benchmarks can report
+them. Set DB_PROFILE=1 for a per-statement report at exit (see
+query_profile.py).
+
+Environment:
+- DATABASE_URL             connection string (required)
+- DB_POOL_MIN / DB_POOL_MAX pool bounds (default 1 / 8)
+- DB_STATEMENT_TIMEOUT_MS  per-session statement timeout (default 30000, 0 = off)
+"""
+
+from __future__ import annotations
+
+import atexit
+import itertools
+import os
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Dict, Iterator, Optional, Tuple
+
+from dotenv import load_dotenv
+from psycopg2 import pool as pg_pool
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, connection as pg_connection, cursor as pg_cursor
+from psycopg2.extras import RealDictCursor
+
+import query_profile
+
+load_dotenv()
+query_profile.enable_from_env()
+
+DEFAULT_POOL_MIN = 1
+DEFAULT_POOL_MAX = 8
+DEFAULT_STATEMENT_TIMEOUT_MS = 30_000
+DEFAULT_ITERSIZE = 2000
+
+_pool: Optional[pg_pool.ThreadedConnectionPool] = None
+_pool_lock = threading.Lock()
+_cursor_ids = itertools.count(1)
+
+
+def get_database_url() -> str:
+    database_url = os.getenv("DATABASE_URL")
+    if not database_url:
+        raise RuntimeError("DATABASE_URL is not set in environment")
+    return database_url
+
+
+class QueryStats:
+    """Process-wide, thread-safe round-trip counters."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._counts: Dict[str, int] = {}
+
+    def add(self, key: str, count: int = 1) -> None:
+        with self._lock:
+            self._counts[key] = self._counts.get(key, 0) + count
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            counts = dict(self._counts)
+        counts["round_trips"] = sum(counts.get(key, 0) for key in ("statements", "fetches", "commits", "rollbacks"))
+        return counts
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counts.clear()
+
+
+stats = QueryStats()
+
+
+@lru_cache(maxsize=None)
+def _counting_cursor(base):
+    """Subclass of cursor class ``base`` that records its round trips in ``stats``
+    and, when query_profile is enabled, per-statement timings."""
+
+    class CountingCursor(base):
+        _profile_key = None
+
+        def _profiled(self, method, query, vars, explain=True):
+            profiler = query_profile.active
+            if profiler is None:
+                return method(query, vars)
+            started = time.perf_counter()
+            try:
+                return method(query, vars)
+            finally:
+                self._profile_query = (query, vars)
+                self._profile_key = profiler.record_execute(self, query, vars, time.perf_counter() - started,
+                                                            explain=explain)
+
+        def _fetched(self, rows, started):
+            profiler = query_profile.active
+            if profiler is not None and self._profile_key is not None:
+                count = len(rows) if isinstance(rows, list) else int(rows is not None)
+                profiler.record_fetch(self, self._profile_key, count, time.perf_counter() - started,
+                                      *self._profile_query)
+            return rows
+
+        def execute(self, query, vars=None):
+            stats.add("statements")
+            return self._profiled(super().execute, query, vars)
+
+        def executemany(self, query, vars_list):
+            stats.add("statements")
+            return self._profiled(super().executemany, query, vars_list, explain=False)
+
+        def copy_expert(self, sql, file, size=8192):
+            stats.add("statements")
+            profiler = query_profile.active
+            started = time.perf_counter()
+            try:
+                return super().copy_expert(sql, file, size)
+            finally:
+                if profiler is not None:
+                    profiler.record_execute(self, sql, None, time.perf_counter() - started, explain=False)
+
+        def fetchone(self):
+            if not self.name:
+                return super().fetchone()
+            stats.add("fetches")
+            started = time.perf_counter()
+            return self._fetched(super().fetchone(), started)
+
+        def fetchmany(self, size=None):
+            if not self.name:
+                return super().fetchmany(size if size is not None else self.arraysize)
+            stats.add("fetches")
+            started = time.perf_counter()
+            return self._fetched(super().fetchmany(size if size is not None else self.arraysize), started)
+
+        def fetchall(self):
+            if not self.name:
+                return super().fetchall()
+            stats.add("fetches")
+            started = time.perf_counter()
+            return self._fetched(super().fetchall(), started)
+
+        def __iter__(self):
+            if not self.name:
+                return super().__iter__()
+            return self._iter_named()
+
+        def _iter_named(self):
+            # Named cursors fetch itersize rows per round trip
+            while True:
+                rows = self.fetchmany(self.itersize)
+                if not rows:
+                    return
+                yield from rows
+
+    CountingCursor.__name__ = f"Counting{base.__name__}"
+    return CountingCursor
+
+
+class CountingConnection(pg_connection):
+    """Connection whose cursors, commits and rollbacks are counted in ``stats``."""
+
+    def cursor(self, *args, **kwargs):
+        factory = kwargs.get("cursor_factory") or self.cursor_factory or pg_cursor
+        kwargs["cursor_factory"] = _counting_cursor(factory)
+        return super().cursor(*args, **kwargs)
+
+    def commit(self):
+        stats.add("commits")
+        return super().commit()
+
+    def rollback(self):
+        stats.add("rollbacks")
+        return super().rollback()
+
+
+def _env_int(name: str, default: int) -> int:
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+def get_pool() -> pg_pool.ThreadedConnectionPool:
+    """Return the process-wide pool, creating it on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                timeout_ms = _env_int("DB_STATEMENT_TIMEOUT_MS", DEFAULT_STATEMENT_TIMEOUT_MS)
+                _pool = pg_pool.ThreadedConnectionPool(
+                    _env_int("DB_POOL_MIN", DEFAULT_POOL_MIN),
+                    _env_int("DB_POOL_MAX", DEFAULT_POOL_MAX),
+                    get_database_url(),
+                    options=f"-c statement_timeout={timeout_ms}",
+                    connection_factory=CountingConnection,
+                )
+    return _pool
+
+
+def close_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
+
+
+atexit.register(close_pool)
+
+
+@contextmanager
+def connection() -> Iterator:
+    """Borrow a pooled connection; it is rolled back and returned on exit."""
+    db_pool = get_pool()
+    conn = db_pool.getconn()
+    try:
+        yield conn
+    finally:
+        if not conn.closed:
+            if conn.info.transaction_status != TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+            if conn.autocommit:
+                conn.autocommit = False
+        db_pool.putconn(conn, close=bool(conn.closed))
+
+
+@contextmanager
+def transaction(
+    cursor_factory=RealDictCursor,
+    statement_timeout_ms: Optional[int] = None,
+) -> Iterator:
+    """Run a block in one transaction and yield a cursor.
+
+    Commits when the block exits normally and rolls back if it raises.
+    ``statement_timeout_ms`` overrides the session timeout for this
+    transaction only (``SET LOCAL``).
+    """
+    with connection() as conn:
+        try:
+            with conn.cursor(cursor_factory=cursor_factory) as cursor:
+                if statement_timeout_ms is not None:
+                    cursor.execute("SET LOCAL statement_timeout = %s", (int(statement_timeout_ms),))
+                yield cursor
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+
+
+@lru_cache(maxsize=None)
+def row_type(fields: Tuple[str, ...]):
+    """Compact tuple row class supporting both ``row.name`` and ``row['name']``."""
+    base = namedtuple("Row", fields)
+
+    class Row(base):
+        __slots__ = ()
+
+        def __getitem__(self, key):
+            if isinstance(key, str):
+                return getattr(self, key)
+            return tuple.__getitem__(self, key)
+
+    return Row
+
+
+def stream(query: str, params=None, itersize: int = DEFAULT_ITERSIZE) -> Iterator:
+    """Yield rows of ``query`` from a named server-side cursor.
+
+    Rows arrive in batches of ``itersize`` so memory stays flat regardless of
+    the result size, and the first row is available after the first batch.
+    The pooled connection is held until the generator is exhausted or closed.
+    """
+    with connection() as conn:
+        with conn.cursor(name=f"stream_{os.getpid()}_{next(_cursor_ids)}") as cursor:
+            cursor.itersize = itersize
+            cursor.execute(query, params)
+            row_cls = None
+            for values in cursor:
+                if row_cls is None:
+                    row_cls = row_type(tuple(column.name for column in cursor.description))
+                yield tuple.__new__(row_cls, values)
@@ -0,0 +1,210 @@
+"""Append-only balance deltas for affiliate payouts, folded into users in batches.
+
+Paying a commission used to increment ``totalEarnings``, ``totalReferrals``
+and ``points`` on the referrer's ``users`` row inside the payout
+transaction, so every concurrent payout for a big team code waited on that
+one row lock. Payout paths now append the ``transactions`` row plus one
+``user_balance_deltas`` row, which never conflicts with anything, and
+``fold()`` later moves the pending deltas into ``users`` with one UPDATE per
+user per batch.
+
+``fold()`` claims deltas with ``FOR UPDATE SKIP LOCKED`` and deletes them
+in the same transaction that updates users, so every delta is applied
+exactly once. Payout, withdrawal and attribution paths (scripts and app
+routes alike) only append: folds run on a timer in the app
+(src/lib/balances.ts), from payout_commissions.py when its queue drains and
+from ``--follow``/``--fold``, never per reservation. Only one fold runs at a
+time (a transaction-level advisory lock on ``FOLD_LOCK_KEY``, shared with the
+app); a second caller returns immediately.
+
+Between folds the ``users`` counters lag behind, so balances are read from
+the ``user_balances`` view, which adds pending deltas to them. The table and
+view ship as prisma/migration_user_balance_deltas.sql; ``ensure_table``
+creates them on databases that have not run it yet.
+
+Usage:
+    python scripts/earnings_ledger.py --status
+    python scripts/earnings_ledger.py --fold                  # drain pending deltas once
+    python scripts/earnings_ledger.py --follow --poll-seconds 5
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+import time
+from typing import Dict, Sequence, Set
+
+from db import transaction
+
+# Which ledger rows feed which points counter, as the app routes write them:
+# commission payouts (front-office reservations) and spending records
+# (front-office spending) credit users.points; the reservation route's
+# points_earned transactions credit users.loyaltyPoints.
+POINTS_TRANSACTION_TYPES = ["commission"]
+LOYALTY_TRANSACTION_TYPES = ["points_earned"]
+
+DEFAULT_FOLD_BATCH = 10_000
+FOLD_LOCK_KEY = 0x6C656467  # arbitrary, shared by every fold() caller and src/lib/balances.ts
+
+LEDGER_DDL = """
+CREATE TABLE IF NOT EXISTS public.user_balance_deltas (
+  id BIGSERIAL PRIMARY KEY,
+  "userId" TEXT NOT NULL,
+  earnings DECIMAL(12,2) NOT NULL DEFAULT 0,
+  referrals INTEGER NOT NULL DEFAULT 0,
+  points INTEGER NOT NULL DEFAULT 0,
+  "transactionId" TEXT,
+  "createdAt" TIMESTAMP(3) NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS "user_balance_deltas_userId_idx" ON public.user_balance_deltas ("userId");
+
+CREATE OR REPLACE VIEW public.user_balances AS
+SELECT
+  u.id,
+  u."totalEarnings" + COALESCE(d.earnings, 0) AS "totalEarnings",
+  u."totalReferrals" + COALESCE(d.referrals, 0)::INTEGER AS "totalReferrals",
+  u.points + COALESCE(d.points, 0)::INTEGER AS points,
+  COALESCE(d.deltas, 0) AS "pendingDeltas"
+FROM public.users u
+LEFT JOIN (
+  SELECT "userId", SUM(earnings) AS earnings, SUM(referrals) AS referrals, SUM(points) AS points,
+         COUNT(*) AS deltas
+  FROM public.user_balance_deltas
+  GROUP BY "userId"
+) d ON d."userId" = u.id;
+"""
+
+APPEND_QUERY = """
+    INSERT INTO public.user_balance_deltas ("userId", earnings, referrals, points, "transactionId")
+    SELECT * FROM unnest(%s::TEXT[], %s::NUMERIC[], %s::INTEGER[], %s::INTEGER[], %s::TEXT[])
+"""
+
+FOLD_QUERY = """
+    WITH claimed AS (
+        SELECT id
+        FROM public.user_balance_deltas
+        ORDER BY id
+        LIMIT %s
+        FOR UPDATE SKIP LOCKED
+    ),
+    taken AS (
+        DELETE FROM public.user_balance_deltas d
+        USING claimed c
+        WHERE d.id = c.id
+        RETURNING d."userId", d.earnings, d.referrals, d.points
+    ),
+    folded AS (
+        UPDATE users u
+        SET "totalEarnings" = u."totalEarnings" + t.earnings,
+            "totalReferrals" = u."totalReferrals" + t.referrals,
+            points = u.points + t.points
+        FROM (
+            SELECT "userId", SUM(earnings) AS earnings, SUM(referrals) AS referrals, SUM(points) AS points
+            FROM taken
+            GROUP BY "userId"
+        ) t
+        WHERE u.id = t."userId"
+        RETURNING u.id
+    )
+    SELECT (SELECT COUNT(*) FROM taken) AS deltas, (SELECT COUNT(*) FROM folded) AS users
+"""
+
+
+# Databases (by DSN) where the table is known to exist, checked once per process
+_ready: Set[str] = set()
+
+
+def ensure_table(cursor) -> None:
+    # Checked first: CREATE OR REPLACE VIEW would lock the view in every payout
+    dsn = cursor.connection.dsn
+    if dsn in _ready:
+        return
+    with cursor.connection.cursor() as plain:
+        plain.execute("SELECT to_regclass('public.user_balance_deltas') IS NOT NULL")
+        if plain.fetchone()[0]:
+            _ready.add(dsn)
+        else:
+            # Not cached: the creating transaction may still roll back
+            plain.execute(LEDGER_DDL)
+
+
+def append(cursor, user_ids: Sequence[str], earnings: Sequence, referrals: Sequence[int],
+           points: Sequence[int], transaction_ids: Sequence[str]) -> None:
+    """Queue balance changes; applied to users by the next fold()."""
+    ensure_table(cursor)
+    cursor.execute(
+        APPEND_QUERY,
+        (list(user_ids), [str(amount) for amount in earnings], list(referrals), list(points),
+         list(transaction_ids)),
+    )
+
+
+def append_one(cursor, user_id: str, earnings, referrals: int, points: int, transaction_id: str) -> None:
+    append(cursor, [user_id], [earnings], [referrals], [points], [transaction_id])
+
+
+def fold(batch_size: int = DEFAULT_FOLD_BATCH) -> Dict[str, int]:
+    """Apply pending deltas to users until none are left; no-op if another fold is running."""
+    totals = {'batches': 0, 'deltas': 0, 'users': 0}
+    while True:
+        with transaction() as cursor:
+            ensure_table(cursor)
+            cursor.execute("SELECT pg_try_advisory_xact_lock(%s) AS locked", (FOLD_LOCK_KEY,))
+            if not cursor.fetchone()['locked']:
+                return totals
+            cursor.execute(FOLD_QUERY, (batch_size,))
+            result = cursor.fetchone()
+        if not result['deltas']:
+            return totals
+        totals['batches'] += 1
+        totals['deltas'] += result['deltas']
+        totals['users'] += result['users']
+        if result['deltas'] < batch_size:
+            return totals
+
+
+def status() -> Dict[str, object]:
+    with transaction() as cursor:
+        ensure_table(cursor)
+        cursor.execute(
+            """
+            SELECT COUNT(*) AS pending, COUNT(DISTINCT "userId") AS users,
+                   COALESCE(SUM(earnings), 0) AS earnings, MIN("createdAt") AS oldest
+            FROM public.user_balance_deltas
+            """
+        )
+        return cursor.fetchone()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Fold pending affiliate balance deltas into users")
+    parser.add_argument('--status', action='store_true', help="Show pending deltas and exit")
+    parser.add_argument('--fold', action='store_true', help="Drain pending deltas once")
+    parser.add_argument('--follow', action='store_true', help="Keep folding as new deltas arrive")
+    parser.add_argument('--poll-seconds', type=float, default=5.0,
+                        help="With --follow, wait this long between folds (default 5)")
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_FOLD_BATCH,
+                        help=f"Deltas per fold transaction (default {DEFAULT_FOLD_BATCH})")
+    args = parser.parse_args()
+
+    if args.fold or args.follow:
+        while True:
+            started = time.perf_counter()
+            result = fold(args.batch_size)
+            if result['deltas'] or not args.follow:
+                print(f"folded deltas={result['deltas']} users={result['users']} batches={result['batches']} "
+                      f"seconds={time.perf_counter() - started:.3f}")
+            if not args.follow:
+                break
+            time.sleep(args.poll_seconds)
+
+    row = status()
+    print(f"pending={row['pending']} users={row['users']} earnings=Rp {float(row['earnings']):,.0f} "
+          f"oldest={row['oldest']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,294 @@
+"""
+Export reservation, commission and spending history for reporting.
+
+Datasets:
+
+- reservations            joined with the treatment and the referrer's name
+- transactions            the commission / points ledger
+- withdrawals
+- daily_spending_entries  with the upload's report date
+
+CSV and JSONL are streamed by Postgres itself with ``COPY (...) TO STDOUT``
+into a buffered file (gzip with ``--gzip``), so memory stays flat
+and a year of rows takes seconds. JSONL rows are built server-side with
+``row_to_json``. Parquet (needs ``pip install pyarrow``) is written one row
+group per chunk from a server-side cursor.
+
+``--since``/``--until`` filter on each dataset's business date (reservation
+date, transaction date, request date, visit date). ``--incremental`` exports
+only rows created or updated since the previous incremental run, keyed on
+("updatedAt" or "createdAt", id) and stored in script_checkpoints; each run
+writes a new timestamped file. Every dataset is read from one snapshot.
+
+Usage:
+    python scripts/export_history.py --since 2025-01-01 --until 2026-01-01 --format csv
+    python scripts/export_history.py --datasets transactions --format parquet --output-dir exports
+    python scripts/export_history.py --incremental --format jsonl
+"""
+
+from __future__ import annotations
+
+import argparse
+import gzip
+import os
+import sys
+import time
+from datetime import date, datetime
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import checkpoints
+from db import connection, transaction
+
+FORMATS = ("csv", "jsonl", "parquet")
+WRITE_BUFFER = 1 << 20
+PARQUET_CHUNK = 100_000
+
+# Control characters never appear unescaped in row_to_json output, so CSV
+# mode with them as quote/delimiter copies each JSON document verbatim
+JSONL_COPY_OPTIONS = "FORMAT csv, QUOTE E'\\x01', DELIMITER E'\\x02'"
+
+
+class Dataset(NamedTuple):
+    name: str
+    columns: str
+    source: str
+    date_column: str
+    watermark: str
+    id_column: str
+
+
+DATASETS: Dict[str, Dataset] = {
+    dataset.name: dataset
+    for dataset in (
+        Dataset(
+            "reservations",
+            """
+            r.id, r."createdAt", r."updatedAt", r."reservationDate", r."reservationTime", r.status,
+            r."userId", r."patientName", r."patientEmail", r."patientPhone",
+            r."treatmentId", t.name AS "treatmentName", t."categoryId",
+            r."originalPrice", r."finalPrice", r."discountAmount",
+            r."referredBy", r."referrerId",
+            NULLIF(TRIM(CONCAT(ref."firstName", ' ', ref."lastName")), '') AS "referrerName",
+            r."commissionAmount", r."commissionPaid", r."completedAt"
+            """,
+            """
+            reservations r
+            JOIN treatments t ON t.id = r."treatmentId"
+            LEFT JOIN users ref ON ref.id = r."referrerId"
+            """,
+            'r."reservationDate"',
+            'r."updatedAt"',
+            "r.id",
+        ),
+        Dataset(
+            "transactions",
+            'x.id, x."userId", x.type, x.amount, x.points, x.description, x."referenceId", x."createdAt"',
+            "transactions x",
+            'x."createdAt"',
+            'x."createdAt"',
+            "x.id",
+        ),
+        Dataset(
+            "withdrawals",
+            """
+            w.id, w."userId", w."bankAccountId", w.amount, w.status, w."requestDate",
+            w."processedDate", w."processedBy", w."adminNotes", w."createdAt", w."updatedAt"
+            """,
+            "withdrawals w",
+            'w."requestDate"',
+            'w."updatedAt"',
+            "w.id",
+        ),
+        Dataset(
+            "daily_spending_entries",
+            """
+            e.id, e."uploadId", u."reportDate", e."nomorInvoice", e."nomorRegistrasi", e."namaPasien",
+            e.dob, e."tanggalKunjungan", e.dokter, e.diagnosa, e.status, e."totalPendapatan",
+            e."pendapatanTindakan", e."pendapatanObat", e.keuntungan, e."createdAt"
+            """,
+            """
+            daily_spending_entries e
+            JOIN daily_spending_uploads u ON u.id = e."uploadId"
+            """,
+            'e."tanggalKunjungan"',
+            'e."createdAt"',
+            "e.id",
+        ),
+    )
+}
+
+
+def checkpoint_name(dataset: Dataset) -> str:
+    return f"export_history:{dataset.name}"
+
+
+def build_filter(dataset: Dataset, since: Optional[date], until: Optional[date],
+                 after: Optional[checkpoints.Checkpoint]) -> Tuple[str, list]:
+    """FROM ... WHERE ... for the selected rows, with its parameters."""
+    conditions: List[str] = []
+    params: list = []
+    if since is not None:
+        conditions.append(f"{dataset.date_column} >= %s")
+        params.append(since)
+    if until is not None:
+        conditions.append(f"{dataset.date_column} < %s")
+        params.append(until)
+    if after is not None and after != checkpoints.START:
+        conditions.append(f"({dataset.watermark}, {dataset.id_column}) > (%s, %s)")
+        params.extend(after)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    return f"FROM {dataset.source} {where}", params
+
+
+def open_output(path: str):
+    if path.endswith(".gz"):
+        return gzip.open(path, "wb", compresslevel=5)
+    return open(path, "wb", buffering=WRITE_BUFFER)
+
+
+def copy_out(cursor, query: str, params: list, path: str, fmt: str) -> int:
+    """COPY the query result to ``path``; returns the row count."""
+    statement = cursor.mogrify(query, params).decode()
+    if fmt == "csv":
+        copy = f"COPY ({statement}) TO STDOUT WITH (FORMAT csv, HEADER)"
+    else:
+        copy = f"COPY (SELECT row_to_json(q) FROM ({statement}) q) TO STDOUT WITH ({JSONL_COPY_OPTIONS})"
+    with open_output(path) as f:
+        cursor.copy_expert(copy, f, size=WRITE_BUFFER)
+    return cursor.rowcount
+
+
+def _arrow_type(pa, column):
+    numeric_types = {
+        16: pa.bool_(), 20: pa.int64(), 21: pa.int16(), 23: pa.int32(), 700: pa.float32(), 701: pa.float64(),
+        1082: pa.date32(), 1114: pa.timestamp("ms"), 1184: pa.timestamp("ms", tz="UTC"),
+    }
+    if column.type_code == 1700:
+        precision = column.precision if column.precision and column.precision > 0 else 38
+        scale = column.scale if column.scale and column.scale >= 0 else 2
+        return pa.decimal128(precision, scale)
+    return numeric_types.get(column.type_code, pa.string())
+
+
+def parquet_out(conn, query: str, params: list, path: str, chunk: int = PARQUET_CHUNK) -> int:
+    """Stream the query through a named cursor into one Parquet row group per chunk."""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as exc:
+        raise RuntimeError("pyarrow is required for --format parquet (pip install pyarrow)") from exc
+
+    rows = 0
+    with conn.cursor(name=f"export_{os.getpid()}") as cursor:
+        cursor.itersize = chunk
+        cursor.execute(query, params)
+        batch = cursor.fetchmany(chunk)
+        schema = pa.schema([(column.name, _arrow_type(pa, column)) for column in cursor.description])
+        with pq.ParquetWriter(path, schema, compression="zstd") as writer:
+            while True:
+                columns = list(zip(*batch)) if batch else [()] * len(schema)
+                writer.write_table(pa.Table.from_arrays(
+                    [pa.array(values, type=field.type) for values, field in zip(columns, schema)],
+                    schema=schema,
+                ))
+                rows += len(batch)
+                batch = cursor.fetchmany(chunk)
+                if not batch:
+                    break
+    return rows
+
+
+def export(datasets: List[Dataset], fmt: str, output_dir: str, since: Optional[date] = None,
+           until: Optional[date] = None, incremental: bool = False, compress: bool = False) -> List[dict]:
+    """Export each dataset from one snapshot; returns one summary per file."""
+    os.makedirs(output_dir, exist_ok=True)
+    stamp = datetime.now().strftime("%Y%m%d%H%M%S")
+    suffix = "." + fmt + (".gz" if compress and fmt != "parquet" else "")
+
+    starts: Dict[str, checkpoints.Checkpoint] = {}
+    if incremental:
+        with transaction() as cursor:
+            checkpoints.ensure_table(cursor)
+            for dataset in datasets:
+                starts[dataset.name] = checkpoints.load(cursor, checkpoint_name(dataset))
+
+    summaries = []
+    advanced: Dict[str, checkpoints.Checkpoint] = {}
+    with connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY")
+            for dataset in datasets:
+                selection, params = build_filter(dataset, since, until, starts.get(dataset.name))
+                query = f"SELECT {dataset.columns} {selection}"
+                name = f"{dataset.name}-{stamp}" if incremental else dataset.name
+                path = os.path.join(output_dir, name + suffix)
+                started = time.perf_counter()
+                if fmt == "parquet":
+                    rows = parquet_out(conn, query, params, path)
+                else:
+                    rows = copy_out(cursor, query, params, path, fmt)
+                elapsed = time.perf_counter() - started
+
+                if incremental:
+                    # Same snapshot as the export, so this is the last row written
+                    cursor.execute(
+                        f"SELECT {dataset.watermark}, {dataset.id_column} {selection} ORDER BY 1 DESC, 2 DESC LIMIT 1",
+                        params,
+                    )
+                    latest = cursor.fetchone()
+                    if latest:
+                        advanced[dataset.name] = checkpoints.Checkpoint(*latest)
+
+                summaries.append({
+                    "dataset": dataset.name,
+                    "path": path,
+                    "rows": rows,
+                    "bytes": os.path.getsize(path),
+                    "seconds": round(elapsed, 3),
+                })
+        conn.rollback()
+
+    # Only advance once every file has been written
+    if advanced:
+        with transaction() as cursor:
+            for name, checkpoint in advanced.items():
+                checkpoints.save(cursor, checkpoint_name(DATASETS[name]), checkpoint)
+    return summaries
+
+
+def parse_date(value: str) -> date:
+    return date.fromisoformat(value)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Export reservation, commission and spending history")
+    parser.add_argument("--datasets", default=",".join(DATASETS),
+                        help=f"Comma-separated subset of: {', '.join(DATASETS)} (default all)")
+    parser.add_argument("--format", choices=FORMATS, default="csv", help="Output format (default csv)")
+    parser.add_argument("--output-dir", default="exports", help="Directory for the files (default exports)")
+    parser.add_argument("--since", type=parse_date, help="First business date to include (YYYY-MM-DD)")
+    parser.add_argument("--until", type=parse_date, help="Business date to stop before (YYYY-MM-DD)")
+    parser.add_argument("--gzip", action="store_true", help="Gzip CSV/JSONL output")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only rows changed since the previous --incremental run")
+    args = parser.parse_args()
+
+    names = [name.strip() for name in args.datasets.split(",") if name.strip()]
+    unknown = [name for name in names if name not in DATASETS]
+    if unknown:
+        parser.error(f"unknown datasets: {', '.join(unknown)}")
+
+    started = time.perf_counter()
+    summaries = export([DATASETS[name] for name in names], args.format, args.output_dir,
+                       args.since, args.until, args.incremental, args.gzip)
+    for summary in summaries:
+        rate = summary["rows"] / summary["seconds"] if summary["seconds"] else 0.0
+        print(f"{summary['dataset']:24s} rows={summary['rows']:<9d} {summary['bytes'] / 1e6:8.1f} MB "
+              f"{summary['seconds']:7.2f}s rows/s={rate:,.0f}  {summary['path']}")
+    print(f"TOTAL: files={len(summaries)} rows={sum(s['rows'] for s in summaries)} "
+          f"seconds={time.perf_counter() - started:.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
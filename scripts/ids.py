@@ -0,0 +1,166 @@
+"""cuid-compatible row ids for everything the scripts insert.
+
+Prisma's ``@default(cuid())`` is applied by the client, not the database, so
+rows written from these scripts need an id generated here. Ids follow the
+cuid v1 layout, 25 lowercase base36 characters::
+
+    c | timestamp (8) | counter (4) | fingerprint (4) | random (8)
+
+- timestamp: milliseconds since the epoch, fixed width, so ids sort roughly
+  by creation time and new rows land at the right edge of the pkey index
+- counter:   per process; when it wraps inside one millisecond the timestamp
+  is advanced instead, so (timestamp, counter) never repeats in a process
+- fingerprint: pid and host name, recomputed after fork, so parallel workers
+  and machines produce disjoint ids even for the same (timestamp, counter)
+- random:    40 bits from os.urandom
+
+``cuid()`` returns one id and ``stream_cuids()`` an endless iterator of
+them. ``cuids(n)`` generates a batch for COPY loads without a Python loop
+per id (the batch is laid out column by column in one buffer and split),
+and can fill a preallocated list in place::
+
+    ids = [None] * len(rows)
+    cuids(len(rows), out=ids)
+"""
+
+from __future__ import annotations
+
+import os
+import socket
+import threading
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+BASE36 = "0123456789abcdefghijklmnopqrstuvwxyz"
+COUNTER_SPACE = 36 ** 4
+TIMESTAMP_WIDTH = 8
+COUNTER_WIDTH = 4
+RANDOM_WIDTH = 8
+ID_LENGTH = 1 + TIMESTAMP_WIDTH + COUNTER_WIDTH + 4 + RANDOM_WIDTH
+
+# Maps each random byte to one of 32 cuid characters; 256 is a multiple of
+# 32, so every character is equally likely and 8 of them carry 40 bits
+_RANDOM_TABLE = bytes(ord(BASE36[i % 32]) for i in range(256))
+_COUNTER_AT = 1 + TIMESTAMP_WIDTH
+_RANDOM_AT = ID_LENGTH - RANDOM_WIDTH
+_LINE = ID_LENGTH + 1  # each id plus the newline the batch is split on
+
+
+def to_base36(value: int, width: int) -> str:
+    digits = []
+    while value:
+        value, digit = divmod(value, 36)
+        digits.append(BASE36[digit])
+    return "".join(reversed(digits)).rjust(width, "0")[-width:]
+
+
+def _fingerprint() -> str:
+    pid = to_base36(os.getpid(), 2)
+    host = socket.gethostname()
+    host_id = to_base36(sum(map(ord, host)) + len(host) + 36, 2)
+    return pid + host_id
+
+
+_digit_periods: Dict[int, bytes] = {}
+
+
+def _counter_digits(digit: int, start: int, n: int) -> bytes:
+    """Base36 digit ``digit`` (0 = most significant) of counters start .. start+n-1."""
+    period = _digit_periods.get(digit)
+    if period is None:
+        repeat = 36 ** (COUNTER_WIDTH - 1 - digit)
+        period = _digit_periods[digit] = b"".join(ch.encode() * repeat for ch in BASE36)
+    offset = start % len(period)
+    copies = (offset + n - 1) // len(period) + 1
+    return (period * copies)[offset:offset + n]
+
+
+class _State:
+    __slots__ = ("lock", "fingerprint", "last_ms", "counter")
+
+    def __init__(self) -> None:
+        self.reset()
+
+    def reset(self) -> None:
+        self.lock = threading.Lock()
+        self.fingerprint = _fingerprint()
+        self.last_ms = 0
+        # Random start so a restarted process that reuses a pid does not replay counters
+        self.counter = int.from_bytes(os.urandom(4), "big") % COUNTER_SPACE
+
+    def reserve(self, n: int) -> Tuple[int, int, str]:
+        """Claim ``n`` consecutive (timestamp, counter) slots; returns the first."""
+        with self.lock:
+            start_ms = max(int(time.time() * 1000), self.last_ms)
+            start_counter = self.counter
+            end = start_counter + n
+            self.last_ms = start_ms + end // COUNTER_SPACE
+            self.counter = end % COUNTER_SPACE
+            return start_ms, start_counter, self.fingerprint
+
+
+_state = _State()
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_state.reset)
+
+
+def cuid() -> str:
+    """One new id."""
+    ms, counter, fingerprint = _state.reserve(1)
+    return ("c" + to_base36(ms, TIMESTAMP_WIDTH) + to_base36(counter, COUNTER_WIDTH) + fingerprint
+            + os.urandom(RANDOM_WIDTH).translate(_RANDOM_TABLE).decode("ascii"))
+
+
+def _segment(ms: int, counter: int, fingerprint: str, n: int) -> List[str]:
+    """``n`` ids sharing one timestamp, counters counter .. counter+n-1."""
+    buf = bytearray(n * _LINE)
+    head = ("c" + to_base36(ms, TIMESTAMP_WIDTH)).encode()
+    for at, ch in enumerate(head):
+        buf[at::_LINE] = bytes((ch,)) * n
+    for digit in range(COUNTER_WIDTH):
+        buf[_COUNTER_AT + digit::_LINE] = _counter_digits(digit, counter, n)
+    for at, ch in enumerate(fingerprint.encode(), _COUNTER_AT + COUNTER_WIDTH):
+        buf[at::_LINE] = bytes((ch,)) * n
+    randoms = os.urandom(RANDOM_WIDTH * n).translate(_RANDOM_TABLE)
+    for at in range(RANDOM_WIDTH):
+        buf[_RANDOM_AT + at::_LINE] = randoms[at * n:(at + 1) * n]
+    buf[ID_LENGTH::_LINE] = b"\n" * n
+    return buf[:-1].decode("ascii").split("\n")
+
+
+def cuids(n: int, out: Optional[List[Optional[str]]] = None, offset: int = 0) -> List[str]:
+    """``n`` new ids in increasing order.
+
+    With ``out``, ids are written to ``out[offset:offset + n]`` (which must
+    already exist) and ``out`` is returned; otherwise a new list is returned.
+    """
+    if n <= 0:
+        return out if out is not None else []
+    ms, counter, fingerprint = _state.reserve(n)
+    if out is None:
+        out = [None] * n
+        offset = 0
+    while n:
+        # Counters wrap by moving to the next millisecond, as reserve() did
+        take = min(n, COUNTER_SPACE - counter)
+        out[offset:offset + take] = _segment(ms, counter, fingerprint, take)
+        offset += take
+        n -= take
+        ms += 1
+        counter = 0
+    return out
+
+
+def stream_cuids(batch: int = 10_000) -> Iterator[str]:
+    """Endless ids for row-at-a-time producers, generated ``batch`` at a time."""
+    while True:
+        yield from cuids(batch)
+
+
+def is_cuid(value: str) -> bool:
+    return len(value) == ID_LENGTH and value[0] == "c" and all(ch in BASE36 for ch in value)
+
+
+def timestamp_of(value: str) -> float:
+    """Creation time (seconds since the epoch) encoded in an id from this module."""
+    return int(value[1:1 + TIMESTAMP_WIDTH], 36) / 1000
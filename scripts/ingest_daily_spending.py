@@ -0,0 +1,513 @@
+#!/usr/bin/env python3
+"""Stream daily spending exports (XLSX/CSV) into daily_spending_entries.
+
+Python counterpart of the front-office ``spending-daily`` upload route for
+backfills: rows are streamed from the file (never the whole workbook in
+memory), parsed with the same header normalization and number/date rules,
+COPY'd into a staging table and upserted on ("uploadId", "nomorInvoice")
+(plus "tanggalKunjungan" once the entries table is partitioned).
+
+Like the route, one upload is kept per report date: re-ingesting a date
+reuses its upload and replaces its entries.
+
+Invoices are deduplicated across uploads: each staged row is hashed (md5
+of its columns) and matched on "nomorInvoice" against every upload. An
+invoice already stored with the same hash is skipped; one stored with a
+different hash is updated in place, under the upload that holds it. Only
+invoices not stored anywhere are inserted under this upload, so
+overlapping exports do not double-count revenue. The database enforces one
+entry per invoice (see create_daily_spending_tables.py), so an ingest racing
+another one for the same invoice fails and can simply be re-run. Upload
+totals are computed from the entries each upload keeps. Each file reports
+inserted / updated / skipped counts.
+
+Usage:
+    python scripts/ingest_daily_spending.py kunjungan-2025-*.xlsx
+    python scripts/ingest_daily_spending.py export.csv --report-date 2025-01-31
+"""
+
+from __future__ import annotations
+
+import argparse
+import csv
+import io
+import math
+import re
+import sys
+import time
+from datetime import date, datetime, timedelta
+from decimal import Decimal, InvalidOperation
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence
+
+from create_daily_spending_tables import is_partitioned, refresh_upload_totals
+from db import transaction
+from ids import cuid, stream_cuids
+
+SHEET_NAME = "Kunjungan"
+EXCEL_EPOCH = datetime(1899, 12, 30)
+DDMMYYYY = re.compile(r"^(\d{1,2})[-/](\d{1,2})[-/](\d{4})$")
+
+# Column name in daily_spending_entries -> accepted export headers
+COLUMNS: Dict[str, Sequence[str]] = {
+    "nomorInvoice": ("Nomor Invoice",),
+    "nomorRegistrasi": ("Nomor Registrasi",),
+    "namaPasien": ("Nama Pasien",),
+    "dob": ("DOB",),
+    "tanggalKunjungan": ("Tanggal Kunjungan",),
+    "dokter": ("Dokter",),
+    "diagnosa": ("Diagnosa",),
+    "totalPendapatan": ("Total Pendapatan",),
+    "pendapatanTindakan": ("Pendapatan Tindakan",),
+    "pendapatanObat": ("Pendapatan Obat",),
+    "keuntungan": ("Keutungan", "Keuntungan"),
+    "status": ("Status",),
+}
+REQUIRED_COLUMNS = ("nomorInvoice", "namaPasien", "tanggalKunjungan", "totalPendapatan")
+
+ENTRY_COLUMNS = (
+    "nomorInvoice",
+    "nomorRegistrasi",
+    "namaPasien",
+    "dob",
+    "tanggalKunjungan",
+    "dokter",
+    "diagnosa",
+    "status",
+    "totalPendapatan",
+    "pendapatanTindakan",
+    "pendapatanObat",
+    "keuntungan",
+)
+ENTRY_COLUMN_LIST = ", ".join(f'"{column}"' for column in ENTRY_COLUMNS)
+
+
+def content_hash(alias: str) -> str:
+    """SQL expression hashing an entry's columns, for staging or stored rows alike."""
+    return "md5(ROW(" + ", ".join(f'{alias}."{column}"' for column in ENTRY_COLUMNS) + ")::TEXT)"
+
+
+# Staged rows (first per invoice) matched to the stored entry for the same
+# invoice in any upload, preferring this upload's own entry. Entries written
+# before "contentHash" existed (or by the app) are hashed on the fly.
+RESOLVE_QUERY = f"""
+CREATE TEMP TABLE daily_spending_resolved ON COMMIT DROP AS
+SELECT s.*, {content_hash("s")} AS "contentHash",
+       e.id AS existing_id, e."uploadId" AS existing_upload_id,
+       e."tanggalKunjungan" AS existing_tanggal, e.hash AS existing_hash
+FROM (
+  SELECT DISTINCT ON ("nomorInvoice") *
+  FROM daily_spending_staging
+  ORDER BY "nomorInvoice", line_no
+) s
+LEFT JOIN LATERAL (
+  SELECT e.id, e."uploadId", e."tanggalKunjungan", COALESCE(e."contentHash", {content_hash("e")}) AS hash
+  FROM daily_spending_entries e
+  WHERE e."nomorInvoice" = s."nomorInvoice"
+  ORDER BY e."uploadId" = %s DESC, e."createdAt", e.id
+  LIMIT 1
+) e ON true
+"""
+
+STAGING_DDL = """
+CREATE TEMP TABLE daily_spending_staging (
+  line_no INTEGER NOT NULL,
+  id TEXT NOT NULL,
+  "nomorInvoice" TEXT NOT NULL,
+  "nomorRegistrasi" TEXT NULL,
+  "namaPasien" TEXT NOT NULL,
+  dob TEXT NULL,
+  "tanggalKunjungan" TIMESTAMP(3) NOT NULL,
+  dokter TEXT NULL,
+  diagnosa TEXT NULL,
+  status TEXT NULL,
+  "totalPendapatan" NUMERIC(14,2) NOT NULL,
+  "pendapatanTindakan" NUMERIC(14,2) NOT NULL,
+  "pendapatanObat" NUMERIC(14,2) NOT NULL,
+  keuntungan NUMERIC(14,2) NOT NULL
+) ON COMMIT DROP;
+"""
+
+
+class ParsedRow(NamedTuple):
+    nomorInvoice: str
+    nomorRegistrasi: Optional[str]
+    namaPasien: str
+    dob: Optional[str]
+    tanggalKunjungan: datetime
+    dokter: Optional[str]
+    diagnosa: Optional[str]
+    status: Optional[str]
+    totalPendapatan: Decimal
+    pendapatanTindakan: Decimal
+    pendapatanObat: Decimal
+    keuntungan: Decimal
+
+
+class IngestTotals:
+    __slots__ = ("rows", "first_date")
+
+    def __init__(self) -> None:
+        self.rows = 0
+        self.first_date: Optional[datetime] = None
+
+    def add(self, row: ParsedRow) -> None:
+        if self.first_date is None:
+            self.first_date = row.tanggalKunjungan
+        self.rows += 1
+
+
+def normalize_header(value: object) -> str:
+    return " ".join(str(value if value is not None else "").strip().lower().split())
+
+
+def to_text(value: object) -> Optional[str]:
+    if value is None:
+        return None
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    elif isinstance(value, datetime):
+        value = value.date().isoformat() if value.time() == datetime.min.time() else value.isoformat()
+    elif isinstance(value, date):
+        value = value.isoformat()
+    return str(value).strip() or None
+
+
+def to_number(value: object) -> Decimal:
+    if isinstance(value, bool):
+        return Decimal(0)
+    if isinstance(value, (int, float)):
+        return Decimal(str(value)) if math.isfinite(value) else Decimal(0)
+    if isinstance(value, Decimal):
+        return value if value.is_finite() else Decimal(0)
+    if isinstance(value, str):
+        cleaned = re.sub(r"[^0-9,.-]", "", value).replace(",", ".", 1)
+        try:
+            parsed = Decimal(cleaned)
+        except InvalidOperation:
+            return Decimal(0)
+        return parsed if parsed.is_finite() else Decimal(0)
+    return Decimal(0)
+
+
+def parse_date_value(value: object) -> Optional[datetime]:
+    if not value:
+        return None
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day)
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        try:
+            return EXCEL_EPOCH + timedelta(days=value)
+        except OverflowError:
+            return None
+    if isinstance(value, str):
+        trimmed = value.strip()
+        match = DDMMYYYY.match(trimmed)
+        try:
+            if match:
+                dd, mm, yyyy = match.groups()
+                return datetime(int(yyyy), int(mm), int(dd))
+            return datetime.fromisoformat(trimmed)
+        except ValueError:
+            return None
+    return None
+
+
+def start_of_day(value: datetime) -> datetime:
+    return datetime(value.year, value.month, value.day)
+
+
+def iter_raw_rows(path: str) -> Iterator[Sequence[object]]:
+    """Yield raw rows (header first) without loading the whole file."""
+    if path.lower().endswith(".csv"):
+        with open(path, newline="", encoding="utf-8-sig") as handle:
+            yield from csv.reader(handle)
+        return
+
+    try:
+        from openpyxl import load_workbook
+    except ImportError as exc:
+        raise RuntimeError("openpyxl is required for .xlsx files (pip install openpyxl)") from exc
+
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        worksheet = workbook[SHEET_NAME] if SHEET_NAME in workbook.sheetnames else workbook.worksheets[0]
+        yield from worksheet.iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+
+def parse_rows(raw_rows: Iterable[Sequence[object]]) -> Iterator[ParsedRow]:
+    """Map headers once, then yield valid rows as they are read."""
+    raw_rows = iter(raw_rows)
+    header = next(raw_rows, None)
+    if header is None:
+        raise ValueError("File kosong")
+
+    header_map = {}
+    for index, cell in enumerate(header):
+        normalized = normalize_header(cell)
+        if normalized:
+            header_map[normalized] = index
+
+    positions: Dict[str, Optional[int]] = {}
+    for column, names in COLUMNS.items():
+        positions[column] = next(
+            (header_map[normalize_header(name)] for name in names if normalize_header(name) in header_map),
+            None,
+        )
+    if any(positions[column] is None for column in REQUIRED_COLUMNS):
+        raise ValueError("Format file tidak sesuai. Pastikan kolom utama tersedia.")
+
+    def cell(row: Sequence[object], column: str) -> object:
+        index = positions[column]
+        return row[index] if index is not None and index < len(row) else None
+
+    for row in raw_rows:
+        nomor_invoice = to_text(cell(row, "nomorInvoice"))
+        nama_pasien = to_text(cell(row, "namaPasien"))
+        if not nomor_invoice or not nama_pasien:
+            continue
+        tanggal = parse_date_value(cell(row, "tanggalKunjungan"))
+        if not tanggal:
+            continue
+
+        yield ParsedRow(
+            nomorInvoice=nomor_invoice,
+            nomorRegistrasi=to_text(cell(row, "nomorRegistrasi")),
+            namaPasien=nama_pasien,
+            dob=to_text(cell(row, "dob")),
+            tanggalKunjungan=start_of_day(tanggal),
+            dokter=to_text(cell(row, "dokter")),
+            diagnosa=to_text(cell(row, "diagnosa")),
+            status=to_text(cell(row, "status")),
+            totalPendapatan=to_number(cell(row, "totalPendapatan")),
+            pendapatanTindakan=to_number(cell(row, "pendapatanTindakan")),
+            pendapatanObat=to_number(cell(row, "pendapatanObat")),
+            keuntungan=to_number(cell(row, "keuntungan")),
+        )
+
+
+class CopySource:
+    """File-like object rendering rows to CSV on demand for COPY FROM STDIN."""
+
+    def __init__(self, rows: Iterable[Sequence[object]]) -> None:
+        self._rows = iter(rows)
+        self._out = io.StringIO()
+        self._writer = csv.writer(self._out)
+        self._pending = ""
+
+    def read(self, size: int = -1) -> str:
+        chunks: List[str] = [self._pending]
+        length = len(self._pending)
+        while size < 0 or length < size:
+            row = next(self._rows, None)
+            if row is None:
+                break
+            self._writer.writerow(row)
+            line = self._out.getvalue()
+            self._out.seek(0)
+            self._out.truncate()
+            chunks.append(line)
+            length += len(line)
+        data = "".join(chunks)
+        if size < 0:
+            self._pending = ""
+            return data
+        self._pending = data[size:]
+        return data[:size]
+
+
+def staging_rows(rows: Iterable[ParsedRow], totals: IngestTotals) -> Iterator[List[object]]:
+    for (line_no, row), row_id in zip(enumerate(rows, 1), stream_cuids()):
+        totals.add(row)
+        yield [line_no, row_id, *row]
+
+
+def upsert_upload(cursor, report_date: datetime, source_file_name: str, uploaded_by: Optional[str]) -> str:
+    """Reuse (and lock) the upload for report_date, or create one; totals are set after the entries."""
+    cursor.execute(
+        """
+        SELECT id FROM daily_spending_uploads
+        WHERE "reportDate" = %s
+        ORDER BY "createdAt"
+        FOR UPDATE
+        """,
+        (report_date,),
+    )
+    existing = [row["id"] for row in cursor.fetchall()]
+
+    if existing:
+        upload_id = existing[0]
+        # The route keeps a single upload per report date
+        if len(existing) > 1:
+            cursor.execute("DELETE FROM daily_spending_uploads WHERE id = ANY(%s)", (existing[1:],))
+        cursor.execute(
+            """
+            UPDATE daily_spending_uploads
+            SET "sourceFileName" = %s,
+                "uploadedByClerkId" = %s,
+                "updatedAt" = CURRENT_TIMESTAMP
+            WHERE id = %s
+            """,
+            (source_file_name, uploaded_by, upload_id),
+        )
+        return upload_id
+
+    upload_id = cuid()
+    cursor.execute(
+        """
+        INSERT INTO daily_spending_uploads
+          (id, "reportDate", "sourceFileName", "uploadedByClerkId", "createdAt", "updatedAt")
+        VALUES (%s, %s, %s, %s, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
+        """,
+        (upload_id, report_date, source_file_name, uploaded_by),
+    )
+    return upload_id
+
+
+def upsert_entries(cursor, upload_id: str) -> Dict[str, int]:
+    """Replace the upload's entries with the staged rows; first row per invoice wins.
+
+    Returns inserted / updated / skipped invoice counts, plus the uploads
+    whose entries changed.
+    """
+    cursor.execute(
+        """
+        DELETE FROM daily_spending_entries e
+        WHERE e."uploadId" = %s
+          AND NOT EXISTS (
+            SELECT 1 FROM daily_spending_staging s
+            WHERE s."nomorInvoice" = e."nomorInvoice"
+          )
+        """,
+        (upload_id,),
+    )
+    cursor.execute(RESOLVE_QUERY, (upload_id,))
+    cursor.execute(
+        """
+        SELECT COUNT(*) FILTER (WHERE existing_id IS NULL) AS inserted,
+               COUNT(*) FILTER (WHERE existing_hash <> "contentHash") AS updated,
+               COUNT(*) FILTER (WHERE existing_hash = "contentHash") AS skipped
+        FROM daily_spending_resolved
+        """
+    )
+    counts = {key: int(value) for key, value in cursor.fetchone().items()}
+    cursor.execute(
+        """
+        SELECT DISTINCT existing_upload_id AS id FROM daily_spending_resolved
+        WHERE existing_upload_id IS NOT NULL AND existing_hash <> "contentHash"
+        """
+    )
+    touched = {upload_id} | {row["id"] for row in cursor.fetchall()}
+
+    conflict = '"uploadId", "nomorInvoice"'
+    if is_partitioned(cursor, "daily_spending_entries"):
+        conflict += ', "tanggalKunjungan"'
+        # A changed visit date would miss the conflict key; move the row instead
+        cursor.execute(
+            """
+            DELETE FROM daily_spending_entries e
+            USING daily_spending_resolved r
+            WHERE e.id = r.existing_id
+              AND e."tanggalKunjungan" = r.existing_tanggal
+              AND r.existing_tanggal <> r."tanggalKunjungan"
+            """
+        )
+    columns = ENTRY_COLUMNS + ("contentHash",)
+    column_list = ", ".join(f'"{column}"' for column in columns)
+    updates = ",\n              ".join(f'"{column}" = EXCLUDED."{column}"' for column in columns[1:])
+    cursor.execute(
+        f"""
+        INSERT INTO daily_spending_entries (id, "uploadId", {column_list}, "createdAt")
+        SELECT COALESCE(existing_id, id), COALESCE(existing_upload_id, %s), {column_list}, CURRENT_TIMESTAMP
+        FROM daily_spending_resolved
+        WHERE existing_hash IS DISTINCT FROM "contentHash"
+        ON CONFLICT ({conflict}) DO UPDATE
+          SET {updates}
+        """,
+        (upload_id,),
+    )
+    written = counts["inserted"] + counts["updated"]
+    if cursor.rowcount != written:
+        raise RuntimeError(
+            f"expected to write {written} entries but wrote {cursor.rowcount} "
+            "(invoices stored by a concurrent upload); re-run the file"
+        )
+    return {**counts, "uploads": touched}
+
+
+def ingest_file(path: str, report_date: Optional[datetime] = None,
+                uploaded_by: Optional[str] = None) -> Dict[str, object]:
+    totals = IngestTotals()
+    source = CopySource(staging_rows(parse_rows(iter_raw_rows(path)), totals))
+
+    with transaction() as cursor:
+        cursor.execute(STAGING_DDL)
+        cursor.copy_expert(
+            f"COPY daily_spending_staging (line_no, id, {ENTRY_COLUMN_LIST}) FROM STDIN WITH (FORMAT csv)",
+            source,
+        )
+        if totals.rows == 0:
+            raise ValueError("Tidak ada data valid yang bisa diproses dari file ini")
+
+        normalized_date = start_of_day(report_date or totals.first_date)
+        source_file_name = path.replace("\\", "/").rsplit("/", 1)[-1]
+        upload_id = upsert_upload(cursor, normalized_date, source_file_name, uploaded_by)
+        entries = upsert_entries(cursor, upload_id)
+        upload = next(row for row in refresh_upload_totals(cursor, entries.pop("uploads"))
+                      if row["id"] == upload_id)
+
+    return {
+        "upload_id": upload_id,
+        "report_date": normalized_date.date().isoformat(),
+        "rows": totals.rows,
+        **entries,
+        "kept": upload["totalRows"],
+        "total_pendapatan": upload["totalPendapatan"],
+        "total_keuntungan": upload["totalKeuntungan"],
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Ingest daily spending XLSX/CSV exports")
+    parser.add_argument("files", nargs="+", help="XLSX or CSV exports")
+    parser.add_argument("--report-date", help="Report date (YYYY-MM-DD); default: first visit date in each file")
+    parser.add_argument("--uploaded-by", help="Clerk user id recorded on the upload")
+    args = parser.parse_args()
+
+    report_date = None
+    if args.report_date:
+        report_date = parse_date_value(args.report_date)
+        if report_date is None:
+            print(f"ERROR: invalid --report-date {args.report_date}")
+            return 1
+
+    failures = 0
+    for path in args.files:
+        started = time.perf_counter()
+        try:
+            result = ingest_file(path, report_date, args.uploaded_by)
+        except Exception as exc:  # noqa: BLE001
+            failures += 1
+            print(f"ERROR: {path}: {exc}")
+            continue
+        elapsed = time.perf_counter() - started
+        print(
+            f"file={path} reportDate={result['report_date']} rows={result['rows']} "
+            f"inserted={result['inserted']} updated={result['updated']} skipped={result['skipped']} "
+            f"kept={result['kept']} "
+            f"totalPendapatan={result['total_pendapatan']} "
+            f"totalKeuntungan={result['total_keuntungan']} seconds={elapsed:.2f}"
+        )
+
+    if failures:
+        print(f"ERROR: {failures}/{len(args.files)} files failed")
+        return 1
+    print("SUCCESS: daily spending ingested.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,343 @@
+"""
+Credit members for clinic visits imported from the daily spending reports.
+
+daily_spending_entries only know the patient by name (and sometimes date of
+birth); members only earn spending points when the front office scans their
+QR code. This linker matches entries to users in one pass and inserts a
+``spending_records`` row (source ``import``) for each confident match.
+
+Users are loaded once into in-memory hash indexes on a few blocking keys,
+so each entry is compared only against the handful of users sharing a key:
+
+- name:   normalized full name, or the same name tokens in another order
+- dob:    date of birth plus first name token (catches spelling variants)
+- phone:  phones booked for this patient name in reservations, matched to
+          the user's phone
+
+Each candidate is scored (name 3, reordered name 2, first name only 1,
+date of birth 4, phone 3; confidence = score / 10). A date of birth that is
+known on both sides and differs rules the candidate out. The best candidate
+is linked when it reaches ``--min-score`` and no other candidate ties it.
+A visit the member already has a scan (or manual) spending record for, on
+the same day, is skipped: the front office credited it at the desk.
+
+pointsEarned follows the scan route (Rp 10.000 = 1 point); points are
+queued as user_balance_deltas and folded into users by earnings_ledger. Linked
+entries are remembered in ``spending_records."sourceEntryId"`` (unique), so
+re-runs only look at entries not linked yet and never credit a visit twice.
+The column comes from prisma/migration_spending_records_source_entry.sql
+(apply with migrate.py); the linker only checks that it is there.
+The front-office daily spending summary leaves ``import`` records out, as
+they repeat the daily_spending_entries it already counts.
+
+Usage:
+    python scripts/link_spending_members.py --dry-run --output matches.csv
+    python scripts/link_spending_members.py --since 2025-01-01
+"""
+
+from __future__ import annotations
+
+import argparse
+import csv
+import sys
+import time
+from collections import defaultdict
+from datetime import date
+from decimal import Decimal
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set
+
+import earnings_ledger
+from check_missing_referrals import phone_key
+from db import DEFAULT_ITERSIZE, stream, transaction
+from ids import cuids
+from ingest_daily_spending import parse_date_value
+
+NAME_WEIGHT = 3
+REORDERED_NAME_WEIGHT = 2
+FIRST_NAME_WEIGHT = 1
+DOB_WEIGHT = 4
+PHONE_WEIGHT = 3
+MAX_SCORE = NAME_WEIGHT + DOB_WEIGHT + PHONE_WEIGHT
+DEFAULT_MIN_SCORE = 6  # name + phone, name + date of birth, ...
+
+RUPIAH_PER_POINT = 10_000  # same as the front-office scan route
+INSERT_BATCH = 5_000
+SOURCE = "import"
+
+USERS_QUERY = """
+    SELECT id, "firstName", "lastName", "dateOfBirth", phone
+    FROM users
+    WHERE "firstName" IS NOT NULL OR "lastName" IS NOT NULL
+"""
+
+RESERVATION_PHONES_QUERY = """
+    SELECT DISTINCT "patientName", "patientPhone"
+    FROM reservations
+    WHERE "patientPhone" IS NOT NULL AND "patientPhone" <> ''
+"""
+
+SCANNED_QUERY = """
+    SELECT DISTINCT "userId", "spendingDate"::DATE AS day
+    FROM spending_records
+    WHERE source <> %s AND "spendingDate" >= %s
+"""
+
+ENTRIES_QUERY = """
+    SELECT e.id, e."nomorInvoice", e."namaPasien", e.dob, e."tanggalKunjungan", e.diagnosa, e."totalPendapatan"
+    FROM daily_spending_entries e
+    WHERE e."totalPendapatan" > 0
+      AND e."tanggalKunjungan" >= %s
+      AND NOT EXISTS (SELECT 1 FROM spending_records s WHERE s."sourceEntryId" = e.id)
+    ORDER BY e."tanggalKunjungan", e.id
+"""
+
+INSERT_QUERY = """
+    WITH linked AS (
+        INSERT INTO spending_records
+            (id, "userId", amount, treatment, "pointsEarned", "spendingDate", source, "sourceEntryId", "createdAt")
+        SELECT id, user_id, amount, treatment, points, spending_date, %(source)s, entry_id, CURRENT_TIMESTAMP
+        FROM unnest(%(ids)s::TEXT[], %(user_ids)s::TEXT[], %(amounts)s::NUMERIC[], %(treatments)s::TEXT[],
+                    %(points)s::INTEGER[], %(dates)s::TIMESTAMP[], %(entry_ids)s::TEXT[])
+            AS m(id, user_id, amount, treatment, points, spending_date, entry_id)
+        -- Scanned at the desk since the match was made
+        WHERE NOT EXISTS (
+            SELECT 1 FROM spending_records s
+            WHERE s."userId" = m.user_id AND s."spendingDate"::DATE = m.spending_date::DATE
+              AND s.source <> %(source)s
+        )
+        ON CONFLICT ("sourceEntryId") DO NOTHING
+        RETURNING "userId", "pointsEarned"
+    ),
+    deltas AS (
+        INSERT INTO user_balance_deltas ("userId", points)
+        SELECT "userId", "pointsEarned"
+        FROM linked
+        WHERE "pointsEarned" > 0
+        RETURNING id
+    )
+    SELECT (SELECT COUNT(*) FROM linked) AS linked,
+           (SELECT COALESCE(SUM("pointsEarned"), 0) FROM linked) AS points
+"""
+
+FIELDS = ['entry_id', 'nomor_invoice', 'nama_pasien', 'tanggal_kunjungan', 'amount', 'points',
+          'user_id', 'member_name', 'score', 'confidence', 'signals']
+
+
+class Member(NamedTuple):
+    id: str
+    name: str
+    dob: Optional[date]
+    phone: str
+
+
+class MemberIndex(NamedTuple):
+    by_name: Dict[str, List[Member]]
+    by_tokens: Dict[str, List[Member]]
+    by_dob_first: Dict[tuple, List[Member]]
+    by_phone: Dict[str, List[Member]]
+    patient_phones: Dict[str, Set[str]]  # patient name key -> phones booked under it
+    scanned: Set[tuple]  # (user id, day) with a non-import spending record
+
+
+def name_key(name) -> str:
+    return ' '.join((name or '').lower().split())
+
+
+def tokens_key(key: str) -> str:
+    return ' '.join(sorted(key.split()))
+
+
+def first_token(key: str) -> str:
+    return key.split(' ', 1)[0]
+
+
+def points_for(amount: Decimal) -> int:
+    return int(amount // RUPIAH_PER_POINT)
+
+
+def has_link_column(cursor) -> bool:
+    """Whether prisma/migration_spending_records_source_entry.sql has been applied."""
+    cursor.execute(
+        """
+        SELECT 1 FROM pg_attribute
+        WHERE attrelid = 'public.spending_records'::regclass AND attname = 'sourceEntryId' AND NOT attisdropped
+        """
+    )
+    return cursor.fetchone() is not None
+
+
+def build_index(since: date = date.min, itersize: int = DEFAULT_ITERSIZE) -> MemberIndex:
+    """Load users, reservation phones and scanned visits into hash maps."""
+    index = MemberIndex(defaultdict(list), defaultdict(list), defaultdict(list), defaultdict(list),
+                        defaultdict(set), set())
+    for row in stream(USERS_QUERY, itersize=itersize):
+        key = name_key(f"{row['firstName'] or ''} {row['lastName'] or ''}")
+        if not key:
+            continue
+        member = Member(row['id'], key, row['dateOfBirth'].date() if row['dateOfBirth'] else None,
+                        phone_key(row['phone']))
+        index.by_name[key].append(member)
+        index.by_tokens[tokens_key(key)].append(member)
+        if member.dob:
+            index.by_dob_first[(member.dob, first_token(key))].append(member)
+        if member.phone:
+            index.by_phone[member.phone].append(member)
+
+    for row in stream(RESERVATION_PHONES_QUERY, itersize=itersize):
+        phone = phone_key(row['patientPhone'])
+        if phone:
+            index.patient_phones[name_key(row['patientName'])].add(phone)
+
+    for row in stream(SCANNED_QUERY, (SOURCE, since), itersize=itersize):
+        index.scanned.add((row['userId'], row['day']))
+    return index
+
+
+def score_entry(index: MemberIndex, key: str, dob: Optional[date]) -> List[tuple]:
+    """[(score, member, signals)] for every candidate sharing a blocking key, best first."""
+    candidates: Dict[str, Member] = {}
+    for block in (index.by_name.get(key, ()), index.by_tokens.get(tokens_key(key), ()),
+                  index.by_dob_first.get((dob, first_token(key)), ()) if dob else ()):
+        for member in block:
+            candidates[member.id] = member
+    phones = index.patient_phones.get(key, ())
+    for phone in phones:
+        for member in index.by_phone.get(phone, ()):
+            candidates[member.id] = member
+
+    scored = []
+    for member in candidates.values():
+        if dob and member.dob and dob != member.dob:
+            continue
+        signals = []
+        total = 0
+        if member.name == key:
+            total += NAME_WEIGHT
+            signals.append('name')
+        elif tokens_key(member.name) == tokens_key(key):
+            total += REORDERED_NAME_WEIGHT
+            signals.append('name_reordered')
+        elif first_token(member.name) == first_token(key):
+            total += FIRST_NAME_WEIGHT
+            signals.append('first_name')
+        if dob and member.dob:
+            total += DOB_WEIGHT
+            signals.append('dob')
+        if member.phone and member.phone in phones:
+            total += PHONE_WEIGHT
+            signals.append('phone')
+        scored.append((total, member, signals))
+    scored.sort(key=lambda item: -item[0])
+    return scored
+
+
+def match_entries(index: MemberIndex, since: date, min_score: int = DEFAULT_MIN_SCORE,
+                  itersize: int = DEFAULT_ITERSIZE) -> Dict[str, object]:
+    """Score every unlinked entry; returns confident matches and counts."""
+    matches = []
+    counts = {'entries': 0, 'no_candidate': 0, 'low_score': 0, 'ambiguous': 0, 'already_scanned': 0}
+    for entry in stream(ENTRIES_QUERY, (since,), itersize=itersize):
+        counts['entries'] += 1
+        parsed = parse_date_value(entry['dob'])
+        scored = score_entry(index, name_key(entry['namaPasien']), parsed.date() if parsed else None)
+        if not scored:
+            counts['no_candidate'] += 1
+            continue
+        total, member, signals = scored[0]
+        if total < min_score:
+            counts['low_score'] += 1
+            continue
+        if len(scored) > 1 and scored[1][0] == total:
+            counts['ambiguous'] += 1
+            continue
+        if (member.id, entry['tanggalKunjungan'].date()) in index.scanned:
+            counts['already_scanned'] += 1
+            continue
+        matches.append({
+            'entry_id': entry['id'],
+            'nomor_invoice': entry['nomorInvoice'],
+            'nama_pasien': entry['namaPasien'],
+            'tanggal_kunjungan': entry['tanggalKunjungan'],
+            'diagnosa': entry['diagnosa'],
+            'amount': entry['totalPendapatan'],
+            'points': points_for(entry['totalPendapatan']),
+            'user_id': member.id,
+            'member_name': member.name,
+            'score': total,
+            'confidence': round(total / MAX_SCORE, 2),
+            'signals': '+'.join(signals),
+        })
+    counts['matched'] = len(matches)
+    return {'matches': matches, 'counts': counts}
+
+
+def link(matches: List[dict], batch_size: int = INSERT_BATCH) -> Dict[str, int]:
+    """Insert spending_records and point deltas for ``matches`` in one transaction."""
+    totals = {'linked': 0, 'points': 0}
+    if not matches:
+        return totals
+    with transaction() as cursor:
+        earnings_ledger.ensure_table(cursor)
+        for start in range(0, len(matches), batch_size):
+            batch = matches[start:start + batch_size]
+            cursor.execute(
+                INSERT_QUERY,
+                {
+                    'source': SOURCE,
+                    'ids': cuids(len(batch)),
+                    'user_ids': [match['user_id'] for match in batch],
+                    'amounts': [str(match['amount']) for match in batch],
+                    'treatments': [match['diagnosa'] for match in batch],
+                    'points': [match['points'] for match in batch],
+                    'dates': [match['tanggal_kunjungan'] for match in batch],
+                    'entry_ids': [match['entry_id'] for match in batch],
+                },
+            )
+            result = cursor.fetchone()
+            totals['linked'] += result['linked']
+            totals['points'] += int(result['points'])
+    return totals
+
+
+def write_matches(path: str, matches: Iterable[dict]) -> None:
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=FIELDS, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(matches)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Link daily spending visits to members as spending_records")
+    parser.add_argument('--since', type=date.fromisoformat, default=date.min,
+                        help="Only visits on or after this date (YYYY-MM-DD)")
+    parser.add_argument('--min-score', type=int, default=DEFAULT_MIN_SCORE,
+                        help=f"Lowest score linked, out of {MAX_SCORE} (default {DEFAULT_MIN_SCORE})")
+    parser.add_argument('--output', help="Write the confident matches to this CSV for review")
+    parser.add_argument('--dry-run', action='store_true', help="Match only; insert nothing")
+    parser.add_argument('--itersize', type=int, default=DEFAULT_ITERSIZE,
+                        help=f"Rows fetched per round trip (default {DEFAULT_ITERSIZE})")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    with transaction() as cursor:
+        if not has_link_column(cursor):
+            print('ERROR: spending_records."sourceEntryId" is missing; run python scripts/migrate.py first')
+            return 1
+    index = build_index(args.since, args.itersize)
+    result = match_entries(index, args.since, args.min_score, args.itersize)
+    matches = result['matches']
+    if args.output:
+        write_matches(args.output, matches)
+
+    counts = ' '.join(f"{key}={value}" for key, value in result['counts'].items())
+    if args.dry_run:
+        print(f"{counts} points={sum(match['points'] for match in matches)} (dry run)")
+    else:
+        totals = link(matches)
+        print(f"{counts} linked={totals['linked']} points={totals['points']}")
+    print(f"seconds={time.perf_counter() - started:.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
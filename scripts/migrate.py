@@ -0,0 +1,402 @@
+"""
+Apply prisma/migration_*.sql files without blocking writes.
+
+Each file is split into statements and run as a sequence of steps:
+
+- ``CREATE [UNIQUE] INDEX`` is rewritten to ``CREATE INDEX CONCURRENTLY``
+  and run on its own outside a transaction, so reservations and spending
+  keep taking writes while the index builds. An invalid index left by an
+  earlier failed concurrent build is dropped (concurrently) first.
+- statements that cannot run in a transaction (already ``CONCURRENTLY``,
+  ``VACUUM``) also run on their own.
+- consecutive other statements run together in one transaction.
+
+Every step runs with ``lock_timeout`` set, so a step stuck behind a long
+transaction gives up instead of queueing all writers behind itself. It is
+then retried with backoff; a transaction step is rolled back before the
+retry and a failed concurrent build is dropped, so a retry does not repeat
+work. The statement timeout is lifted for the duration of a step.
+
+Applied files are recorded in ``schema_migrations`` (version = file name
+without .sql, plus a checksum), and a file is recorded once all of its
+steps succeed. Files run in the order of their ``-- Date:`` header, then
+by name. Files are not all safe to run twice (migration_team_affiliate.sql
+promotes every user to team leader), so a file that failed half-way is not
+simply re-run, and on a database where the files were already applied by
+hand, ``--baseline`` must be run once to record them without executing
+anything. The runner refuses to start while ``schema_migrations`` is empty
+but the schema shows hand-applied migrations (see ``HAND_APPLIED_MARKERS``).
+
+Usage:
+    python scripts/migrate.py --status
+    python scripts/migrate.py --dry-run                 # show the steps, run nothing
+    python scripts/migrate.py                           # apply pending migrations
+    python scripts/migrate.py --baseline                # record all as applied, run nothing
+    python scripts/migrate.py --baseline migration_team_affiliate migration_blog_posts
+    python scripts/migrate.py --lock-timeout-ms 2000 --retries 10
+"""
+
+from __future__ import annotations
+
+import argparse
+import glob
+import hashlib
+import os
+import re
+import sys
+import time
+from typing import Dict, List, NamedTuple, Optional
+
+from psycopg2 import errors
+
+from db import connection, transaction
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "prisma")
+MIGRATION_GLOB = "migration_*.sql"
+
+DEFAULT_LOCK_TIMEOUT_MS = 3000
+DEFAULT_RETRIES = 5
+DEFAULT_RETRY_WAIT = 2.0
+
+MIGRATIONS_DDL = """
+CREATE TABLE IF NOT EXISTS public.schema_migrations (
+  version TEXT PRIMARY KEY,
+  checksum TEXT NOT NULL,
+  "appliedAt" TIMESTAMP(3) NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  "durationMs" INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+DATE_HEADER = re.compile(r"^--\s*Date:\s*(\d{4}-\d{2}-\d{2})", re.MULTILINE)
+CREATE_INDEX = re.compile(
+    r"^(CREATE\s+(?:UNIQUE\s+)?INDEX)\s+(?!CONCURRENTLY\b)(.*)$", re.IGNORECASE | re.DOTALL
+)
+INDEX_NAME = re.compile(
+    r"^CREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+(?:IF\s+NOT\s+EXISTS\s+)?"
+    r"(\"(?:[^\"]|\"\")+\"|[A-Za-z_][A-Za-z0-9_$]*)",
+    re.IGNORECASE,
+)
+# Statements PostgreSQL refuses to run inside a transaction block
+NON_TRANSACTIONAL = re.compile(
+    r"^(?:(?:CREATE\s+(?:UNIQUE\s+)?INDEX|DROP\s+INDEX|REINDEX\s+\w+)\s+CONCURRENTLY\b|VACUUM\b)",
+    re.IGNORECASE,
+)
+DOLLAR_TAG = re.compile(r"\$[A-Za-z_0-9]*\$")
+
+
+class Step(NamedTuple):
+    concurrent: bool
+    statements: List[str]
+
+    def summary(self) -> str:
+        first = " ".join(self.statements[0].split())
+        more = f" (+{len(self.statements) - 1} more)" if len(self.statements) > 1 else ""
+        return (first if len(first) <= 90 else first[:87] + "...") + more
+
+
+class Migration(NamedTuple):
+    version: str
+    path: str
+    date: str
+    checksum: str
+    sql: str
+
+
+def split_statements(sql: str) -> List[str]:
+    """Split SQL on top-level semicolons, keeping quotes, comments and $$ bodies intact.
+
+    Comment-only fragments are dropped and leading comments are stripped.
+    """
+    statements: List[str] = []
+    current: List[str] = []
+    has_code = False
+    i, n = 0, len(sql)
+    while i < n:
+        ch = sql[i]
+        if ch == "-" and sql.startswith("--", i):
+            end = sql.find("\n", i)
+            end = n if end < 0 else end + 1
+            if has_code:
+                current.append(sql[i:end])
+            i = end
+            continue
+        if ch == "/" and sql.startswith("/*", i):
+            end = sql.find("*/", i + 2)
+            end = n if end < 0 else end + 2
+            if has_code:
+                current.append(sql[i:end])
+            i = end
+            continue
+        if ch in "'\"":
+            end = i + 1
+            while end < n:
+                if sql[end] == ch:
+                    if end + 1 < n and sql[end + 1] == ch:
+                        end += 2
+                        continue
+                    break
+                end += 1
+            current.append(sql[i:end + 1])
+            has_code = True
+            i = end + 1
+            continue
+        if ch == "$":
+            tag = DOLLAR_TAG.match(sql, i)
+            if tag:
+                end = sql.find(tag.group(), tag.end())
+                end = n if end < 0 else end + len(tag.group())
+                current.append(sql[i:end])
+                has_code = True
+                i = end
+                continue
+        if ch == ";":
+            if has_code:
+                statements.append("".join(current).strip())
+            current, has_code = [], False
+            i += 1
+            continue
+        if not ch.isspace():
+            has_code = True
+        if has_code:
+            current.append(ch)
+        i += 1
+    if has_code and "".join(current).strip():
+        statements.append("".join(current).strip())
+    return statements
+
+
+def plan(sql: str) -> List[Step]:
+    """Group statements into steps, rewriting index builds to run concurrently."""
+    steps: List[Step] = []
+    for statement in split_statements(sql):
+        match = CREATE_INDEX.match(statement)
+        if match:
+            steps.append(Step(True, [f"{match.group(1)} CONCURRENTLY {match.group(2)}"]))
+        elif NON_TRANSACTIONAL.match(statement):
+            steps.append(Step(True, [statement]))
+        elif steps and not steps[-1].concurrent:
+            steps[-1].statements.append(statement)
+        else:
+            steps.append(Step(False, [statement]))
+    return steps
+
+
+def discover(directory: str = MIGRATIONS_DIR) -> List[Migration]:
+    migrations = []
+    for path in glob.glob(os.path.join(directory, MIGRATION_GLOB)):
+        with open(path, encoding="utf-8") as f:
+            sql = f.read()
+        header = DATE_HEADER.search(sql)
+        migrations.append(Migration(
+            version=os.path.splitext(os.path.basename(path))[0],
+            path=path,
+            # Undated files run after dated ones
+            date=header.group(1) if header else "9999-12-31",
+            checksum=hashlib.sha256(sql.encode("utf-8")).hexdigest(),
+            sql=sql,
+        ))
+    return sorted(migrations, key=lambda migration: (migration.date, migration.version))
+
+
+# Objects created by migration files that were applied by hand before this runner existed
+HAND_APPLIED_MARKERS = (
+    ("users.\"isTeamLeader\"", "SELECT 1 FROM pg_attribute WHERE attrelid = to_regclass('public.users') "
+                                "AND attname = 'isTeamLeader' AND NOT attisdropped"),
+    ("best_deal_promos", "SELECT 1 WHERE to_regclass('public.best_deal_promos') IS NOT NULL"),
+    ("blog_posts", "SELECT 1 WHERE to_regclass('public.blog_posts') IS NOT NULL"),
+)
+
+
+def hand_applied() -> List[str]:
+    """Markers of hand-applied migrations present in the schema."""
+    found = []
+    with transaction() as cursor:
+        for name, query in HAND_APPLIED_MARKERS:
+            cursor.execute(query)
+            if cursor.fetchone():
+                found.append(name)
+    return found
+
+
+def applied_versions() -> Dict[str, dict]:
+    with transaction() as cursor:
+        cursor.execute(MIGRATIONS_DDL)
+        cursor.execute('SELECT version, checksum, "appliedAt", "durationMs" FROM public.schema_migrations')
+        return {row["version"]: row for row in cursor.fetchall()}
+
+
+def record(migration: Migration, duration_ms: int) -> None:
+    with transaction() as cursor:
+        cursor.execute(
+            """
+            INSERT INTO public.schema_migrations (version, checksum, "appliedAt", "durationMs")
+            VALUES (%s, %s, CURRENT_TIMESTAMP, %s)
+            ON CONFLICT (version) DO UPDATE
+            SET checksum = EXCLUDED.checksum, "appliedAt" = EXCLUDED."appliedAt", "durationMs" = EXCLUDED."durationMs"
+            """,
+            (migration.version, migration.checksum, duration_ms),
+        )
+
+
+def drop_invalid_index(cursor, statement: str) -> Optional[str]:
+    """Drop the index ``statement`` builds if an earlier build left it invalid."""
+    match = INDEX_NAME.match(statement)
+    if not match:
+        return None
+    name = match.group(1)
+    cursor.execute(
+        """
+        SELECT i.indexrelid::regclass::text
+        FROM pg_index i
+        JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE c.relname = %s AND c.relnamespace = 'public'::regnamespace AND NOT i.indisvalid
+        """,
+        (name[1:-1].replace('""', '"') if name.startswith('"') else name.lower(),),
+    )
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {row[0]}")
+    return row[0]
+
+
+def run_step(conn, step: Step, retries: int, retry_wait: float) -> int:
+    """Run one step, retrying lock timeouts; returns the number of attempts."""
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            conn.autocommit = step.concurrent
+            with conn.cursor() as cursor:
+                if step.concurrent:
+                    dropped = drop_invalid_index(cursor, step.statements[0])
+                    if dropped:
+                        print(f"    dropped invalid index {dropped} from an earlier build")
+                for statement in step.statements:
+                    cursor.execute(statement)
+            if not step.concurrent:
+                conn.commit()
+            return attempt
+        except (errors.LockNotAvailable, errors.DeadlockDetected) as exc:
+            if not step.concurrent:
+                conn.rollback()
+            if attempt > retries:
+                raise
+            wait = retry_wait * 2 ** (attempt - 1)
+            print(f"    {type(exc).__name__} on attempt {attempt}; retrying in {wait:.1f}s")
+            time.sleep(wait)
+        except BaseException:
+            if not step.concurrent and not conn.closed:
+                conn.rollback()
+            raise
+
+
+def apply(migration: Migration, lock_timeout_ms: int = DEFAULT_LOCK_TIMEOUT_MS,
+          retries: int = DEFAULT_RETRIES, retry_wait: float = DEFAULT_RETRY_WAIT) -> float:
+    """Run every step of ``migration`` and record it; returns elapsed seconds."""
+    started = time.perf_counter()
+    with connection() as conn:
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            cursor.execute("SET lock_timeout = %s", (int(lock_timeout_ms),))
+            cursor.execute("SET statement_timeout = 0")
+        try:
+            for number, step in enumerate(plan(migration.sql), 1):
+                step_started = time.perf_counter()
+                attempts = run_step(conn, step, retries, retry_wait)
+                kind = "concurrent" if step.concurrent else "transaction"
+                print(f"  step {number} {kind:11s} {time.perf_counter() - step_started:8.3f}s "
+                      f"attempts={attempts}  {step.summary()}")
+        finally:
+            if not conn.closed:
+                conn.rollback()
+                conn.autocommit = True
+                with conn.cursor() as cursor:
+                    cursor.execute("RESET lock_timeout")
+                    cursor.execute("RESET statement_timeout")
+    elapsed = time.perf_counter() - started
+    record(migration, int(elapsed * 1000))
+    return elapsed
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Apply prisma/migration_*.sql with concurrent index builds")
+    parser.add_argument("--dir", default=MIGRATIONS_DIR, help="Directory holding migration_*.sql")
+    parser.add_argument("--status", action="store_true", help="List migrations and whether they are applied")
+    parser.add_argument("--dry-run", action="store_true", help="Print the steps of pending migrations")
+    parser.add_argument("--baseline", nargs="*", metavar="VERSION",
+                        help="Record the given migrations (default: every pending one) as applied "
+                             "without running them")
+    parser.add_argument("--lock-timeout-ms", type=int, default=DEFAULT_LOCK_TIMEOUT_MS,
+                        help=f"lock_timeout per step (default {DEFAULT_LOCK_TIMEOUT_MS})")
+    parser.add_argument("--retries", type=int, default=DEFAULT_RETRIES,
+                        help=f"Retries per step after a lock timeout (default {DEFAULT_RETRIES})")
+    parser.add_argument("--retry-wait", type=float, default=DEFAULT_RETRY_WAIT,
+                        help=f"First retry wait in seconds, doubled each time (default {DEFAULT_RETRY_WAIT})")
+    args = parser.parse_args()
+
+    migrations = discover(args.dir)
+    applied = applied_versions()
+
+    if args.status:
+        for migration in migrations:
+            row = applied.get(migration.version)
+            if row is None:
+                state = "pending"
+            elif row["checksum"] != migration.checksum:
+                state = f"applied {row['appliedAt']:%Y-%m-%d %H:%M} (file changed since)"
+            else:
+                state = f"applied {row['appliedAt']:%Y-%m-%d %H:%M} in {row['durationMs']} ms"
+            print(f"{migration.version:40s} {state}")
+        return 0
+
+    pending = [migration for migration in migrations if migration.version not in applied]
+    if not pending:
+        print("No pending migrations.")
+        return 0
+
+    if args.baseline is not None:
+        unknown = set(args.baseline) - {migration.version for migration in pending}
+        if unknown:
+            print(f"ERROR: not pending: {', '.join(sorted(unknown))}")
+            return 1
+        for migration in pending:
+            if args.baseline and migration.version not in args.baseline:
+                continue
+            record(migration, 0)
+            print(f"{migration.version}: recorded as applied")
+        return 0
+
+    if not applied and not args.dry_run:
+        markers = hand_applied()
+        if markers:
+            print(f"ERROR: schema_migrations is empty but {', '.join(markers)} already exist, so the "
+                  "migration files were applied by hand.")
+            print("Re-running them is not safe; record the hand-applied ones with "
+                  "--baseline VERSION ... first, then run again to apply the rest.")
+            return 1
+
+    total = time.perf_counter()
+    for migration in pending:
+        print(f"{migration.version} ({os.path.basename(migration.path)})")
+        if args.dry_run:
+            for number, step in enumerate(plan(migration.sql), 1):
+                kind = "concurrent" if step.concurrent else "transaction"
+                print(f"  step {number} {kind:11s} {step.summary()}")
+            continue
+        try:
+            elapsed = apply(migration, args.lock_timeout_ms, args.retries, args.retry_wait)
+        except Exception as exc:  # noqa: BLE001
+            print(f"ERROR: {migration.version} failed: {exc}")
+            print("Earlier steps of this file stay applied and it is not recorded. Re-running repeats "
+                  "the whole file: finish it by hand and record it with --baseline unless every "
+                  "step is safe to repeat.")
+            return 1
+        print(f"  applied in {elapsed:.2f}s")
+    if not args.dry_run:
+        print(f"SUCCESS: {len(pending)} migrations applied in {time.perf_counter() - total:.2f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,263 @@
+"""Indexed patient-name lookup for reservations and daily spending entries.
+
+Names are matched on ``LOWER(name)`` in three modes:
+
+- exact:   ``LOWER(name) = 'fika'``
+- prefix:  ``LOWER(name) LIKE 'fik%'``
+- similar: pg_trgm similarity ranking, so "Fika A." still finds "FIKA"
+
+Exact and prefix lookups use a ``LOWER(name) text_pattern_ops`` btree
+index, similarity lookups a ``gin_trgm_ops`` index. Create them once with::
+
+    python scripts/patient_lookup.py --install-indexes
+
+When the pg_trgm extension is not available, similar mode falls back to
+ranking the distinct names with difflib in Python (a full scan).
+
+Usage:
+    python scripts/patient_lookup.py "fika a"                      # similar, reservations
+    python scripts/patient_lookup.py wild --mode prefix
+    python scripts/patient_lookup.py "wildan arif" --mode exact --table daily_spending_entries
+"""
+
+from __future__ import annotations
+
+import argparse
+import difflib
+import sys
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+import psycopg2
+
+from db import transaction
+
+EXACT = "exact"
+PREFIX = "prefix"
+SIMILAR = "similar"
+MODES = (EXACT, PREFIX, SIMILAR)
+
+DEFAULT_SIMILARITY = 0.3
+
+
+class LookupTarget(NamedTuple):
+    table: str
+    alias: str
+    column: str
+    order: str
+
+    @property
+    def key(self) -> str:
+        return f'LOWER({self.alias}."{self.column}")'
+
+
+RESERVATIONS = LookupTarget("reservations", "r", "patientName", 'r."createdAt" DESC')
+DAILY_SPENDING_ENTRIES = LookupTarget("daily_spending_entries", "e", "namaPasien", 'e."tanggalKunjungan" DESC')
+TARGETS = {target.table: target for target in (RESERVATIONS, DAILY_SPENDING_ENTRIES)}
+
+LOWER_INDEX_DDL = {
+    "reservations": """
+        CREATE INDEX IF NOT EXISTS reservations_patient_name_lower_idx
+          ON public.reservations (LOWER("patientName") text_pattern_ops);
+    """,
+    "daily_spending_entries": """
+        CREATE INDEX IF NOT EXISTS daily_spending_entries_nama_pasien_lower_idx
+          ON public.daily_spending_entries (LOWER("namaPasien") text_pattern_ops);
+    """,
+}
+
+TRIGRAM_INDEX_DDL = {
+    "reservations": """
+        CREATE INDEX IF NOT EXISTS reservations_patient_name_trgm_idx
+          ON public.reservations USING gin (LOWER("patientName") gin_trgm_ops);
+    """,
+    "daily_spending_entries": """
+        CREATE INDEX IF NOT EXISTS daily_spending_entries_nama_pasien_trgm_idx
+          ON public.daily_spending_entries USING gin (LOWER("namaPasien") gin_trgm_ops);
+    """,
+}
+
+
+def normalize(name: str) -> str:
+    return name.strip().lower()
+
+
+def escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def has_trigram(cursor) -> bool:
+    with cursor.connection.cursor() as plain:
+        plain.execute("SELECT EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm')")
+        return plain.fetchone()[0]
+
+
+def install_indexes(cursor) -> List[str]:
+    """Create the lookup indexes on every existing target table.
+
+    Returns the names of the tables that got trigram indexes; that list is
+    empty when pg_trgm cannot be installed on this server.
+    """
+    with cursor.connection.cursor() as plain:
+        tables = []
+        for table in TARGETS:
+            plain.execute("SELECT to_regclass(%s)", (f"public.{table}",))
+            if plain.fetchone()[0]:
+                tables.append(table)
+
+        for table in tables:
+            plain.execute(LOWER_INDEX_DDL[table])
+
+        plain.execute("SAVEPOINT pg_trgm")
+        try:
+            plain.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        except psycopg2.Error as exc:
+            plain.execute("ROLLBACK TO SAVEPOINT pg_trgm")
+            print(f"WARNING: pg_trgm unavailable, similar mode will scan: {str(exc).splitlines()[0]}")
+            return []
+        plain.execute("RELEASE SAVEPOINT pg_trgm")
+
+        for table in tables:
+            plain.execute(TRIGRAM_INDEX_DDL[table])
+    return tables
+
+
+def _select(target: LookupTarget, columns: str, join: str) -> str:
+    return f"""
+        SELECT {target.key} AS patient_key, {columns}
+        FROM {target.table} {target.alias}
+        {join}
+    """
+
+
+def search(
+    cursor,
+    name: str,
+    mode: str = EXACT,
+    target: LookupTarget = RESERVATIONS,
+    columns: Optional[str] = None,
+    join: str = "",
+    where: str = "",
+    limit: Optional[int] = None,
+    threshold: float = DEFAULT_SIMILARITY,
+) -> List[dict]:
+    """Rows of ``target`` whose name matches ``name``.
+
+    ``columns``, ``join`` and ``where`` (starting with AND) extend the query
+    and refer to the target through its alias (``r`` or ``e``). Rows are
+    ordered newest first; similar mode adds a ``score`` column and ranks by
+    it first.
+    """
+    if mode not in MODES:
+        raise ValueError(f"unknown lookup mode: {mode}")
+    columns = columns or f"{target.alias}.*"
+    query = _select(target, columns, join)
+    key = normalize(name)
+    params: Dict[str, object] = {"key": key, "limit": limit}
+
+    if mode == EXACT:
+        query += f"WHERE {target.key} = %(key)s {where} ORDER BY {target.order}"
+    elif mode == PREFIX:
+        params["pattern"] = escape_like(key) + "%"
+        query += f"WHERE {target.key} LIKE %(pattern)s {where} ORDER BY {target.key}, {target.order}"
+    elif has_trigram(cursor):
+        cursor.execute("SET LOCAL pg_trgm.similarity_threshold = %s", (threshold,))
+        query = _select(target, f"similarity({target.key}, %(key)s) AS score, {columns}", join)
+        query += f"WHERE {target.key} %% %(key)s {where} ORDER BY score DESC, {target.order}"
+    else:
+        return _similar_fallback(cursor, key, target, columns, join, where, limit, threshold)
+
+    cursor.execute(query + " LIMIT %(limit)s", params)
+    return cursor.fetchall()
+
+
+def _similar_fallback(cursor, key, target, columns, join, where, limit, threshold) -> List[dict]:
+    cursor.execute(f"SELECT DISTINCT {target.key} AS patient_key FROM {target.table} {target.alias}")
+    scores = {}
+    for row in cursor.fetchall():
+        score = difflib.SequenceMatcher(None, key, row["patient_key"]).ratio()
+        if score >= threshold:
+            scores[row["patient_key"]] = score
+    if not scores:
+        return []
+
+    cursor.execute(
+        _select(target, columns, join)
+        + f"WHERE {target.key} = ANY(%(keys)s) {where} ORDER BY {target.order}",
+        {"keys": list(scores)},
+    )
+    rows = [dict(row, score=scores[row["patient_key"]]) for row in cursor.fetchall()]
+    rows.sort(key=lambda row: row["score"], reverse=True)
+    return rows[:limit] if limit else rows
+
+
+def latest(
+    cursor,
+    names: Iterable[str],
+    target: LookupTarget = RESERVATIONS,
+    columns: Optional[str] = None,
+    join: str = "",
+    where: str = "",
+) -> Dict[str, dict]:
+    """Newest exact match per name for the whole list in one query.
+
+    Returns {normalized name: row}; names without a match are absent.
+    """
+    keys = sorted({normalize(name) for name in names})
+    cursor.execute(
+        f"""
+        SELECT DISTINCT ON ({target.key}) {target.key} AS patient_key, {columns or f"{target.alias}.*"}
+        FROM {target.table} {target.alias}
+        {join}
+        WHERE {target.key} = ANY(%s)
+        {where}
+        ORDER BY {target.key}, {target.order}
+        """,
+        (keys,),
+    )
+    return {row["patient_key"]: row for row in cursor.fetchall()}
+
+
+def suggest(cursor, name: str, target: LookupTarget = RESERVATIONS, limit: int = 5) -> List[str]:
+    """Distinct names similar to ``name``, best first."""
+    seen: List[str] = []
+    for row in search(cursor, name, SIMILAR, target, columns=f'{target.alias}."{target.column}" AS name'):
+        if row["name"] not in seen:
+            seen.append(row["name"])
+        if len(seen) >= limit:
+            break
+    return seen
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Look up patients by name")
+    parser.add_argument("name", nargs="?", help="Patient name (or prefix)")
+    parser.add_argument("--mode", choices=MODES, default=SIMILAR, help="Match mode (default similar)")
+    parser.add_argument("--table", choices=sorted(TARGETS), default=RESERVATIONS.table)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--threshold", type=float, default=DEFAULT_SIMILARITY,
+                        help=f"Minimum similarity in similar mode (default {DEFAULT_SIMILARITY})")
+    parser.add_argument("--install-indexes", action="store_true", help="Create the lookup indexes")
+    args = parser.parse_args()
+
+    if args.install_indexes:
+        with transaction() as cursor:
+            trigram_tables = install_indexes(cursor)
+        print(f"SUCCESS: lookup indexes ready (trigram: {', '.join(trigram_tables) or 'none'}).")
+        return 0
+    if not args.name:
+        parser.error("name is required unless --install-indexes is given")
+
+    target = TARGETS[args.table]
+    with transaction() as cursor:
+        rows = search(cursor, args.name, args.mode, target, limit=args.limit, threshold=args.threshold)
+
+    for row in rows:
+        score = f"{row['score']:.2f} " if "score" in row else ""
+        when = row["createdAt"] if target is RESERVATIONS else row["tanggalKunjungan"]
+        print(f"{score}{row[target.column]:30s} {when} {row['id']}")
+    print(f"=== {len(rows)} match(es) ===")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
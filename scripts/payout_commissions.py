@@ -0,0 +1,227 @@
+"""
+Pay out commissions for completed, attributed, unpaid reservations.
+
+The attribution scripts only pay a commission when the reservation is
+already ``completed``; reservations completed later stay at
+``commissionPaid = false``. This worker claims batches of them with
+``FOR UPDATE SKIP LOCKED`` and pays each batch in one transaction:
+
+- one ``transactions`` row (type commission) per reservation
+- one ``user_balance_deltas`` row per reservation (see earnings_ledger.py)
+- ``commissionPaid = true``
+
+Claimed rows stay locked until the batch commits, so any number of workers
+(processes or machines) can run side by side without paying a reservation
+twice; each just skips the rows another worker holds. The front-office
+reservations route pays under the same row lock, and a reservation that
+already has a commission transaction (paid by an older app version that
+did not set ``commissionPaid``) is never claimed. No batch touches a
+``users`` row, so workers do not queue behind a big team's referrer; the
+deltas are folded into balances when the queue is drained. The stored
+``commissionAmount`` is paid; reservations stored with 0 are priced with
+the commission rate table first.
+
+Usage:
+    python scripts/payout_commissions.py                       # drain the queue once
+    python scripts/payout_commissions.py --workers 4           # 4 processes in parallel
+    python scripts/payout_commissions.py --follow --poll-seconds 30
+"""
+
+from __future__ import annotations
+
+import argparse
+import multiprocessing
+import sys
+import time
+from typing import Dict, List, Optional
+
+import earnings_ledger
+from commission import compute_batch, get_rate_table, points_for
+from db import close_pool, transaction
+from ids import cuids
+
+DEFAULT_BATCH_SIZE = 500
+
+CLAIM_QUERY = """
+    SELECT
+        r.id,
+        r."referrerId",
+        r."patientName",
+        (r."commissionAmount" * 100)::BIGINT AS amount_cents,
+        (r."finalPrice" * 100)::BIGINT AS price_cents,
+        t."categoryId",
+        r."reservationDate"::DATE - DATE '1970-01-01' AS day
+    FROM reservations r
+    JOIN treatments t ON t.id = r."treatmentId"
+    WHERE r.status = 'completed'
+    AND r."referrerId" IS NOT NULL
+    AND NOT r."commissionPaid"
+    AND NOT EXISTS (
+        SELECT 1 FROM transactions tx WHERE tx."referenceId" = r.id AND tx.type = 'commission'
+    )
+    ORDER BY r."completedAt" NULLS FIRST, r.id
+    LIMIT %s
+    FOR UPDATE OF r SKIP LOCKED
+"""
+
+PAY_QUERY = """
+    WITH payout AS (
+        SELECT *
+        FROM unnest(%s::TEXT[], %s::TEXT[], %s::TEXT[], %s::TEXT[], %s::BIGINT[], %s::BIGINT[])
+            AS p(reservation_id, referrer_id, transaction_id, patient_name, amount_cents, points)
+    ),
+    paid AS (
+        UPDATE reservations r
+        SET "commissionPaid" = true,
+            "commissionAmount" = p.amount_cents / 100.0,
+            "updatedAt" = NOW()
+        FROM payout p
+        WHERE r.id = p.reservation_id
+        RETURNING r.id
+    ),
+    ledger AS (
+        INSERT INTO transactions
+            (id, "userId", type, amount, points, description, "referenceId", "createdAt")
+        SELECT transaction_id, referrer_id, 'commission', amount_cents / 100.0, points,
+               'Commission from referral: ' || patient_name, reservation_id, NOW()
+        FROM payout
+        RETURNING id
+    ),
+    deltas AS (
+        INSERT INTO user_balance_deltas ("userId", earnings, referrals, points, "transactionId")
+        SELECT referrer_id, amount_cents / 100.0, 1, points, transaction_id
+        FROM payout
+        RETURNING id
+    )
+    SELECT
+        (SELECT COUNT(*) FROM paid) AS paid,
+        (SELECT COUNT(*) FROM ledger) AS transactions,
+        (SELECT COUNT(*) FROM deltas) AS deltas,
+        (SELECT COALESCE(SUM(amount_cents), 0) FROM payout) AS amount_cents
+"""
+
+
+def pay_batch(batch_size: int = DEFAULT_BATCH_SIZE) -> Dict[str, int]:
+    """Claim and pay one batch; returns counts (paid = 0 when nothing was claimable)."""
+    with transaction() as cursor:
+        cursor.execute(CLAIM_QUERY, (batch_size,))
+        rows = cursor.fetchall()
+        if not rows:
+            return {'paid': 0, 'transactions': 0, 'deltas': 0, 'amount_cents': 0}
+
+        # Commission stored as 0 was never priced; price it like the attribution paths
+        unpriced = [row for row in rows if not row['amount_cents']]
+        if unpriced:
+            _, amounts, _ = compute_batch(
+                get_rate_table(),
+                [row['price_cents'] for row in unpriced],
+                [row['referrerId'] for row in unpriced],
+                [row['categoryId'] for row in unpriced],
+                [row['day'] for row in unpriced],
+            )
+            for row, amount in zip(unpriced, amounts):
+                row['amount_cents'] = int(amount)
+
+        amounts = [row['amount_cents'] for row in rows]
+        earnings_ledger.ensure_table(cursor)
+        cursor.execute(
+            PAY_QUERY,
+            (
+                [row['id'] for row in rows],
+                [row['referrerId'] for row in rows],
+                cuids(len(rows)),
+                [row['patientName'] for row in rows],
+                amounts,
+                [points_for(amount) for amount in amounts],
+            ),
+        )
+        result = cursor.fetchone()
+        if result['paid'] != len(rows):
+            raise RuntimeError(f"claimed {len(rows)} reservations but updated {result['paid']}")
+        return {key: int(value) for key, value in result.items()}
+
+
+def run(batch_size: int = DEFAULT_BATCH_SIZE, follow: bool = False, poll_seconds: float = 30.0,
+        max_batches: Optional[int] = None) -> Dict[str, float]:
+    """Pay batches until none are left (or forever with ``follow``); returns totals."""
+    totals = {'batches': 0, 'paid': 0, 'amount_cents': 0}
+    started = time.perf_counter()
+    while max_batches is None or totals['batches'] < max_batches:
+        result = pay_batch(batch_size)
+        if not result['paid']:
+            if not follow:
+                break
+            time.sleep(poll_seconds)
+            continue
+        totals['batches'] += 1
+        for key in ('paid', 'amount_cents'):
+            totals[key] += result[key]
+        if follow and result['paid'] < batch_size:
+            earnings_ledger.fold()
+    totals['seconds'] = time.perf_counter() - started
+    earnings_ledger.fold()
+    return totals
+
+
+def _worker(batch_size: int, follow: bool, poll_seconds: float, queue) -> None:
+    try:
+        queue.put(run(batch_size, follow, poll_seconds))
+    except BaseException as exc:
+        queue.put({'error': f"{type(exc).__name__}: {exc}"})
+        raise
+
+
+def run_parallel(workers: int, batch_size: int = DEFAULT_BATCH_SIZE, follow: bool = False,
+                 poll_seconds: float = 30.0) -> List[Dict[str, float]]:
+    """Run ``workers`` worker processes against the same queue; returns each one's totals."""
+    # Children open their own pools
+    close_pool()
+    context = multiprocessing.get_context("fork")
+    queue = context.Queue()
+    processes = [
+        context.Process(target=_worker, args=(batch_size, follow, poll_seconds, queue), name=f"payout-{i}")
+        for i in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    results = [queue.get() for _ in processes]
+    for process in processes:
+        process.join()
+    # A worker's final fold can be skipped while another holds the fold lock
+    earnings_ledger.fold()
+    errors = [result['error'] for result in results if 'error' in result]
+    if errors:
+        # Batches committed by the other workers stand; failed batches rolled back
+        raise RuntimeError(f"payout workers failed: {'; '.join(errors)}")
+    return results
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Pay commissions for completed, unpaid reservations")
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help=f"Reservations claimed per transaction (default {DEFAULT_BATCH_SIZE})")
+    parser.add_argument('--workers', type=int, default=1, help="Worker processes (default 1)")
+    parser.add_argument('--follow', action='store_true', help="Keep polling for new completions")
+    parser.add_argument('--poll-seconds', type=float, default=30.0,
+                        help="With --follow, wait this long when the queue is empty (default 30)")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    if args.workers > 1:
+        results = run_parallel(args.workers, args.batch_size, args.follow, args.poll_seconds)
+    else:
+        results = [run(args.batch_size, args.follow, args.poll_seconds)]
+    wall = time.perf_counter() - started
+
+    for i, result in enumerate(results):
+        rate = result['paid'] / result['seconds'] if result['seconds'] else 0.0
+        print(f"worker {i}: batches={result['batches']} paid={result['paid']} "
+              f"amount=Rp {result['amount_cents'] / 100:,.0f} payouts/sec={rate:,.1f}")
+    paid = sum(result['paid'] for result in results)
+    print(f"TOTAL: paid={paid} amount=Rp {sum(result['amount_cents'] for result in results) / 100:,.0f} "
+          f"seconds={wall:.2f} payouts/sec={paid / wall if wall else 0.0:,.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
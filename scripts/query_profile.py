@@ -0,0 +1,241 @@
+"""Opt-in per-statement profiling for the pooled cursors in db.py.
+
+When enabled, every statement run through a pooled cursor is grouped by its
+SQL text and recorded with call count, latency, rows returned/affected and
+round trips (named cursor fetches included). With an EXPLAIN threshold set,
+the first call of each statement slower than the threshold is explained and
+sequential scans are flagged. Reads are re-run as ``EXPLAIN (ANALYZE,
+BUFFERS)``; writes (INSERT/UPDATE/DELETE, data-modifying CTEs, locking or
+sequence-advancing SELECTs) only get a plain ``EXPLAIN``, since running them
+again would repeat triggers, NOTIFYs, sequence advances and lock waits even
+inside a savepoint. In a transaction the EXPLAIN runs in a savepoint, so a
+failure does not abort it. At exit a
+summary table goes to stderr, or a JSON/text report to a file.
+
+Enable from the environment for any script::
+
+    DB_PROFILE=1 python scripts/check_missing_referrals.py --stream
+    DB_PROFILE=1 DB_PROFILE_EXPLAIN_MS=50 DB_PROFILE_OUTPUT=profile.json python scripts/...
+
+or from code with ``query_profile.enable(explain_ms=50)``.
+
+Environment:
+- DB_PROFILE              1 to enable
+- DB_PROFILE_EXPLAIN_MS   EXPLAIN statements slower than this (off by default)
+- DB_PROFILE_EXPLAIN_MAX  at most this many EXPLAINs per run (default 10)
+- DB_PROFILE_OUTPUT       report file; .json writes JSON, anything else a text table
+"""
+
+from __future__ import annotations
+
+import atexit
+import json
+import os
+import re
+import sys
+import threading
+import time
+from typing import Dict, List, Optional
+
+from psycopg2 import Error as PgError, sql
+from psycopg2.extensions import cursor as pg_cursor
+
+DEFAULT_EXPLAIN_MAX = 10
+EXPLAINABLE = ("select", "with", "insert", "update", "delete", "values")
+# Statements with side effects beyond reading: explained without ANALYZE
+WRITES = re.compile(
+    r"\b(insert|update|delete|merge|for\s+(no\s+key\s+)?update|for\s+(key\s+)?share|"
+    r"nextval|setval|pg_notify|pg_(try_)?advisory\w*lock\w*)\b",
+    re.IGNORECASE,
+)
+SEQ_SCAN = re.compile(r"Seq Scan on (\S+)")
+
+
+class StatementStats:
+    __slots__ = ("query", "calls", "total_ms", "max_ms", "rows", "round_trips", "plan", "seq_scans")
+
+    def __init__(self, query: str) -> None:
+        self.query = query
+        self.calls = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.rows = 0
+        self.round_trips = 0
+        self.plan: Optional[str] = None
+        self.seq_scans: List[str] = []
+
+    def as_dict(self) -> Dict[str, object]:
+        return {
+            "query": self.query,
+            "calls": self.calls,
+            "total_ms": round(self.total_ms, 3),
+            "mean_ms": round(self.total_ms / self.calls, 3) if self.calls else 0.0,
+            "max_ms": round(self.max_ms, 3),
+            "rows": self.rows,
+            "round_trips": self.round_trips,
+            "seq_scans": self.seq_scans,
+            "plan": self.plan,
+        }
+
+
+def _query_text(cursor, query) -> str:
+    if isinstance(query, sql.Composable):
+        query = query.as_string(cursor.connection)
+    if isinstance(query, bytes):
+        query = query.decode()
+    return " ".join(query.split())
+
+
+class QueryProfiler:
+    def __init__(self, explain_ms: Optional[float] = None, explain_max: int = DEFAULT_EXPLAIN_MAX,
+                 output: Optional[str] = None) -> None:
+        self.explain_ms = explain_ms
+        self.explain_max = explain_max
+        self.output = output
+        self._lock = threading.Lock()
+        self._statements: Dict[str, StatementStats] = {}
+        self._explained = 0
+        self._started = time.perf_counter()
+
+    def _entry(self, key: str) -> StatementStats:
+        entry = self._statements.get(key)
+        if entry is None:
+            entry = self._statements[key] = StatementStats(key)
+        return entry
+
+    def record_execute(self, cursor, query, vars, elapsed: float, explain: bool = True) -> str:
+        """Record one execute; returns the statement key for later fetches."""
+        key = _query_text(cursor, query)
+        elapsed_ms = elapsed * 1000
+        with self._lock:
+            entry = self._entry(key)
+            entry.calls += 1
+            entry.total_ms += elapsed_ms
+            entry.max_ms = max(entry.max_ms, elapsed_ms)
+            entry.round_trips += 1
+            if cursor.rowcount > 0:
+                entry.rows += cursor.rowcount
+        if explain and not cursor.name:
+            self.maybe_explain(cursor, key, query, vars, elapsed_ms)
+        return key
+
+    def record_fetch(self, cursor, key: str, rows: int, elapsed: float, query, vars) -> None:
+        """Record a named cursor fetch against the statement that declared it."""
+        elapsed_ms = elapsed * 1000
+        with self._lock:
+            entry = self._entry(key)
+            entry.total_ms += elapsed_ms
+            entry.max_ms = max(entry.max_ms, elapsed_ms)
+            entry.round_trips += 1
+            entry.rows += rows
+            slow = entry.total_ms
+        self.maybe_explain(cursor, key, query, vars, slow)
+
+    def maybe_explain(self, cursor, key: str, query, vars, elapsed_ms: float) -> None:
+        if self.explain_ms is None or elapsed_ms < self.explain_ms:
+            return
+        if not key.lower().startswith(EXPLAINABLE):
+            return
+        with self._lock:
+            entry = self._statements[key]
+            if entry.plan is not None or self._explained >= self.explain_max:
+                return
+            self._explained += 1
+            entry.plan = ""
+
+        conn = cursor.connection
+        plain = pg_cursor(conn)
+        try:
+            statement = cursor.mogrify(query, vars)
+            options = b"" if WRITES.search(key) else b"(ANALYZE, BUFFERS) "
+            explain = b"EXPLAIN " + options + statement
+            if conn.autocommit:
+                plain.execute(explain)
+                plan = "\n".join(row[0] for row in plain.fetchall())
+            else:
+                # Keeps the caller's transaction usable if the EXPLAIN fails
+                plain.execute("SAVEPOINT query_profile_explain")
+                try:
+                    plain.execute(explain)
+                    plan = "\n".join(row[0] for row in plain.fetchall())
+                finally:
+                    plain.execute("ROLLBACK TO SAVEPOINT query_profile_explain")
+                    plain.execute("RELEASE SAVEPOINT query_profile_explain")
+        except PgError as exc:
+            plan = f"EXPLAIN failed: {str(exc).strip()}"
+        finally:
+            plain.close()
+
+        with self._lock:
+            entry.plan = plan
+            entry.seq_scans = sorted(set(SEQ_SCAN.findall(plan)))
+
+    def statements(self) -> List[StatementStats]:
+        with self._lock:
+            return sorted(self._statements.values(), key=lambda entry: entry.total_ms, reverse=True)
+
+    def report(self) -> Dict[str, object]:
+        statements = self.statements()
+        return {
+            "wall_ms": round((time.perf_counter() - self._started) * 1000, 3),
+            "statements": len(statements),
+            "calls": sum(entry.calls for entry in statements),
+            "round_trips": sum(entry.round_trips for entry in statements),
+            "total_ms": round(sum(entry.total_ms for entry in statements), 3),
+            "queries": [entry.as_dict() for entry in statements],
+        }
+
+    def format_table(self, limit: int = 20) -> str:
+        report = self.report()
+        lines = [
+            f"=== query profile: {report['calls']} calls, {report['round_trips']} round trips, "
+            f"{report['total_ms']:.1f} ms in SQL of {report['wall_ms']:.1f} ms wall ===",
+            f"{'TOTAL ms':>10s} {'CALLS':>6s} {'MEAN ms':>9s} {'MAX ms':>9s} {'ROWS':>9s} {'TRIPS':>6s}  "
+            f"{'SEQ SCAN':16s} STATEMENT",
+        ]
+        for entry in report["queries"][:limit]:
+            seq_scans = ",".join(entry["seq_scans"]) or ("-" if entry["plan"] is not None else "")
+            lines.append(
+                f"{entry['total_ms']:>10.1f} {entry['calls']:>6d} {entry['mean_ms']:>9.2f} {entry['max_ms']:>9.1f} "
+                f"{entry['rows']:>9d} {entry['round_trips']:>6d}  {seq_scans[:16]:16s} {entry['query'][:90]}"
+            )
+        for entry in report["queries"]:
+            if entry["plan"]:
+                lines.append(f"\n--- EXPLAIN: {entry['query'][:120]}\n{entry['plan']}")
+        return "\n".join(lines)
+
+    def write(self) -> None:
+        if not self._statements:
+            return
+        if self.output and self.output.lower().endswith(".json"):
+            with open(self.output, "w", encoding="utf-8") as f:
+                json.dump(self.report(), f, indent=2)
+        elif self.output:
+            with open(self.output, "w", encoding="utf-8") as f:
+                f.write(self.format_table(limit=len(self._statements)) + "\n")
+        else:
+            print(self.format_table(), file=sys.stderr)
+
+
+active: Optional[QueryProfiler] = None
+
+
+def enable(explain_ms: Optional[float] = None, explain_max: int = DEFAULT_EXPLAIN_MAX,
+           output: Optional[str] = None) -> QueryProfiler:
+    """Start profiling pooled cursors; the report is written at exit."""
+    global active
+    if active is None:
+        active = QueryProfiler(explain_ms, explain_max, output)
+        atexit.register(active.write)
+    return active
+
+
+def enable_from_env() -> Optional[QueryProfiler]:
+    if os.getenv("DB_PROFILE", "").lower() not in ("1", "true", "yes"):
+        return None
+    explain_ms = os.getenv("DB_PROFILE_EXPLAIN_MS")
+    return enable(
+        explain_ms=float(explain_ms) if explain_ms else None,
+        explain_max=int(os.getenv("DB_PROFILE_EXPLAIN_MAX") or DEFAULT_EXPLAIN_MAX),
+        output=os.getenv("DB_PROFILE_OUTPUT") or None,
+    )
@@ -0,0 +1,181 @@
+"""
+Recompute users.loyaltyPoints and loyaltyLevel from the points ledger.
+
+The app increments ``loyaltyPoints`` as points are earned, so it drifts
+whenever a step fails half-way, and ``loyaltyLevel`` is never written at
+all. Expected values follow from the source rows:
+
+- loyaltyPoints = spending record points (spending_records.pointsEarned)
+                  + points of the transaction types that credit loyalty
+                  (earnings_ledger.LOYALTY_TRANSACTION_TYPES: the
+                  reservation route's points_earned). Spending points
+                  also credit the redeemable users.points balance
+                  (reconcile_commissions); loyaltyPoints only ranks tiers.
+- loyaltyLevel  = Platinum >= 10000, Gold >= 5000, Silver >= 2000, else
+                  Bronze (the thresholds in src/lib/affiliate.ts)
+
+Both sources are aggregated per user in one set-based query and only users
+whose stored values differ are written, with a single UPDATE ... FROM.
+``--incremental`` restricts the pass to users with spending records or
+loyalty transactions created since the previous incremental run (one
+watermark per source in script_checkpoints); the first incremental run
+covers everyone.
+
+Usage:
+    python scripts/recompute_loyalty.py                 # every user
+    python scripts/recompute_loyalty.py --incremental   # users with new spending/loyalty points since the last run
+    python scripts/recompute_loyalty.py --dry-run       # count changes, write nothing
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+import time
+from collections import Counter
+from typing import Dict
+
+import checkpoints
+from db import transaction
+from earnings_ledger import LOYALTY_TRANSACTION_TYPES
+
+# getLoyaltyLevel in src/lib/affiliate.ts (also used by api/user), highest first;
+# below the last threshold a user is DEFAULT_LEVEL
+LEVELS = (("Platinum", 10_000), ("Gold", 5_000), ("Silver", 2_000))
+DEFAULT_LEVEL = "Bronze"
+
+# Sources whose new rows mark a user for the incremental pass
+SOURCES = ("spending_records", "transactions")
+
+ALL_USERS = "SELECT id AS \"userId\" FROM users"
+
+USERS_SINCE = """
+    SELECT "userId" FROM spending_records
+    WHERE ("createdAt", id) > (%(spending_records_ts)s, %(spending_records_id)s)
+    UNION
+    SELECT "userId" FROM transactions
+    WHERE ("createdAt", id) > (%(transactions_ts)s, %(transactions_id)s) AND type = ANY(%(loyalty_types)s)
+"""
+
+RECOMPUTE_QUERY = """
+    WITH targets AS (
+        {targets}
+    ),
+    earned AS (
+        SELECT "userId", SUM(points) AS points
+        FROM (
+            SELECT "userId", "pointsEarned" AS points
+            FROM spending_records
+            WHERE "userId" IN (SELECT "userId" FROM targets)
+            UNION ALL
+            SELECT "userId", points
+            FROM transactions
+            WHERE "userId" IN (SELECT "userId" FROM targets) AND type = ANY(%(loyalty_types)s)
+        ) sources
+        GROUP BY "userId"
+    ),
+    expected AS (
+        SELECT
+            u.id,
+            u."loyaltyPoints" AS "storedPoints",
+            u."loyaltyLevel" AS "storedLevel",
+            COALESCE(e.points, 0)::INT AS "expectedPoints",
+            CASE {levels} ELSE %(default_level)s END AS "expectedLevel"
+        FROM users u
+        JOIN (SELECT DISTINCT "userId" FROM targets) t ON t."userId" = u.id
+        LEFT JOIN earned e ON e."userId" = u.id
+    ),
+    changed AS (
+        SELECT * FROM expected
+        WHERE ("storedPoints", "storedLevel") IS DISTINCT FROM ("expectedPoints", "expectedLevel")
+    ),
+    written AS (
+        {write}
+    )
+    SELECT
+        (SELECT COUNT(*) FROM expected) AS scanned,
+        (SELECT COUNT(*) FROM written) AS written,
+        COALESCE((SELECT jsonb_object_agg(move, users) FROM (
+            SELECT "storedLevel" || ' -> ' || "expectedLevel" AS move, COUNT(*) AS users
+            FROM written
+            WHERE "storedLevel" IS DISTINCT FROM "expectedLevel"
+            GROUP BY 1
+        ) moves), '{{}}'::jsonb) AS moves
+"""
+
+WRITE_CHANGED = """
+        UPDATE users u
+        SET "loyaltyPoints" = c."expectedPoints",
+            "loyaltyLevel" = c."expectedLevel",
+            "updatedAt" = CURRENT_TIMESTAMP
+        FROM changed c
+        WHERE u.id = c.id
+        RETURNING c.*
+"""
+
+PREVIEW_CHANGED = "SELECT * FROM changed"
+
+WATERMARK_QUERY = 'SELECT "createdAt", id FROM {table} ORDER BY "createdAt" DESC, id DESC LIMIT 1'
+
+
+def checkpoint_name(source: str) -> str:
+    return f"recompute_loyalty:{source}"
+
+
+def recompute(incremental: bool = False, dry_run: bool = False) -> Dict[str, object]:
+    """Recompute loyalty for every user (or those with new points); returns counts."""
+    params: Dict[str, object] = {'default_level': DEFAULT_LEVEL, 'loyalty_types': LOYALTY_TRANSACTION_TYPES}
+    for i, (level, threshold) in enumerate(LEVELS):
+        params[f"level_{i}"], params[f"threshold_{i}"] = level, threshold
+    advanced: Dict[str, checkpoints.Checkpoint] = {}
+    with transaction() as cursor:
+        if incremental:
+            checkpoints.ensure_table(cursor)
+            for source in SOURCES:
+                start = checkpoints.load(cursor, checkpoint_name(source))
+                params[f"{source}_ts"], params[f"{source}_id"] = start
+                # Read before the recompute, so rows arriving meanwhile are redone next run
+                cursor.execute(WATERMARK_QUERY.format(table=source))
+                latest = cursor.fetchone()
+                advanced[source] = checkpoints.Checkpoint(latest['createdAt'], latest['id']) if latest else start
+
+        query = RECOMPUTE_QUERY.format(
+            targets=USERS_SINCE if incremental else ALL_USERS,
+            levels=" ".join(
+                f"WHEN COALESCE(e.points, 0) >= %(threshold_{i})s THEN %(level_{i})s" for i in range(len(LEVELS))
+            ),
+            write=PREVIEW_CHANGED if dry_run else WRITE_CHANGED,
+        )
+        cursor.execute(query, params)
+        result = cursor.fetchone()
+
+        if incremental and not dry_run:
+            for source, checkpoint in advanced.items():
+                if checkpoint != checkpoints.START:
+                    checkpoints.save(cursor, checkpoint_name(source), checkpoint)
+
+    return {
+        'scanned': result['scanned'],
+        'changed': result['written'],
+        'moves': Counter(result['moves']),
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Recompute loyalty points and levels from the points ledger")
+    parser.add_argument('--incremental', action='store_true',
+                        help="Only users with spending records or loyalty transactions since the previous --incremental run")
+    parser.add_argument('--dry-run', action='store_true', help="Count changes without writing them")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    result = recompute(args.incremental, args.dry_run)
+    verb = "would change" if args.dry_run else "changed"
+    print(f"scanned={result['scanned']} {verb}={result['changed']} seconds={time.perf_counter() - started:.2f}")
+    for move, users in sorted(result['moves'].items(), key=lambda item: -item[1]):
+        print(f"  {move}: {users}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,239 @@
+"""
+Reconcile affiliate balances against the commission ledger.
+
+Stored counters on ``users`` are incremented by the app as commissions are
+paid, so they drift whenever a step fails half-way. Expected values are
+recomputed from the source rows:
+
+- totalEarnings  = commission transactions - non-rejected withdrawals
+- totalReferrals = reservations with commissionPaid = true
+- points         = commission transaction points + spending record points
+                   (earnings_ledger.POINTS_TRANSACTION_TYPES; points_earned
+                   transactions feed loyaltyPoints instead)
+
+Stored values include deltas still queued in ``user_balance_deltas``, and
+``--apply`` leaves those for earnings_ledger to fold.
+
+Users are split into id ranges (ntile over the primary key) and every range
+is aggregated with one set-based query on its own pooled connection, in
+parallel. Discrepancies are printed as JSON; ``--apply`` writes the expected
+values back in a single transaction, skipping users whose stored values
+changed since they were read.
+
+Usage:
+    python scripts/reconcile_commissions.py                     # JSON report on stdout
+    python scripts/reconcile_commissions.py --output diff.json  # report to a file
+    python scripts/reconcile_commissions.py --apply             # report, then correct
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from typing import Dict, List, Optional, Tuple
+
+import earnings_ledger
+from db import get_pool, transaction
+
+DEFAULT_WORKERS = 4
+
+FIELDS = ("totalEarnings", "totalReferrals", "points")
+
+ID_RANGES_QUERY = """
+    SELECT MIN(id) AS lo, MAX(id) AS hi
+    FROM (SELECT id, ntile(%s) OVER (ORDER BY id) AS bucket FROM users) buckets
+    GROUP BY bucket
+    ORDER BY lo
+"""
+
+DISCREPANCIES_QUERY = """
+    WITH tx AS (
+        SELECT "userId",
+               COALESCE(SUM(amount) FILTER (WHERE type = 'commission'), 0) AS commission,
+               COALESCE(SUM(points) FILTER (WHERE type = ANY(%(points_types)s)), 0) AS points
+        FROM transactions
+        WHERE "userId" BETWEEN %(lo)s AND %(hi)s
+        GROUP BY "userId"
+    ),
+    wd AS (
+        SELECT "userId", SUM(amount) AS withdrawn
+        FROM withdrawals
+        WHERE status <> 'rejected' AND "userId" BETWEEN %(lo)s AND %(hi)s
+        GROUP BY "userId"
+    ),
+    ref AS (
+        SELECT "referrerId", COUNT(*) AS referrals
+        FROM reservations
+        WHERE "commissionPaid" = true AND "referrerId" BETWEEN %(lo)s AND %(hi)s
+        GROUP BY "referrerId"
+    ),
+    sp AS (
+        SELECT "userId", SUM("pointsEarned") AS points
+        FROM spending_records
+        WHERE "userId" BETWEEN %(lo)s AND %(hi)s
+        GROUP BY "userId"
+    ),
+    pd AS (
+        SELECT "userId", SUM(earnings) AS earnings, SUM(referrals) AS referrals, SUM(points) AS points
+        FROM user_balance_deltas
+        WHERE "userId" BETWEEN %(lo)s AND %(hi)s
+        GROUP BY "userId"
+    ),
+    expected AS (
+        SELECT
+            u.id,
+            u.email,
+            u."affiliateCode",
+            u."totalEarnings",
+            u."totalReferrals",
+            u.points,
+            COALESCE(pd.earnings, 0) AS "pendingEarnings",
+            COALESCE(pd.referrals, 0)::INT AS "pendingReferrals",
+            COALESCE(pd.points, 0)::INT AS "pendingPoints",
+            COALESCE(tx.commission, 0) - COALESCE(wd.withdrawn, 0) AS "expectedEarnings",
+            COALESCE(ref.referrals, 0)::INT AS "expectedReferrals",
+            (COALESCE(tx.points, 0) + COALESCE(sp.points, 0))::INT AS "expectedPoints"
+        FROM users u
+        LEFT JOIN tx ON tx."userId" = u.id
+        LEFT JOIN wd ON wd."userId" = u.id
+        LEFT JOIN ref ON ref."referrerId" = u.id
+        LEFT JOIN sp ON sp."userId" = u.id
+        LEFT JOIN pd ON pd."userId" = u.id
+        WHERE u.id BETWEEN %(lo)s AND %(hi)s
+    )
+    SELECT *
+    FROM expected
+    WHERE "totalEarnings" + "pendingEarnings" <> "expectedEarnings"
+       OR "totalReferrals" + "pendingReferrals" <> "expectedReferrals"
+       OR points + "pendingPoints" <> "expectedPoints"
+    ORDER BY id
+"""
+
+APPLY_QUERY = """
+    UPDATE users u
+    SET "totalEarnings" = d."expectedEarnings" - d."pendingEarnings",
+        "totalReferrals" = d."expectedReferrals" - d."pendingReferrals",
+        points = d."expectedPoints" - d."pendingPoints",
+        "updatedAt" = CURRENT_TIMESTAMP
+    FROM jsonb_to_recordset(%s::jsonb) AS d(
+        id TEXT,
+        "totalEarnings" NUMERIC, "expectedEarnings" NUMERIC, "pendingEarnings" NUMERIC,
+        "totalReferrals" INT, "expectedReferrals" INT, "pendingReferrals" INT,
+        points INT, "expectedPoints" INT, "pendingPoints" INT
+    )
+    WHERE u.id = d.id
+      AND u."totalEarnings" = d."totalEarnings"
+      AND u."totalReferrals" = d."totalReferrals"
+      AND u.points = d.points
+    RETURNING u.id
+"""
+
+
+def id_ranges(workers: int) -> List[Tuple[str, str]]:
+    with transaction() as cursor:
+        earnings_ledger.ensure_table(cursor)
+        cursor.execute(ID_RANGES_QUERY, (workers,))
+        return [(row['lo'], row['hi']) for row in cursor.fetchall()]
+
+
+def scan_range(bounds: Tuple[str, str]) -> List[dict]:
+    lo, hi = bounds
+    with transaction() as cursor:
+        cursor.execute(DISCREPANCIES_QUERY, {
+            'lo': lo, 'hi': hi, 'points_types': earnings_ledger.POINTS_TRANSACTION_TYPES,
+        })
+        return cursor.fetchall()
+
+
+def find_discrepancies(workers: int = DEFAULT_WORKERS) -> List[dict]:
+    """Aggregate every user id range in parallel and return the mismatched rows."""
+    # One pooled connection per thread; the pool raises instead of blocking when exhausted
+    workers = min(max(workers, 1), get_pool().maxconn)
+    ranges = id_ranges(workers)
+    with ThreadPoolExecutor(max_workers=max(1, len(ranges))) as executor:
+        results = executor.map(scan_range, ranges)
+        return [row for rows in results for row in rows]
+
+
+def to_report(row: dict) -> dict:
+    # Deltas not yet folded by earnings_ledger count as stored
+    stored = {
+        'totalEarnings': row['totalEarnings'] + row['pendingEarnings'],
+        'totalReferrals': row['totalReferrals'] + row['pendingReferrals'],
+        'points': row['points'] + row['pendingPoints'],
+    }
+    expected = {'totalEarnings': row['expectedEarnings'], 'totalReferrals': row['expectedReferrals'],
+                'points': row['expectedPoints']}
+    return {
+        'userId': row['id'],
+        'email': row['email'],
+        'affiliateCode': row['affiliateCode'],
+        'fields': {
+            field: {'stored': stored[field], 'expected': expected[field], 'delta': expected[field] - stored[field]}
+            for field in FIELDS
+            if stored[field] != expected[field]
+        },
+    }
+
+
+def json_default(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+
+def apply_corrections(rows: List[dict]) -> List[str]:
+    """Write expected values for ``rows``; users changed since the scan are left alone."""
+    if not rows:
+        return []
+    payload = json.dumps(
+        [
+            {key: row[key] for key in ('id', 'totalEarnings', 'expectedEarnings', 'pendingEarnings',
+                                       'totalReferrals', 'expectedReferrals', 'pendingReferrals',
+                                       'points', 'expectedPoints', 'pendingPoints')}
+            for row in rows
+        ],
+        default=json_default,
+    )
+    with transaction() as cursor:
+        cursor.execute(APPLY_QUERY, (payload,))
+        return [row['id'] for row in cursor.fetchall()]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Reconcile affiliate balances with the commission ledger")
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                        help=f"Parallel user id ranges (default {DEFAULT_WORKERS}, capped at DB_POOL_MAX)")
+    parser.add_argument('--output', help="Write the JSON report to this file instead of stdout")
+    parser.add_argument('--apply', action='store_true', help="Correct stored balances in one transaction")
+    args = parser.parse_args()
+
+    rows = find_discrepancies(args.workers)
+    report: Dict[str, object] = {
+        'discrepancies': [to_report(row) for row in rows],
+        'count': len(rows),
+    }
+
+    applied: Optional[List[str]] = None
+    if args.apply:
+        applied = apply_corrections(rows)
+        applied_ids = set(applied)
+        report['applied'] = len(applied)
+        report['skipped'] = [row['id'] for row in rows if row['id'] not in applied_ids]
+
+    text = json.dumps(report, indent=2, default=json_default)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as handle:
+            handle.write(text + "\n")
+        print(f"discrepancies={len(rows)} report={args.output}"
+              + (f" applied={len(applied)}" if applied is not None else ""), file=sys.stderr)
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
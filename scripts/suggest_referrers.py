@@ -0,0 +1,184 @@
+"""
+Suggest likely referrers for reservations without one
+
+One streamed pass over reservations builds in-memory hash maps of who
+referred each booker and each patient contact before; the affiliate
+directory supplies users and teams. Every open reservation is then scored
+against those maps without further queries:
+
+- contact:  earlier reservations with the same patientPhone/patientEmail
+            were referred by this code (same patient)
+- booker:   the booker's other reservations were referred by this code
+- team:     the booker is a member of this code's team (not its leader)
+
+Ties go to the code that referred most recently.
+
+Only the latest open reservation per patient name is scored, matching what
+the bulk attribution path updates. The output is a CSV/JSON file with
+patient_name and affiliate_code columns (plus score and signals for
+review) that can be fed straight back in:
+
+    python scripts/suggest_referrers.py --output suggestions.csv
+    python scripts/add_specific_referrals.py --file suggestions.csv --dry-run
+"""
+import argparse
+import csv
+import json
+import sys
+from collections import Counter, defaultdict
+from datetime import datetime
+from typing import NamedTuple
+
+from affiliate_directory import get_directory
+from check_missing_referrals import phone_key
+from db import DEFAULT_ITERSIZE, stream
+
+CONTACT_WEIGHT = 5
+BOOKER_WEIGHT = 3
+TEAM_WEIGHT = 2
+
+RESERVATIONS_QUERY = '''
+    SELECT
+        r.id,
+        r."userId",
+        r."patientName",
+        r."patientPhone",
+        r."patientEmail",
+        r."referrerId",
+        r."createdAt"
+    FROM reservations r
+    ORDER BY r."createdAt"
+'''
+
+
+class SignalMaps(NamedTuple):
+    directory: object
+    by_booker: dict     # booker userId -> Counter(code)
+    by_contact: dict    # phone/email -> Counter(code)
+    last_referral: dict # code -> createdAt of its latest referral
+
+
+FIELDS = ['patient_name', 'affiliate_code', 'rank', 'score', 'signals', 'reservation_id', 'referrer_name']
+
+
+def email_key(email):
+    return (email or '').strip().lower()
+
+
+def name_key(name):
+    return ' '.join((name or '').lower().split())
+
+
+def collect(itersize=DEFAULT_ITERSIZE):
+    """One pass over reservations: signal maps plus the open reservation per patient."""
+    directory = get_directory(listen=False)
+    by_booker = defaultdict(Counter)
+    by_contact = defaultdict(Counter)
+    last_referral = {}
+    open_by_name = {}
+
+    for res in stream(RESERVATIONS_QUERY, itersize=itersize):
+        contacts = [key for key in (phone_key(res['patientPhone']), email_key(res['patientEmail'])) if key]
+        if res['referrerId']:
+            code = directory.code_for_user(res['referrerId'])
+            if code:
+                last_referral[code] = res['createdAt']
+                by_booker[res['userId']][code] += 1
+                for contact in contacts:
+                    by_contact[contact][code] += 1
+        else:
+            # Rows arrive oldest first, so the last one seen per name is the latest
+            open_by_name[name_key(res['patientName'])] = (res, contacts)
+
+    maps = SignalMaps(directory, by_booker, by_contact, last_referral)
+    return maps, list(open_by_name.values())
+
+
+def score(maps, res, contacts):
+    """Ranked [(code, leader, score, signals)] for one open reservation."""
+    scores = Counter()
+    signals = defaultdict(set)
+
+    for contact in contacts:
+        for code, count in maps.by_contact.get(contact, {}).items():
+            scores[code] += CONTACT_WEIGHT * count
+            signals[code].add('contact')
+
+    for code, count in maps.by_booker.get(res['userId'], {}).items():
+        scores[code] += BOOKER_WEIGHT * count
+        signals[code].add('booker')
+
+    team_code = maps.directory.code_for_user(res['userId'])
+    if team_code:
+        scores[team_code] += TEAM_WEIGHT
+        signals[team_code].add('team')
+
+    def rank_key(item):
+        code, total = item
+        return total, maps.last_referral.get(code, datetime.min)
+
+    ranked = []
+    for code, total in sorted(scores.items(), key=rank_key, reverse=True):
+        leader = maps.directory.resolve(code)
+        # The bulk path rejects a booker's own code
+        if leader is None or leader.id == res['userId']:
+            continue
+        ranked.append((code, leader, total, sorted(signals[code])))
+    return ranked
+
+
+def suggest(top=1, min_score=1, itersize=DEFAULT_ITERSIZE):
+    maps, open_reservations = collect(itersize)
+    suggestions = []
+    for res, contacts in open_reservations:
+        ranked = score(maps, res, contacts)
+        for rank, (code, leader, total, signals) in enumerate(ranked[:top], 1):
+            if total < min_score:
+                break
+            suggestions.append({
+                'patient_name': res['patientName'],
+                'affiliate_code': code,
+                'rank': rank,
+                'score': total,
+                'signals': '+'.join(signals),
+                'reservation_id': res['id'],
+                'referrer_name': leader.name,
+            })
+    suggestions.sort(key=lambda row: (-row['score'], row['patient_name'], row['rank']))
+    return len(open_reservations), suggestions
+
+
+def write_suggestions(path, suggestions):
+    if path.lower().endswith('.json'):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(suggestions, f, indent=2, ensure_ascii=False)
+        return
+
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=FIELDS)
+        writer.writeheader()
+        writer.writerows(suggestions)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Suggest referrers for reservations without one")
+    parser.add_argument('--output', default='referrer_suggestions.csv',
+                        help="CSV or JSON file to write (default referrer_suggestions.csv)")
+    parser.add_argument('--top', type=int, default=1,
+                        help="Suggestions per reservation (default 1; only rank 1 is safe to bulk-apply)")
+    parser.add_argument('--min-score', type=int, default=BOOKER_WEIGHT,
+                        help=f"Drop suggestions scoring below this (default {BOOKER_WEIGHT})")
+    parser.add_argument('--itersize', type=int, default=DEFAULT_ITERSIZE,
+                        help=f"Rows fetched per round trip (default {DEFAULT_ITERSIZE})")
+    args = parser.parse_args()
+
+    open_count, suggestions = suggest(top=args.top, min_score=args.min_score, itersize=args.itersize)
+    write_suggestions(args.output, suggestions)
+
+    covered = len({row['reservation_id'] for row in suggestions})
+    print(f"open_reservations={open_count} suggested={covered} rows={len(suggestions)} output={args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
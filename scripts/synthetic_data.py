@@ -0,0 +1,282 @@
+"""Load a local database with synthetic data for benchmarks.
+
+Rows are generated server-side with ``generate_series`` (no client-side
+row building) in chunks of one transaction each, so 10M reservations load
+in minutes. Every synthetic id starts with ``bench_`` and can be removed
+again with ``--clean``.
+
+Shape of the data at ``--scale N`` (N reservations):
+
+- users: N/10 (min 100) in teams of 3 sharing an affiliate code; the
+  first 5% of users form one hot DRJJ9 team
+- referrers: 30% of referrals go to the DRJJ9 team, the rest are skewed
+  toward low user numbers (kept below the Decimal(10,2) totalEarnings cap)
+- reservations: ~60% referred, 50% completed, completed+referred ones paid
+- transactions: one commission row per paid reservation; user totals are
+  recomputed to match
+- daily_spending_entries: N rows over one upload per day
+
+Refuses to run against a non-local database unless --allow-remote is given.
+
+Usage:
+    python scripts/synthetic_data.py --scale 100000
+    python scripts/synthetic_data.py --clean
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+import time
+from typing import Dict
+
+from psycopg2.extensions import parse_dsn
+
+from db import get_database_url, transaction
+
+PREFIX = "bench_"
+HOT_CODE = "DRJJ9"
+HOT_TEAM_SHARE = 0.05
+HOT_REFERRAL_SHARE = 0.3
+CATEGORIES = 5
+TREATMENTS = 50
+CHUNK_ROWS = 500_000
+SPENDING_DAYS = 365
+
+FIRST_NAMES = [
+    "Ayu", "Budi", "Citra", "Dewi", "Eka", "Fika", "Gilang", "Hana", "Indra", "Joko",
+    "Kartika", "Lestari", "Made", "Nur", "Putri", "Rizky", "Sari", "Tono", "Wildan", "Yuni",
+]
+LAST_NAMES = [
+    "Pratama", "Saputra", "Wijaya", "Lestari", "Kusuma", "Hidayat", "Santoso", "Nugroho",
+    "Wibowo", "Putra", "Anggraini", "Arif", "Setiawan", "Rahayu", "Permata", "Halim",
+]
+
+CLEAN_STATEMENTS = [
+    "DELETE FROM transactions WHERE id LIKE 'bench\\_%'",
+    "DELETE FROM reservations WHERE id LIKE 'bench\\_%'",
+    "DELETE FROM daily_spending_uploads WHERE id LIKE 'bench\\_%'",
+    "DELETE FROM treatments WHERE id LIKE 'bench\\_%'",
+    "DELETE FROM treatment_categories WHERE id LIKE 'bench\\_%'",
+    "DELETE FROM users WHERE id LIKE 'bench\\_%'",
+]
+
+CLEAN_INDEX_NAMES = ["bench_clean_reservations_user", "bench_clean_reservations_referrer", "bench_clean_transactions_user"]
+CLEAN_INDEXES = [
+    'CREATE INDEX bench_clean_reservations_user ON reservations ("userId")',
+    'CREATE INDEX bench_clean_reservations_referrer ON reservations ("referrerId")',
+    'CREATE INDEX bench_clean_transactions_user ON transactions ("userId")',
+]
+
+USERS_SQL = """
+    INSERT INTO users (id, "clerkUserId", email, "firstName", "lastName", "affiliateCode",
+                       "isTeamLeader", "createdAt", "updatedAt")
+    SELECT
+        'bench_u' || g,
+        'bench_clerk_' || g,
+        'bench' || g || '@example.com',
+        (%(first)s::TEXT[])[1 + g %% array_length(%(first)s::TEXT[], 1)],
+        (%(last)s::TEXT[])[1 + (g / 20) %% array_length(%(last)s::TEXT[], 1)],
+        CASE WHEN g <= %(hot)s THEN %(hot_code)s ELSE 'BN' || ((g - %(hot)s - 1) / 3) END,
+        g = 1 OR (g > %(hot)s AND (g - %(hot)s - 1) %% 3 = 0),
+        TIMESTAMP '2024-01-01' + g * INTERVAL '1 second',
+        CURRENT_TIMESTAMP
+    FROM generate_series(%(lo)s, %(hi)s) AS g
+"""
+
+CATALOG_SQL = [
+    """
+    INSERT INTO treatment_categories (id, name, slug, "createdAt", "updatedAt")
+    SELECT 'bench_c' || g, 'Bench Category ' || g, 'bench-category-' || g, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP
+    FROM generate_series(1, %(categories)s) AS g
+    """,
+    """
+    INSERT INTO treatments (id, "categoryId", name, slug, price, "createdAt", "updatedAt")
+    SELECT 'bench_t' || g, 'bench_c' || (1 + g %% %(categories)s), 'Bench Treatment ' || g,
+           'bench-treatment-' || g, 100000 + (g %% 20) * 50000, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP
+    FROM generate_series(1, %(treatments)s) AS g
+    """,
+]
+
+RESERVATIONS_SQL = """
+    INSERT INTO reservations (id, "userId", "treatmentId", "referredBy", "referrerId",
+                              "patientName", "patientEmail", "patientPhone",
+                              "reservationDate", "reservationTime", status,
+                              "originalPrice", "finalPrice", "commissionAmount", "commissionPaid",
+                              "completedAt", "createdAt", "updatedAt")
+    SELECT
+        'bench_r' || g,
+        'bench_u' || booker,
+        'bench_t' || treatment,
+        ref."affiliateCode",
+        ref.id,
+        (%(first)s::TEXT[])[1 + patient %% array_length(%(first)s::TEXT[], 1)] || ' '
+            || (%(last)s::TEXT[])[1 + (patient / 20) %% array_length(%(last)s::TEXT[], 1)] || ' ' || patient,
+        'patient' || patient || '@example.com',
+        '08' || lpad(patient::TEXT, 10, '0'),
+        created + INTERVAL '3 days',
+        '10:00',
+        status,
+        price,
+        price,
+        CASE WHEN ref.id IS NULL THEN 0 ELSE ROUND(price * 0.10, 2) END,
+        ref.id IS NOT NULL AND status = 'completed',
+        CASE WHEN status = 'completed' THEN created + INTERVAL '3 days' END,
+        created,
+        created
+    FROM (
+        SELECT
+            g,
+            1 + floor(random() * %(users)s)::BIGINT AS booker,
+            1 + floor(random() * %(treatments)s)::BIGINT AS treatment,
+            1 + floor(random() * GREATEST(%(users)s * 2, 1))::BIGINT AS patient,
+            CASE
+                WHEN random() >= 0.6 THEN NULL
+                WHEN random() < %(hot_share)s THEN 1 + floor(random() * %(hot)s)::BIGINT
+                ELSE 1 + floor(%(users)s * power(random(), 1.5))::BIGINT
+            END AS referrer,
+            (ARRAY['completed', 'completed', 'completed', 'completed', 'completed',
+                   'pending', 'pending', 'confirmed', 'confirmed', 'cancelled'])[1 + floor(random() * 10)::INT] AS status,
+            (100000 + floor(random() * 20) * 50000)::NUMERIC(10,2) AS price,
+            TIMESTAMP '2024-01-01' + g * INTERVAL '30 seconds' AS created
+        FROM generate_series(%(lo)s, %(hi)s) AS g
+    ) r
+    LEFT JOIN users ref ON ref.id = 'bench_u' || r.referrer
+"""
+
+TRANSACTIONS_SQL = """
+    INSERT INTO transactions (id, "userId", type, amount, points, description, "referenceId", "createdAt")
+    SELECT 'bench_x' || substr(r.id, 8), r."referrerId", 'commission', r."commissionAmount",
+           FLOOR(r."commissionAmount" / 100)::INT, 'Commission from referral: ' || r."patientName",
+           r.id, r."completedAt"
+    FROM reservations r
+    WHERE r.id LIKE 'bench\\_%' AND r."commissionPaid"
+"""
+
+USER_TOTALS_SQL = """
+    UPDATE users u
+    SET "totalEarnings" = t.earnings, "totalReferrals" = t.referrals, points = t.points
+    FROM (
+        SELECT "userId", SUM(amount) AS earnings, COUNT(*) AS referrals, SUM(points) AS points
+        FROM transactions
+        WHERE id LIKE 'bench\\_%'
+        GROUP BY "userId"
+    ) t
+    WHERE u.id = t."userId"
+"""
+
+UPLOADS_SQL = """
+    INSERT INTO daily_spending_uploads (id, "reportDate", "sourceFileName", "totalRows", "createdAt", "updatedAt")
+    SELECT 'bench_d' || g, DATE '2024-01-01' + g, 'bench-' || g || '.xlsx', 0, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP
+    FROM generate_series(0, %(days)s - 1) AS g
+"""
+
+ENTRIES_SQL = """
+    INSERT INTO daily_spending_entries (id, "uploadId", "nomorInvoice", "namaPasien", "tanggalKunjungan",
+                                        status, "totalPendapatan", "pendapatanTindakan", keuntungan)
+    SELECT
+        'bench_e' || g,
+        'bench_d' || (g %% %(days)s),
+        'BINV' || g,
+        (%(first)s::TEXT[])[1 + patient %% array_length(%(first)s::TEXT[], 1)] || ' '
+            || (%(last)s::TEXT[])[1 + (patient / 20) %% array_length(%(last)s::TEXT[], 1)] || ' ' || patient,
+        TIMESTAMP '2024-01-01' + (g %% %(days)s) * INTERVAL '1 day',
+        'Selesai',
+        amount,
+        amount,
+        ROUND(amount * 0.3, 2)
+    FROM (
+        SELECT g, 1 + floor(random() * GREATEST(%(users)s * 2, 1))::BIGINT AS patient,
+               (50000 + floor(random() * 40) * 25000)::NUMERIC(14,2) AS amount
+        FROM generate_series(%(lo)s, %(hi)s) AS g
+    ) e
+"""
+
+
+def require_local(allow_remote: bool = False, action: str = "load synthetic data into") -> None:
+    host = parse_dsn(get_database_url()).get("host", "")
+    if not allow_remote and host not in ("", "localhost", "127.0.0.1", "::1") and not host.startswith("/"):
+        raise RuntimeError(f"refusing to {action} non-local host {host!r} (use --allow-remote)")
+
+
+def clean() -> Dict[str, int]:
+    deleted = {}
+    with transaction(statement_timeout_ms=0) as cursor:
+        # Without these, each deleted user's foreign key check scans reservations
+        for statement in CLEAN_INDEXES:
+            cursor.execute(statement)
+        for statement in CLEAN_STATEMENTS:
+            cursor.execute(statement)
+            deleted[statement.split()[2]] = cursor.rowcount
+        for name in CLEAN_INDEX_NAMES:
+            cursor.execute(f"DROP INDEX {name}")
+    return deleted
+
+
+def _chunked(statement: str, total: int, params: Dict[str, object], seed: float) -> None:
+    for lo in range(1, total + 1, CHUNK_ROWS):
+        hi = min(lo + CHUNK_ROWS - 1, total)
+        with transaction(statement_timeout_ms=0) as cursor:
+            # random() is seeded per session, so every chunk reseeds its own connection
+            cursor.execute("SELECT setseed(%s)", ((seed + lo / CHUNK_ROWS / 1000) % 1,))
+            cursor.execute(statement, dict(params, lo=lo, hi=hi))
+
+
+def generate(scale: int, seed: float = 0.42) -> Dict[str, object]:
+    """Insert synthetic rows for ``scale`` reservations; returns row counts and timing."""
+    users = max(100, scale // 10)
+    params = {
+        "first": FIRST_NAMES,
+        "last": LAST_NAMES,
+        "hot": max(1, int(users * HOT_TEAM_SHARE)),
+        "hot_share": HOT_REFERRAL_SHARE,
+        "hot_code": HOT_CODE,
+        "users": users,
+        "categories": CATEGORIES,
+        "treatments": TREATMENTS,
+        "days": SPENDING_DAYS,
+    }
+    started = time.perf_counter()
+
+    with transaction() as cursor:
+        for statement in CATALOG_SQL:
+            cursor.execute(statement, params)
+        cursor.execute(UPLOADS_SQL, params)
+    _chunked(USERS_SQL, users, params, seed)
+    _chunked(RESERVATIONS_SQL, scale, params, seed)
+    _chunked(ENTRIES_SQL, scale, params, seed)
+    with transaction(statement_timeout_ms=0) as cursor:
+        cursor.execute(TRANSACTIONS_SQL)
+        transactions = cursor.rowcount
+        cursor.execute(USER_TOTALS_SQL)
+        cursor.execute("ANALYZE users, reservations, transactions, daily_spending_entries")
+
+    return {
+        "users": users,
+        "reservations": scale,
+        "transactions": transactions,
+        "daily_spending_entries": scale,
+        "seconds": round(time.perf_counter() - started, 2),
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Load synthetic benchmark data")
+    parser.add_argument("--scale", type=int, default=10_000, help="Reservations to generate (default 10000)")
+    parser.add_argument("--clean", action="store_true", help="Only remove previously generated rows")
+    parser.add_argument("--allow-remote", action="store_true", help="Allow a non-local DATABASE_URL")
+    args = parser.parse_args()
+
+    require_local(args.allow_remote)
+    deleted = clean()
+    if args.clean:
+        print(" ".join(f"{table}={count}" for table, count in deleted.items()))
+        return 0
+
+    result = generate(args.scale)
+    print(" ".join(f"{key}={value}" for key, value in result.items()))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,132 @@
+"""Catalog-based row estimates and table health for the verification scripts.
+
+``COUNT(*)`` reads every row, so on large tables a readiness check grows
+with the data. The figures here come from the catalog instead and return in
+milliseconds at any size:
+
+- rows: ``pg_class.reltuples`` (kept by VACUUM/ANALYZE); a table that was
+  never analyzed (``-1``) falls back to ``n_live_tup``
+- live/dead tuples and last (auto)vacuum/analyze: ``pg_stat_user_tables``
+- table, index and total size: ``pg_relation_size``/``pg_indexes_size``/
+  ``pg_total_relation_size``
+
+Partitioned tables are summed over their leaf partitions; the vacuum and
+analyze times are those of the stalest partition, or "never" if any
+partition has not been vacuumed/analyzed yet. ``dead_ratio`` (dead over
+live + dead tuples) is the bloat signal; past the default autovacuum trigger
+(50 dead tuples + 20% of the table) the table is waiting on a vacuum.
+"""
+
+from __future__ import annotations
+
+from typing import Dict, Iterable, List, Optional
+
+from psycopg2 import sql
+
+# Autovacuum defaults: vacuum once dead tuples pass threshold + scale factor * rows
+AUTOVACUUM_THRESHOLD = 50
+AUTOVACUUM_SCALE_FACTOR = 0.2
+
+STATS_QUERY = """
+    SELECT
+        t.name AS table,
+        c.oid IS NOT NULL AS exists,
+        leaves.rows::BIGINT AS rows,
+        leaves.live::BIGINT AS live,
+        leaves.dead::BIGINT AS dead,
+        leaves.last_vacuum,
+        leaves.last_analyze,
+        leaves.table_bytes::BIGINT AS table_bytes,
+        leaves.index_bytes::BIGINT AS index_bytes,
+        leaves.total_bytes::BIGINT AS total_bytes
+    FROM unnest(%s::TEXT[]) WITH ORDINALITY AS t(name, position)
+    LEFT JOIN pg_class c ON c.oid = to_regclass('public.' || quote_ident(t.name))
+    LEFT JOIN LATERAL (
+        SELECT
+            SUM(CASE WHEN p.reltuples >= 0 THEN p.reltuples ELSE COALESCE(s.n_live_tup, 0) END) AS rows,
+            SUM(s.n_live_tup) AS live,
+            SUM(s.n_dead_tup) AS dead,
+            -- MIN() skips NULLs: a leaf never vacuumed/analyzed makes the whole table "never"
+            CASE WHEN bool_or(COALESCE(s.last_vacuum, s.last_autovacuum) IS NULL) THEN NULL
+                 ELSE MIN(GREATEST(s.last_vacuum, s.last_autovacuum)) END AS last_vacuum,
+            CASE WHEN bool_or(COALESCE(s.last_analyze, s.last_autoanalyze) IS NULL) THEN NULL
+                 ELSE MIN(GREATEST(s.last_analyze, s.last_autoanalyze)) END AS last_analyze,
+            SUM(pg_relation_size(p.oid)) AS table_bytes,
+            SUM(pg_indexes_size(p.oid)) AS index_bytes,
+            SUM(pg_total_relation_size(p.oid)) AS total_bytes
+        FROM (
+            -- pg_partition_tree() is empty for a plain table; it is its own leaf
+            SELECT relid FROM pg_partition_tree(c.oid) WHERE isleaf
+            UNION
+            SELECT c.oid WHERE c.relkind <> 'p'
+        ) tree
+        JOIN pg_class p ON p.oid = tree.relid
+        LEFT JOIN pg_stat_user_tables s ON s.relid = p.oid
+    ) leaves ON c.oid IS NOT NULL
+    ORDER BY t.position
+"""
+
+STATS_COLUMNS = (
+    "table", "exists", "rows", "live", "dead", "last_vacuum", "last_analyze",
+    "table_bytes", "index_bytes", "total_bytes",
+)
+
+
+def table_stats(cursor, tables: Iterable[str], exact: bool = False) -> List[Dict[str, object]]:
+    """Estimated rows, tuple counts, sizes and bloat signal per public table.
+
+    Missing tables are reported with ``exists=False``. With ``exact``, rows
+    is a ``COUNT(*)`` instead (a full scan of each table).
+    """
+    tables = list(tables)
+    results = []
+    with cursor.connection.cursor() as plain:
+        plain.execute(STATS_QUERY, (tables,))
+        for row in plain.fetchall():
+            stats = dict(zip(STATS_COLUMNS, row))
+            live, dead = stats["live"] or 0, stats["dead"] or 0
+            stats["dead_ratio"] = dead / (live + dead) if live + dead else 0.0
+            stats["bloated"] = dead > AUTOVACUUM_THRESHOLD + AUTOVACUUM_SCALE_FACTOR * (stats["rows"] or 0)
+            stats["exact"] = exact
+            if exact and stats["exists"]:
+                plain.execute(sql.SQL("SELECT COUNT(*) FROM public.{}").format(sql.Identifier(stats["table"])))
+                stats["rows"] = plain.fetchone()[0]
+            results.append(stats)
+    return results
+
+
+def estimate_rows(cursor, query: str, params=None) -> int:
+    """The planner's row estimate for ``query``, without running it."""
+    with cursor.connection.cursor() as plain:
+        plain.execute(f"EXPLAIN (FORMAT JSON) {query}", params)
+        return int(plain.fetchone()[0][0]["Plan"]["Plan Rows"])
+
+
+def format_bytes(size: Optional[int]) -> str:
+    size = float(size or 0)
+    for unit in ("B", "kB", "MB", "GB"):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TB"
+
+
+def _when(moment) -> str:
+    return moment.strftime("%Y-%m-%d %H:%M") if moment else "never"
+
+
+def format_stats(stats: Dict[str, object]) -> str:
+    """One line per table: rows (``~`` when estimated), sizes, dead tuples, maintenance."""
+    if not stats["exists"]:
+        return f"table={stats['table']} exists=False"
+    rows = f"{stats['rows']}" if stats["exact"] else f"~{stats['rows']}"
+    line = (
+        f"table={stats['table']} exists=True rows={rows} "
+        f"size={format_bytes(stats['table_bytes'])} indexes={format_bytes(stats['index_bytes'])} "
+        f"total={format_bytes(stats['total_bytes'])} "
+        f"live={stats['live'] or 0} dead={stats['dead'] or 0} ({stats['dead_ratio']:.0%}) "
+        f"last_vacuum={_when(stats['last_vacuum'])} last_analyze={_when(stats['last_analyze'])}"
+    )
+    if stats["bloated"]:
+        line += " BLOAT: dead tuples above autovacuum threshold, VACUUM (ANALYZE) recommended"
+    return line
@@ -0,0 +1,113 @@
+from datetime import date
+from decimal import Decimal
+
+import pytest
+
+import commission
+from commission import RateRule, RateTable
+
+LEADER = "leader-1"
+OTHER = "leader-2"
+CATEGORY = "category-1"
+NOVEMBER = commission.to_day("2026-11-01")
+JANUARY = commission.to_day("2027-01-01")
+
+TABLE = RateTable([
+    RateRule(1500, LEADER, None, NOVEMBER, JANUARY),
+    RateRule(1200, LEADER),
+    RateRule(800, None, CATEGORY),
+    RateRule(900, LEADER, CATEGORY),
+    RateRule(1300, LEADER),
+])
+
+
+@pytest.mark.parametrize("leader_id, category_id, on, rate_bp", [
+    (None, None, None, 1000),                  # default
+    (OTHER, None, "2026-12-01", 1000),
+    (OTHER, CATEGORY, None, 800),              # category only
+    (LEADER, None, None, 1300),                # later of two equal rules wins
+    (LEADER, CATEGORY, None, 900),             # leader + category beats either alone
+    (LEADER, None, "2026-12-01", 1500),        # leader + date range
+    (LEADER, None, "2027-01-01", 1300),        # until is exclusive
+    (LEADER, None, date(2026, 11, 1), 1500),   # from is inclusive
+    (LEADER, CATEGORY, "2026-12-01", 900),     # ties on specificity: later rule wins
+])
+def test_rate_rule_precedence(leader_id, category_id, on, rate_bp):
+    assert TABLE.rate_for(leader_id, category_id, on) == rate_bp
+
+
+def test_from_dict_resolves_codes_and_rates():
+    table = RateTable.from_dict(
+        {"default_rate": "0.075", "rules": [{"code": "DRJJ9", "rate": "0.12"}]},
+        resolve_code=lambda code: type("Leader", (), {"id": LEADER}),
+    )
+    assert table.default_bp == 750
+    assert table.rate_for(LEADER) == 1200
+    with pytest.raises(ValueError):
+        commission.to_bp("0.12345")
+
+
+@pytest.mark.parametrize("price, rate_bp, cents, points", [
+    (Decimal("150000.00"), 1000, 1_500_000, 150),
+    (Decimal("0.05"), 1000, 1, 0),             # 0.5 cent rounds half up
+    (Decimal("0.04"), 1000, 0, 0),
+    (Decimal("12345.67"), 1250, 154_321, 15),  # 154320.875 cents
+    (Decimal("99.99"), 1, 1, 0),               # 0.9999 cents
+    ("19999.99", 500, 100_000, 10),            # exactly Rp 1,000.00
+    (19999.89, 500, 99_999, 9),                # floats go through repr
+])
+def test_basis_point_rounding(price, rate_bp, cents, points):
+    table = RateTable(default_bp=rate_bp)
+    result = table.commission_for(price)
+    assert (result.amount_cents, result.points) == (cents, points)
+    assert result.amount == Decimal(cents).scaleb(-2)
+
+
+def batch_rows():
+    prices = [0, 1, 5, 4_999, 5_000, 1_500_000, 1_234_567, 99_999_999, 15_000_000_000]
+    leaders = [None, LEADER, OTHER]
+    categories = [None, CATEGORY]
+    days = [None, NOVEMBER - 1, NOVEMBER, JANUARY - 1, JANUARY]
+    rows = [
+        (price, leader, category, day)
+        for price in prices for leader in leaders for category in categories for day in days
+    ]
+    return [list(column) for column in zip(*rows)]
+
+
+def as_lists(result):
+    return [[int(value) for value in column] for column in result]
+
+
+@pytest.mark.skipif(commission.np is None, reason="NumPy not installed")
+def test_numpy_and_fallback_batches_agree(monkeypatch):
+    prices, leaders, categories, days = batch_rows()
+    vectorized = as_lists(commission.compute_batch(TABLE, prices, leaders, categories, days))
+    monkeypatch.setattr(commission, "np", None)
+    fallback = as_lists(commission.compute_batch(TABLE, prices, leaders, categories, days))
+    assert vectorized == fallback
+
+
+@pytest.mark.parametrize("numpy", [True, False])
+def test_batch_matches_single_row_path(monkeypatch, numpy):
+    if numpy and commission.np is None:
+        pytest.skip("NumPy not installed")
+    if not numpy:
+        monkeypatch.setattr(commission, "np", None)
+    prices, leaders, categories, days = batch_rows()
+    rates, amounts, points = as_lists(commission.compute_batch(TABLE, prices, leaders, categories, days))
+    for i, (price, leader, category, day) in enumerate(zip(prices, leaders, categories, days)):
+        single = TABLE.commission_for(commission.from_cents(price), leader, category, day)
+        assert (rates[i], amounts[i], points[i]) == tuple(single)
+
+
+@pytest.mark.parametrize("numpy", [True, False])
+def test_batch_without_optional_columns(monkeypatch, numpy):
+    if numpy and commission.np is None:
+        pytest.skip("NumPy not installed")
+    if not numpy:
+        monkeypatch.setattr(commission, "np", None)
+    rates, amounts, points = as_lists(commission.compute_batch(TABLE, [1_000_000, 5]))
+    assert rates == [1000, 1000]
+    assert amounts == [100_000, 1]
+    assert points == [10, 0]
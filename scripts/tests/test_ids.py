@@ -0,0 +1,68 @@
+import time
+
+import pytest
+
+import ids
+
+
+@pytest.fixture
+def frozen_clock(monkeypatch):
+    """Pin the id clock ahead of wall time so every reservation shares one millisecond."""
+    ms = int(time.time() * 1000) + 60_000
+    monkeypatch.setattr(ids._state, "last_ms", ms)
+    return ms
+
+
+def prefix(value):
+    """Timestamp and counter: the part of an id that must never repeat in a process."""
+    return value[:ids._COUNTER_AT + ids.COUNTER_WIDTH]
+
+
+def test_cuid_layout():
+    value = ids.cuid()
+    assert ids.is_cuid(value)
+    assert value[ids._COUNTER_AT + ids.COUNTER_WIDTH:ids._RANDOM_AT] == ids._state.fingerprint
+    assert abs(ids.timestamp_of(value) - time.time()) < 5
+
+
+def test_cuids_unique_and_ordered():
+    batch = ids.cuids(50_000)
+    assert len(set(batch)) == len(batch)
+    assert batch == sorted(batch)
+    assert all(ids.is_cuid(value) for value in batch)
+
+
+def test_single_and_batch_ids_interleave_in_order():
+    values = [ids.cuid()] + ids.cuids(1000) + [ids.cuid()] + ids.cuids(3) + [ids.cuid()]
+    prefixes = [prefix(value) for value in values]
+    assert prefixes == sorted(prefixes)
+    assert len(set(prefixes)) == len(prefixes)
+
+
+def test_batch_counters_match_single_ids(frozen_clock, monkeypatch):
+    monkeypatch.setattr(ids._state, "counter", 1234)
+    batch = ids.cuids(40)
+    monkeypatch.setattr(ids._state, "last_ms", frozen_clock)
+    monkeypatch.setattr(ids._state, "counter", 1234)
+    singles = [ids.cuid() for _ in range(40)]
+    assert [prefix(value) for value in batch] == [prefix(value) for value in singles]
+
+
+@pytest.mark.parametrize("make", [lambda n: ids.cuids(n), lambda n: [ids.cuid() for _ in range(n)]])
+def test_counter_wrap_moves_to_next_millisecond(frozen_clock, monkeypatch, make):
+    monkeypatch.setattr(ids._state, "counter", ids.COUNTER_SPACE - 3)
+    batch = make(6)
+    counters = [value[ids._COUNTER_AT:ids._COUNTER_AT + ids.COUNTER_WIDTH] for value in batch]
+    assert counters == ["zzzx", "zzzy", "zzzz", "0000", "0001", "0002"]
+    assert [ids.timestamp_of(value) * 1000 for value in batch] == [frozen_clock] * 3 + [frozen_clock + 1] * 3
+    assert batch == sorted(batch)
+    # The next reservation continues after the wrap
+    assert ids.cuid()[ids._COUNTER_AT:ids._COUNTER_AT + ids.COUNTER_WIDTH] == "0003"
+
+
+def test_cuids_fills_out_in_place():
+    out = ["x", None, None, None, "y"]
+    assert ids.cuids(3, out=out, offset=1) is out
+    assert out[0] == "x" and out[4] == "y"
+    assert all(ids.is_cuid(value) for value in out[1:4])
+    assert ids.cuids(0) == []
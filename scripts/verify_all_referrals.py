@@ -1,95 +1,134 @@
 """
 Final verification of all referrals
+
+Statistics are planner estimates by default (catalog row counts and
+column statistics, no table scan), followed by size and dead-tuple figures
+for the tables involved; --exact counts them with COUNT(*).
+
+Usage:
+    python scripts/verify_all_referrals.py                    # latest 10 reservations
+    python scripts/verify_all_referrals.py --stream --limit 0 # every reservation, flat memory
+    python scripts/verify_all_referrals.py --limit 1 --exact  # exact statistics (full scan)
 """
-import os
-import psycopg2
-from psycopg2.extras import RealDictCursor
-from dotenv import load_dotenv
-
-load_dotenv()
-
-def connect_db():
-    database_url = os.getenv('DATABASE_URL')
-    conn = psycopg2.connect(database_url)
-    return conn
-
-def verify_all():
-    conn = connect_db()
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
-    
+import argparse
+
+from db import DEFAULT_ITERSIZE, stream, transaction
+from table_stats import estimate_rows, format_stats, table_stats
+
+STATS_TABLES = ("reservations", "users", "transactions")
+
+EXACT_STATS_QUERY = '''
+    SELECT
+        COUNT(*) as total,
+        COUNT(r."referrerId") as with_referrer,
+        COUNT(*) - COUNT(r."referrerId") as without_referrer,
+        COUNT(CASE WHEN r.status = 'completed' AND r."commissionPaid" = true THEN 1 END) as paid_commissions
+    FROM reservations r
+'''
+
+RESERVATIONS_QUERY = '''
+    SELECT
+        r.id,
+        r."patientName",
+        r."patientEmail",
+        r."patientPhone",
+        r.status,
+        r."finalPrice",
+        r."referredBy",
+        r."commissionAmount",
+        r."commissionPaid",
+        r."createdAt",
+        u."firstName" as booker_first,
+        u."lastName" as booker_last,
+        u."affiliateCode" as booker_code,
+        ref."firstName" as referrer_first,
+        ref."lastName" as referrer_last,
+        ref."affiliateCode" as referrer_code
+    FROM reservations r
+    JOIN users u ON r."userId" = u.id
+    LEFT JOIN users ref ON r."referrerId" = ref.id
+    ORDER BY r."createdAt" DESC
+    LIMIT %s
+'''
+
+def print_reservation(i, res):
+    print(f"{i}. {res['patientName']} - {res['status'].upper()}")
+    print(f"   Phone: {res['patientPhone']}")
+    print(f"   Price: Rp {float(res['finalPrice']):,.0f}")
+    print(f"   Booked by: {res['booker_first']} {res['booker_last']} ({res['booker_code']})")
+
+    if res['referredBy']:
+        print(f"   ✅ Referrer: {res['referrer_first']} {res['referrer_last']} ({res['referrer_code']})")
+        print(f"   ✅ Commission: Rp {float(res['commissionAmount']):,.0f}")
+        print(f"   ✅ Paid: {'YES' if res['commissionPaid'] else 'NO'}")
+    else:
+        print(f"   ❌ NO REFERRER")
+
+    print(f"   Created: {res['createdAt']}")
+    print()
+
+def estimated_stats(cursor):
+    total = table_stats(cursor, ("reservations",))[0]['rows'] or 0
+    with_referrer = estimate_rows(cursor, 'SELECT 1 FROM reservations WHERE "referrerId" IS NOT NULL')
+    paid = estimate_rows(
+        cursor, "SELECT 1 FROM reservations WHERE status = 'completed' AND \"commissionPaid\" = true"
+    )
+    return {
+        'total': total,
+        'with_referrer': with_referrer,
+        'without_referrer': max(total - with_referrer, 0),
+        'paid_commissions': paid,
+    }
+
+def verify_all(limit=10, use_stream=False, itersize=DEFAULT_ITERSIZE, exact=False):
     print("="*80)
     print("FINAL VERIFICATION - ALL RESERVATIONS")
     print("="*80 + "\n")
-    
-    cursor.execute(
-        '''
-        SELECT 
-            r.id,
-            r."patientName",
-            r."patientEmail",
-            r."patientPhone",
-            r.status,
-            r."finalPrice",
-            r."referredBy",
-            r."commissionAmount",
-            r."commissionPaid",
-            r."createdAt",
-            u."firstName" as booker_first,
-            u."lastName" as booker_last,
-            u."affiliateCode" as booker_code,
-            ref."firstName" as referrer_first,
-            ref."lastName" as referrer_last,
-            ref."affiliateCode" as referrer_code
-        FROM reservations r
-        JOIN users u ON r."userId" = u.id
-        LEFT JOIN users ref ON r."referrerId" = ref.id
-        ORDER BY r."createdAt" DESC
-        LIMIT 10
-        '''
-    )
-    
-    results = cursor.fetchall()
-    
-    for i, res in enumerate(results, 1):
-        print(f"{i}. {res['patientName']} - {res['status'].upper()}")
-        print(f"   Phone: {res['patientPhone']}")
-        print(f"   Price: Rp {float(res['finalPrice']):,.0f}")
-        print(f"   Booked by: {res['booker_first']} {res['booker_last']} ({res['booker_code']})")
-        
-        if res['referredBy']:
-            print(f"   ✅ Referrer: {res['referrer_first']} {res['referrer_last']} ({res['referrer_code']})")
-            print(f"   ✅ Commission: Rp {float(res['commissionAmount']):,.0f}")
-            print(f"   ✅ Paid: {'YES' if res['commissionPaid'] else 'NO'}")
+
+    # LIMIT NULL means no limit
+    limit_param = (limit or None,)
+
+    if use_stream:
+        for i, res in enumerate(stream(RESERVATIONS_QUERY, limit_param, itersize=itersize), 1):
+            print_reservation(i, res)
+
+    with transaction() as cursor:
+        if not use_stream:
+            cursor.execute(RESERVATIONS_QUERY, limit_param)
+
+            results = cursor.fetchall()
+
+            for i, res in enumerate(results, 1):
+                print_reservation(i, res)
+
+        # Count stats
+        if exact:
+            cursor.execute(EXACT_STATS_QUERY)
+            stats = cursor.fetchone()
         else:
-            print(f"   ❌ NO REFERRER")
-        
-        print(f"   Created: {res['createdAt']}")
+            stats = estimated_stats(cursor)
+        approx = "" if exact else "~"
+
+        print("="*80)
+        print("STATISTICS" + ("" if exact else " (estimated, --exact to count)"))
+        print("="*80)
+        print(f"Total Reservations: {approx}{stats['total']}")
+        print(f"With Referrer: {approx}{stats['with_referrer']}")
+        print(f"Without Referrer: {approx}{stats['without_referrer']}")
+        print(f"Paid Commissions: {approx}{stats['paid_commissions']}")
+
         print()
-    
-    # Count stats
-    cursor.execute(
-        '''
-        SELECT 
-            COUNT(*) as total,
-            COUNT(r."referrerId") as with_referrer,
-            COUNT(*) - COUNT(r."referrerId") as without_referrer,
-            COUNT(CASE WHEN r.status = 'completed' AND r."commissionPaid" = true THEN 1 END) as paid_commissions
-        FROM reservations r
-        '''
-    )
-    
-    stats = cursor.fetchone()
-    
-    print("="*80)
-    print("STATISTICS")
-    print("="*80)
-    print(f"Total Reservations: {stats['total']}")
-    print(f"With Referrer: {stats['with_referrer']}")
-    print(f"Without Referrer: {stats['without_referrer']}")
-    print(f"Paid Commissions: {stats['paid_commissions']}")
-    
-    cursor.close()
-    conn.close()
+        for table in table_stats(cursor, STATS_TABLES, exact=exact):
+            print(format_stats(table))
 
 if __name__ == "__main__":
-    verify_all()
+    parser = argparse.ArgumentParser(description="Verify referrals on reservations")
+    parser.add_argument('--limit', type=int, default=10, help="Reservations to list, 0 = all (default 10)")
+    parser.add_argument('--stream', action='store_true', help="Stream rows with a server-side cursor")
+    parser.add_argument('--itersize', type=int, default=DEFAULT_ITERSIZE,
+                        help=f"Rows fetched per round trip in stream mode (default {DEFAULT_ITERSIZE})")
+    parser.add_argument('--exact', action='store_true',
+                        help="Exact statistics with COUNT(*) (full table scans) instead of planner estimates")
+    args = parser.parse_args()
+
+    verify_all(limit=args.limit, use_stream=args.stream, itersize=args.itersize, exact=args.exact)
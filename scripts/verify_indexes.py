@@ -0,0 +1,222 @@
+"""
+Check that the hot-query index pack is used by the scripts' queries.
+
+The pack lives in prisma/migration_hot_query_indexes.sql and is applied by
+migrate.py. Each check below is a query one of the scripts runs (taken from
+the script where it is a module constant), with parameters sampled from the
+database. It is run under ``EXPLAIN (FORMAT JSON)``, and the check passes
+when the plan uses the expected index. Streamed queries are checked with a
+``LIMIT`` of one fetch, the way a server-side cursor plans them.
+
+``--compare`` also times each query with ``EXPLAIN ANALYZE`` twice: once
+with the pack's indexes dropped inside a transaction that is rolled back
+(before), and once with them in place (after). The DROP INDEX takes
+ACCESS EXCLUSIVE locks until the rollback, so like synthetic_data.py it
+refuses a non-local database unless --allow-remote is given.
+
+Usage:
+    python scripts/verify_indexes.py                 # plans only; exit 1 if an index is not used
+    python scripts/verify_indexes.py --compare       # plus before/after timings (local database only)
+    python scripts/verify_indexes.py --compare --output indexes.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sys
+from typing import Callable, Dict, Iterator, List, NamedTuple
+
+from check_missing_referrals import RESERVATIONS_SINCE_CHECKPOINT_QUERY, RESERVATIONS_WITHOUT_REFERRER_QUERY
+from db import DEFAULT_ITERSIZE, connection
+from migrate import INDEX_NAME, MIGRATIONS_DIR, plan
+from payout_commissions import CLAIM_QUERY, DEFAULT_BATCH_SIZE
+import synthetic_data
+
+PACK_FILE = os.path.join(MIGRATIONS_DIR, "migration_hot_query_indexes.sql")
+DEFAULT_RUNS = 3
+
+
+class Check(NamedTuple):
+    name: str
+    script: str
+    index: str
+    query: str
+    params: Callable  # cursor -> query parameters sampled from the database
+
+
+def _sample(cursor, query: str):
+    cursor.execute(query)
+    row = cursor.fetchone()
+    return tuple(row) if row else None
+
+
+def _first_fetch(query: str) -> str:
+    return f"SELECT * FROM ({query}) q LIMIT {DEFAULT_ITERSIZE}"
+
+
+CHECKS: List[Check] = [
+    Check(
+        "open_reservations_stream",
+        "check_missing_referrals.py --stream",
+        "reservations_open_referral_createdAt_idx",
+        _first_fetch(RESERVATIONS_WITHOUT_REFERRER_QUERY),
+        lambda cursor: None,
+    ),
+    Check(
+        "open_reservations_since_checkpoint",
+        "check_missing_referrals.py --incremental",
+        "reservations_open_referral_updatedAt_id_idx",
+        _first_fetch(RESERVATIONS_SINCE_CHECKPOINT_QUERY),
+        # A checkpoint a few hundred changes behind the newest open reservation
+        lambda cursor: _sample(cursor, """
+            SELECT "updatedAt", id FROM reservations WHERE "referrerId" IS NULL
+            ORDER BY "updatedAt" DESC, id DESC OFFSET 500 LIMIT 1
+        """) or ("-infinity", ""),
+    ),
+    Check(
+        "unpaid_commission_claim",
+        "payout_commissions.py",
+        "reservations_unpaid_commission_idx",
+        CLAIM_QUERY,
+        lambda cursor: (DEFAULT_BATCH_SIZE,),
+    ),
+    Check(
+        "user_recent_transactions",
+        "add_drw_corp_referral.py",
+        "transactions_userId_createdAt_idx",
+        """
+        SELECT type, amount, points, description, "createdAt"
+        FROM transactions
+        WHERE "userId" = %s
+        ORDER BY "createdAt" DESC
+        LIMIT 5
+        """,
+        lambda cursor: _sample(cursor, """
+            SELECT "userId" FROM transactions GROUP BY "userId" ORDER BY COUNT(*) DESC LIMIT 1
+        """) or ("",),
+    ),
+    Check(
+        "reservation_transactions",
+        "transactions by referenceId",
+        "transactions_referenceId_idx",
+        'SELECT id, type, amount, "createdAt" FROM transactions WHERE "referenceId" = %s',
+        lambda cursor: _sample(cursor, """
+            SELECT "referenceId" FROM transactions WHERE "referenceId" IS NOT NULL ORDER BY id DESC LIMIT 1
+        """) or ("",),
+    ),
+]
+
+
+def pack_indexes(path: str = PACK_FILE) -> Dict[str, str]:
+    """Index name -> CREATE INDEX statement, from the pack's migration file."""
+    with open(path, encoding="utf-8") as f:
+        sql = f.read()
+    indexes = {}
+    for step in plan(sql):
+        for statement in step.statements:
+            match = INDEX_NAME.match(statement)
+            if match:
+                indexes[match.group(1).strip('"')] = statement
+    return indexes
+
+
+def _plan_nodes(node: dict) -> Iterator[dict]:
+    yield node
+    for child in node.get("Plans", ()):
+        yield from _plan_nodes(child)
+
+
+def explain(cursor, check: Check, params, analyze: bool = False) -> dict:
+    options = "ANALYZE, BUFFERS, FORMAT JSON" if analyze else "FORMAT JSON"
+    cursor.execute(f"EXPLAIN ({options}) {check.query}", params)
+    result = cursor.fetchone()[0][0]
+    nodes = list(_plan_nodes(result["Plan"]))
+    return {
+        "indexes": sorted({node["Index Name"] for node in nodes if "Index Name" in node}),
+        "seq_scans": sorted({node["Relation Name"] for node in nodes if node["Node Type"] == "Seq Scan"}),
+        "ms": result.get("Execution Time"),
+    }
+
+
+def timed(cursor, check: Check, params, runs: int) -> float:
+    return min(explain(cursor, check, params, analyze=True)["ms"] for _ in range(runs))
+
+
+def verify(compare: bool = False, runs: int = DEFAULT_RUNS) -> List[dict]:
+    """Explain every check; with ``compare``, time it without and with the pack."""
+    indexes = pack_indexes()
+    results = []
+    # Nothing here is committed: claims, EXPLAIN ANALYZE writes and dropped indexes all roll back
+    with connection() as conn, conn.cursor() as cursor:
+        cursor.execute("SELECT indexname FROM pg_indexes WHERE schemaname = 'public'")
+        present = {row[0] for row in cursor.fetchall()}
+        samples = [check.params(cursor) for check in CHECKS]
+
+        for check, params in zip(CHECKS, samples):
+            found = explain(cursor, check, params)
+            results.append({
+                "check": check.name,
+                "script": check.script,
+                "index": check.index,
+                "installed": check.index in present,
+                "used": check.index in found["indexes"],
+                "plan_indexes": found["indexes"],
+                "seq_scans": found["seq_scans"],
+            })
+
+        if compare:
+            for result, check, params in zip(results, CHECKS, samples):
+                result["after_ms"] = timed(cursor, check, params, runs)
+            cursor.execute("SAVEPOINT without_pack")
+            for name in indexes:
+                if name in present:
+                    cursor.execute(f'DROP INDEX public."{name}"')
+            for result, check, params in zip(results, CHECKS, samples):
+                result["before_ms"] = timed(cursor, check, params, runs)
+            cursor.execute("ROLLBACK TO SAVEPOINT without_pack")
+    return results
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Verify the scripts' queries use the hot-query index pack")
+    parser.add_argument("--compare", action="store_true",
+                        help="Time each query without and with the pack (drops indexes in a rolled-back "
+                             "transaction; local database only)")
+    parser.add_argument("--runs", type=int, default=DEFAULT_RUNS,
+                        help=f"EXPLAIN ANALYZE runs per timing, fastest kept (default {DEFAULT_RUNS})")
+    parser.add_argument("--output", help="Also write the results as JSON to this file")
+    parser.add_argument("--allow-remote", action="store_true", help="Allow --compare on a non-local DATABASE_URL")
+    args = parser.parse_args()
+
+    if args.compare:
+        synthetic_data.require_local(args.allow_remote, "drop indexes for --compare on")
+    results = verify(args.compare, max(args.runs, 1))
+    for result in results:
+        if not result["installed"]:
+            state = "MISSING"
+        else:
+            state = "ok" if result["used"] else "NOT USED"
+        line = f"{result['check']:36s} {state:8s} {result['index']:44s}"
+        if args.compare:
+            before, after = result["before_ms"], result["after_ms"]
+            speedup = before / after if after else float("inf")
+            line += f" before={before:8.3f}ms after={after:8.3f}ms x{speedup:,.1f}"
+        print(line + f"  ({result['script']})")
+        if result["installed"] and not result["used"]:
+            print(f"    plan uses: {', '.join(result['plan_indexes']) or 'no index'}; "
+                  f"seq scans: {', '.join(result['seq_scans']) or 'none'}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+    missing = [result["index"] for result in results if not result["installed"]]
+    if missing:
+        print("Index pack not (fully) installed; run python scripts/migrate.py", file=sys.stderr)
+    return 0 if all(result["used"] for result in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
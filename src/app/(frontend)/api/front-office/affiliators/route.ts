@@ -1,5 +1,6 @@
 import { NextResponse } from 'next/server';
 import { PrismaClient } from '@prisma/client';
+import { getBalances } from '@/lib/balances';
 
 const prisma = new PrismaClient();
 
@@ -33,6 +34,9 @@ export async function GET() {
       }
     });
 
+    // Current balances, including ledger deltas not folded into users yet
+    const balances = await getBalances(prisma, users.map(user => user.id));
+
     // Process data to get affiliator statistics
     const affiliators = users.map(user => {
       const totalCommission = user.referrals
@@ -47,7 +51,7 @@ export async function GET() {
         .reduce((sum, w) => sum + Number(w.amount || 0), 0);
       
       // Calculate remaining commission
-      const remainingCommission = user.totalEarnings;
+      const remainingCommission = balances.get(user.id)?.totalEarnings ?? user.totalEarnings;
 
       return {
         firstName: user.firstName || '',
@@ -1,5 +1,57 @@
 import { NextResponse } from 'next/server';
 import { prisma } from '@/lib/prisma';
+import { queueBalanceDelta } from '@/lib/balances';
+
+// Pay one reservation's commission. The reservation row is locked (FOR UPDATE)
+// and commissionPaid re-checked inside the transaction, the same claim
+// scripts/payout_commissions.py uses, so a commission is never paid twice.
+// The referrer's balance change is queued as a ledger delta (src/lib/balances.ts)
+// rather than updating the users row.
+async function payCommission(
+  reservationId: string,
+  referrerId: string,
+  commissionAmount: number,
+  patientName: string
+): Promise<boolean> {
+  return prisma.$transaction(async (tx) => {
+    const [locked] = await tx.$queryRaw<{ commissionPaid: boolean }[]>`
+      SELECT "commissionPaid" FROM reservations WHERE id = ${reservationId} FOR UPDATE
+    `;
+    if (!locked || locked.commissionPaid) {
+      return false;
+    }
+
+    const points = Math.floor(commissionAmount / 100);
+
+    // Create commission transaction
+    const transaction = await tx.transaction.create({
+      data: {
+        userId: referrerId,
+        type: 'commission',
+        amount: commissionAmount,
+        points,
+        description: `Commission from referral: ${patientName}`,
+        referenceId: reservationId
+      }
+    });
+
+    // Queue referrer earnings
+    await queueBalanceDelta(tx, referrerId, {
+      earnings: commissionAmount,
+      referrals: 1,
+      points,
+      transactionId: transaction.id
+    });
+
+    // Mark commission as paid
+    await tx.reservation.update({
+      where: { id: reservationId },
+      data: { commissionPaid: true }
+    });
+
+    return true;
+  });
+}
 
 // Front Office endpoint - no auth required
 export async function GET(req: Request) {
@@ -97,35 +149,16 @@ export async function PATCH(req: Request) {
       console.log(`[COMMISSION] Referrer ID: ${reservation.referrerId}`);
       console.log(`[COMMISSION] Amount: ${commissionAmount}`);
 
-      // Update referrer earnings
-      await prisma.user.update({
-        where: { id: reservation.referrerId },
-        data: {
-          totalEarnings: { increment: commissionAmount },
-          totalReferrals: { increment: 1 },
-          points: { increment: Math.floor(Number(commissionAmount) / 100) }
-        }
-      });
-
-      // Create commission transaction
-      await prisma.transaction.create({
-        data: {
-          userId: reservation.referrerId,
-          type: 'commission',
-          amount: commissionAmount,
-          points: Math.floor(Number(commissionAmount) / 100),
-          description: `Commission from referral: ${reservation.patientName}`,
-          referenceId: reservation.id
-        }
-      });
-
-      // Mark commission as paid
-      await prisma.reservation.update({
-        where: { id: reservationId },
-        data: { commissionPaid: true }
-      });
+      const paid = await payCommission(
+        reservation.id,
+        reservation.referrerId,
+        Number(commissionAmount),
+        reservation.patientName
+      );
 
-      console.log(`[COMMISSION] Successfully paid commission to referrer`);
+      console.log(paid
+        ? `[COMMISSION] Successfully paid commission to referrer`
+        : `[COMMISSION] Commission already paid, skipped`);
     }
 
     return NextResponse.json({ reservation });
@@ -235,32 +268,11 @@ export async function PUT(req: Request) {
     if (reservation.status === 'completed' && !reservation.commissionPaid) {
       console.log(`[COMMISSION] Reservation already completed, paying commission now...`);
       
-      await prisma.user.update({
-        where: { id: referrer.id },
-        data: {
-          totalEarnings: { increment: commissionAmount },
-          totalReferrals: { increment: 1 },
-          points: { increment: Math.floor(commissionAmount / 100) }
-        }
-      });
-
-      await prisma.transaction.create({
-        data: {
-          userId: referrer.id,
-          type: 'commission',
-          amount: commissionAmount,
-          points: Math.floor(commissionAmount / 100),
-          description: `Commission from referral: ${reservation.patientName}`,
-          referenceId: reservation.id
-        }
-      });
+      const paid = await payCommission(reservation.id, referrer.id, commissionAmount, reservation.patientName);
 
-      await prisma.reservation.update({
-        where: { id: reservationId },
-        data: { commissionPaid: true }
-      });
-
-      console.log(`[COMMISSION] Successfully paid Rp ${commissionAmount} to ${referrer.firstName} ${referrer.lastName}`);
+      if (paid) {
+        console.log(`[COMMISSION] Successfully paid Rp ${commissionAmount} to ${referrer.firstName} ${referrer.lastName}`);
+      }
     }
 
     return NextResponse.json({ reservation, message: 'Affiliate berhasil ditambahkan' });
@@ -1,6 +1,7 @@
 import { NextRequest, NextResponse } from 'next/server';
 import { auth } from '@clerk/nextjs/server';
 import ExcelJS from 'exceljs';
+import { Prisma } from '@prisma/client';
 import { prisma } from '@/lib/prisma';
 
 type ParsedRow = {
@@ -73,6 +74,113 @@ function startOfDay(input: Date): Date {
   return date;
 }
 
+type CustomerSummary = {
+  namaPasien: string;
+  totalKunjungan: number;
+  totalPendapatan: number;
+  totalKeuntungan: number;
+  lastVisit: Date;
+};
+
+const SUMMARY_LIMIT = 1500;
+
+// daily_spending_rollups dibuat oleh scripts/create_daily_spending_tables.py --rollups;
+// sekali ada, tabelnya tetap ada, jadi cukup dicek sampai ketemu
+let rollupsReady = false;
+
+async function hasRollups(): Promise<boolean> {
+  if (!rollupsReady) {
+    const [row] = await prisma.$queryRaw<{ ready: boolean }[]>`
+      SELECT to_regclass('public.daily_spending_rollups') IS NOT NULL AS ready
+    `;
+    rollupsReady = row.ready;
+  }
+  return rollupsReady;
+}
+
+// Ringkasan per pasien (key = nama lowercase) dari entry daily spending: dari rollup
+// per hari/pasien bila tersedia, selain itu dari entry mentah terbaru
+async function entrySummaries(range?: { gte: Date; lt: Date }): Promise<Map<string, CustomerSummary>> {
+  const summaryMap = new Map<string, CustomerSummary>();
+
+  if (await hasRollups()) {
+    // Rollup dikunci per hari UTC (date_trunc pada timestamp tersimpan), jadi batas
+    // rentang dibulatkan dengan cara yang sama
+    const dateFilter = range
+      ? Prisma.sql`
+          WHERE "tanggalKunjungan" >= date_trunc('day', ${range.gte.toISOString()}::timestamptz AT TIME ZONE 'UTC')
+            AND "tanggalKunjungan" < date_trunc('day', ${range.lt.toISOString()}::timestamptz AT TIME ZONE 'UTC')`
+      : Prisma.empty;
+    const rows = await prisma.$queryRaw<{
+      patientKey: string;
+      namaPasien: string;
+      totalKunjungan: number;
+      totalPendapatan: Prisma.Decimal;
+      totalKeuntungan: Prisma.Decimal;
+      lastVisit: Date;
+    }[]>`
+      SELECT "patientKey", MAX("namaPasien") AS "namaPasien",
+             SUM("totalKunjungan")::INTEGER AS "totalKunjungan",
+             SUM("totalPendapatan") AS "totalPendapatan",
+             SUM("totalKeuntungan") AS "totalKeuntungan",
+             MAX("tanggalKunjungan") AS "lastVisit"
+      FROM daily_spending_rollups
+      ${dateFilter}
+      GROUP BY "patientKey"
+      ORDER BY SUM("totalPendapatan") DESC
+      LIMIT ${SUMMARY_LIMIT}
+    `;
+    for (const row of rows) {
+      summaryMap.set(row.patientKey, {
+        namaPasien: row.namaPasien,
+        totalKunjungan: row.totalKunjungan,
+        totalPendapatan: Number(row.totalPendapatan),
+        totalKeuntungan: Number(row.totalKeuntungan),
+        lastVisit: row.lastVisit,
+      });
+    }
+    return summaryMap;
+  }
+
+  const entries = await prisma.dailySpendingEntry.findMany({
+    where: range ? { tanggalKunjungan: range } : {},
+    orderBy: { tanggalKunjungan: 'desc' },
+    select: {
+      namaPasien: true,
+      tanggalKunjungan: true,
+      totalPendapatan: true,
+      keuntungan: true,
+    },
+    take: SUMMARY_LIMIT,
+  });
+
+  for (const row of entries) {
+    const key = row.namaPasien.trim().toLowerCase();
+    const current = summaryMap.get(key);
+    const pendapatan = Number(row.totalPendapatan || 0);
+    const keuntungan = Number(row.keuntungan || 0);
+
+    if (!current) {
+      summaryMap.set(key, {
+        namaPasien: row.namaPasien,
+        totalKunjungan: 1,
+        totalPendapatan: pendapatan,
+        totalKeuntungan: keuntungan,
+        lastVisit: row.tanggalKunjungan,
+      });
+      continue;
+    }
+
+    current.totalKunjungan += 1;
+    current.totalPendapatan += pendapatan;
+    current.totalKeuntungan += keuntungan;
+    if (row.tanggalKunjungan > current.lastVisit) {
+      current.lastVisit = row.tanggalKunjungan;
+    }
+  }
+  return summaryMap;
+}
+
 export async function GET(req: NextRequest) {
   try {
     const { searchParams } = new URL(req.url);
@@ -91,8 +199,6 @@ export async function GET(req: NextRequest) {
       range = { gte: from, lt: to };
     }
 
-    const whereByDate = range ? { tanggalKunjungan: range } : {};
-
     const uploads = await prisma.dailySpendingUpload.findMany({
       orderBy: { createdAt: 'desc' },
       take: 30,
@@ -101,53 +207,15 @@ export async function GET(req: NextRequest) {
       },
     });
 
-    const entries = await prisma.dailySpendingEntry.findMany({
-      where: whereByDate,
-      orderBy: { tanggalKunjungan: 'desc' },
-      select: {
-        namaPasien: true,
-        tanggalKunjungan: true,
-        totalPendapatan: true,
-        keuntungan: true,
-      },
-      take: 1500,
-    });
-
-    const summaryMap = new Map<string, {
-      namaPasien: string;
-      totalKunjungan: number;
-      totalPendapatan: number;
-      totalKeuntungan: number;
-      lastVisit: Date;
-    }>();
+    const summaryMap = await entrySummaries(range);
 
-    for (const row of entries) {
-      const key = row.namaPasien.trim().toLowerCase();
-      const current = summaryMap.get(key);
-      const pendapatan = Number(row.totalPendapatan || 0);
-      const keuntungan = Number(row.keuntungan || 0);
-
-      if (!current) {
-        summaryMap.set(key, {
-          namaPasien: row.namaPasien,
-          totalKunjungan: 1,
-          totalPendapatan: pendapatan,
-          totalKeuntungan: keuntungan,
-          lastVisit: row.tanggalKunjungan,
-        });
-        continue;
-      }
-
-      current.totalKunjungan += 1;
-      current.totalPendapatan += pendapatan;
-      current.totalKeuntungan += keuntungan;
-      if (row.tanggalKunjungan > current.lastVisit) {
-        current.lastVisit = row.tanggalKunjungan;
-      }
-    }
-
-    // Data hasil SCAN (sumber utama / real-time) — ikut digabung ke ringkasan
-    const scanWhere = range ? { spendingDate: range } : {};
+    // Data hasil SCAN (sumber utama / real-time) — ikut digabung ke ringkasan.
+    // Record source 'import' (link_spending_members.py) adalah kunjungan yang sama
+    // dengan entry di atas, jadi tidak dihitung dua kali.
+    const scanWhere = {
+      ...(range ? { spendingDate: range } : {}),
+      source: { not: 'import' },
+    };
     const scanRows = await prisma.spendingRecord.findMany({
       where: scanWhere,
       orderBy: { spendingDate: 'desc' },
@@ -380,7 +448,23 @@ export async function POST(req: NextRequest) {
         skipDuplicates: true,
       });
 
-      return { ...createdUpload, isReplace };
+      // Invoice yang sudah tersimpan di upload lain dilewati (nomorInvoice unik),
+      // jadi total dihitung dari baris yang benar-benar tersimpan
+      const kept = await tx.dailySpendingEntry.aggregate({
+        where: { uploadId: createdUpload.id },
+        _count: { _all: true },
+        _sum: { totalPendapatan: true, keuntungan: true },
+      });
+      const updatedUpload = await tx.dailySpendingUpload.update({
+        where: { id: createdUpload.id },
+        data: {
+          totalRows: kept._count._all,
+          totalPendapatan: kept._sum.totalPendapatan ?? 0,
+          totalKeuntungan: kept._sum.keuntungan ?? 0,
+        },
+      });
+
+      return { ...updatedUpload, isReplace };
     });
 
     const message = upload.isReplace
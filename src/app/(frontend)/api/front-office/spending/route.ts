@@ -1,6 +1,7 @@
 import { NextResponse } from 'next/server';
 import { auth } from '@clerk/nextjs/server';
 import { prisma } from '@/lib/prisma';
+import { getBalance, queueBalanceDelta } from '@/lib/balances';
 
 const TIER_THRESHOLDS = { GOLD: 1_000_000, PLATINUM: 5_000_000 };
 const RUPIAH_PER_POINT = 10_000; // Rp 10.000 = 1 poin
@@ -48,8 +49,9 @@ export async function POST(req: Request) {
 
     const pointsEarned = Math.floor(amount / RUPIAH_PER_POINT);
 
-    const [, updatedUser] = await prisma.$transaction([
-      prisma.spendingRecord.create({
+    // Poin masuk sebagai delta ledger (src/lib/balances.ts), bukan update langsung ke users
+    const balance = await prisma.$transaction(async (tx) => {
+      const record = await tx.spendingRecord.create({
         data: {
           userId: user.id,
           amount,
@@ -59,13 +61,10 @@ export async function POST(req: Request) {
           source: 'scan',
           pointsEarned,
         },
-      }),
-      prisma.user.update({
-        where: { id: user.id },
-        data: { points: { increment: pointsEarned } },
-        select: { points: true },
-      }),
-    ]);
+      });
+      await queueBalanceDelta(tx, user.id, { points: pointsEarned, transactionId: record.id });
+      return getBalance(tx, user.id);
+    });
 
     // Hitung ulang total spending member
     const [reservations, spendingRecords] = await Promise.all([
@@ -89,7 +88,7 @@ export async function POST(req: Request) {
       totalSpending,
       tier: computeTier(totalSpending),
       pointsEarned,
-      points: updatedUser.points,
+      points: balance?.points ?? 0,
     });
   } catch (error) {
     console.error('Error recording spending:', error);
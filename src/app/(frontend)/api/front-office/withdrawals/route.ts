@@ -1,6 +1,7 @@
 import { NextRequest, NextResponse } from 'next/server';
 import { auth } from '@clerk/nextjs/server';
 import { prisma } from '@/lib/prisma';
+import { getBalance, getBalances, queueBalanceDelta } from '@/lib/balances';
 
 // GET - Get all withdrawal requests
 export async function GET(req: NextRequest) {
@@ -36,9 +37,15 @@ export async function GET(req: NextRequest) {
       }
     });
 
+    // Current balance, including ledger deltas not folded into users yet
+    const balances = await getBalances(prisma, [...new Set(withdrawals.map((w) => w.userId))]);
+
     return NextResponse.json({
       success: true,
-      withdrawals
+      withdrawals: withdrawals.map((w) => ({
+        ...w,
+        user: { ...w.user, totalEarnings: balances.get(w.userId)?.totalEarnings ?? w.user.totalEarnings }
+      }))
     }, { status: 200 });
 
   } catch (error) {
@@ -75,39 +82,50 @@ export async function PATCH(req: NextRequest) {
       return NextResponse.json({ error: 'Penarikan tidak ditemukan' }, { status: 404 });
     }
 
-    // If status is being changed to rejected, return the money to user
-    if (status === 'rejected' && withdrawal.status === 'pending') {
-      await prisma.user.update({
-        where: { id: withdrawal.userId },
+    const updatedWithdrawal = await prisma.$transaction(async (tx) => {
+      // If status is being changed to rejected, return the money to user. The
+      // refund is queued as a ledger delta, and only the request that moves
+      // the withdrawal out of pending gets to queue it.
+      if (status === 'rejected' && withdrawal.status === 'pending') {
+        const { count } = await tx.withdrawal.updateMany({
+          where: { id: withdrawalId, status: 'pending' },
+          data: { status }
+        });
+        if (count) {
+          await queueBalanceDelta(tx, withdrawal.userId, {
+            earnings: Number(withdrawal.amount),
+            transactionId: withdrawal.id
+          });
+          console.log(`[FO WITHDRAWAL] Returned ${withdrawal.amount} to user ${withdrawal.user.email} due to rejection`);
+        }
+      }
+
+      // Update withdrawal
+      return tx.withdrawal.update({
+        where: { id: withdrawalId },
         data: {
-          totalEarnings: {
-            increment: parseFloat(withdrawal.amount.toString())
-          }
+          status,
+          adminNotes: adminNotes || withdrawal.adminNotes,
+          processedDate: new Date(),
+          processedBy: userId
+        },
+        include: {
+          user: true,
+          bankAccount: true
         }
       });
-      console.log(`[FO WITHDRAWAL] Returned ${withdrawal.amount} to user ${withdrawal.user.email} due to rejection`);
-    }
-
-    // Update withdrawal
-    const updatedWithdrawal = await prisma.withdrawal.update({
-      where: { id: withdrawalId },
-      data: {
-        status,
-        adminNotes: adminNotes || withdrawal.adminNotes,
-        processedDate: new Date(),
-        processedBy: userId
-      },
-      include: {
-        user: true,
-        bankAccount: true
-      }
     });
 
     console.log(`[FO WITHDRAWAL] Updated withdrawal ${withdrawalId} to status ${status} by admin ${userId}`);
 
+    const balance = await getBalance(prisma, updatedWithdrawal.userId);
+
     return NextResponse.json({
       success: true,
-      withdrawal: updatedWithdrawal
+      withdrawal: {
+        ...updatedWithdrawal,
+        user: { ...updatedWithdrawal.user, totalEarnings: balance?.totalEarnings ?? updatedWithdrawal.user.totalEarnings }
+      }
     }, { status: 200 });
 
   } catch (error) {
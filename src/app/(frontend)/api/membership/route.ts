@@ -1,6 +1,7 @@
 import { NextResponse } from 'next/server';
 import { auth } from '@clerk/nextjs/server';
 import { prisma } from '@/lib/prisma';
+import { getBalance } from '@/lib/balances';
 
 const TIER_THRESHOLDS = {
   SILVER: 0,
@@ -123,6 +124,8 @@ export async function GET() {
     const totalSpending = reservationSpending + scanSpending;
 
     const tierData = computeTier(totalSpending);
+    // Points include ledger deltas not folded into users yet
+    const balance = await getBalance(prisma, user.id);
 
     return NextResponse.json({
       membership: {
@@ -130,7 +133,7 @@ export async function GET() {
         totalSpending,
         memberSince: user.createdAt,
         isTeamLeader: user.isTeamLeader,
-        points: user.points,
+        points: balance?.points ?? user.points,
         pointHistory: user.spendingRecords
           .filter((s) => s.pointsEarned > 0)
           .slice(0, 20)
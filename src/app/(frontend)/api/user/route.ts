@@ -1,8 +1,9 @@
 import { auth } from '@clerk/nextjs/server';
 import { NextResponse } from 'next/server';
 import { prisma } from '@/lib/prisma';
-import { ensureUniqueAffiliateCode } from '@/lib/affiliate';
+import { ensureUniqueAffiliateCode, getLoyaltyLevel } from '@/lib/affiliate';
 import { ADMIN_USER_IDS } from '@/lib/admin';
+import { getBalance } from '@/lib/balances';
 
 // Handle CORS preflight
 export async function OPTIONS() {
@@ -228,6 +229,8 @@ export async function GET() {
 
     // Calculate additional fields
     const totalReferrals = user.referrals.length;
+    // Balances include ledger deltas not folded into users yet
+    const balance = await getBalance(prisma, user.id);
     const loyaltyLevel = getLoyaltyLevel(user.loyaltyPoints);
 
     // Get team members count (users with same affiliate code)
@@ -241,6 +244,8 @@ export async function GET() {
     return NextResponse.json({ 
       user: {
         ...user,
+        totalEarnings: balance?.totalEarnings ?? user.totalEarnings,
+        points: balance?.points ?? user.points,
         isAdmin,
         totalReferrals,
         loyaltyLevel,
@@ -255,10 +260,3 @@ export async function GET() {
     );
   }
 }
-
-function getLoyaltyLevel(points: number): string {
-  if (points >= 10000) return 'Platinum';
-  if (points >= 5000) return 'Gold';
-  if (points >= 1000) return 'Silver';
-  return 'Bronze';
-}
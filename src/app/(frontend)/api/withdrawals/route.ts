@@ -1,6 +1,7 @@
 import { NextRequest, NextResponse } from 'next/server';
 import { auth } from '@clerk/nextjs/server';
 import { prisma } from '@/lib/prisma';
+import { getBalance, lockBalance, queueBalanceDelta } from '@/lib/balances';
 
 // POST - Create withdrawal request
 export async function POST(req: NextRequest) {
@@ -32,58 +33,63 @@ export async function POST(req: NextRequest) {
       return NextResponse.json({ error: 'User tidak ditemukan' }, { status: 404 });
     }
 
-    // Check if user has enough balance
-    if (parseFloat(user.totalEarnings.toString()) < amount) {
-      return NextResponse.json({ error: 'Saldo komisi tidak mencukupi' }, { status: 400 });
-    }
-
-    // Check if bank account already exists for this user
-    let bankAccount = await prisma.bankAccount.findFirst({
-      where: {
-        userId: user.id,
-        accountType,
-        bankName,
-        accountNumber
+    // Check the balance and queue the deduction under a per-user lock, so two
+    // requests can't both spend the same earnings. The balance includes
+    // ledger deltas that are not folded into users yet.
+    const withdrawal = await prisma.$transaction(async (tx) => {
+      await lockBalance(tx, user.id);
+      const balance = await getBalance(tx, user.id);
+      if (!balance || balance.totalEarnings.lessThan(amount)) {
+        return null;
       }
-    });
 
-    // If not exists, create new bank account
-    if (!bankAccount) {
-      bankAccount = await prisma.bankAccount.create({
-        data: {
+      // Check if bank account already exists for this user
+      let bankAccount = await tx.bankAccount.findFirst({
+        where: {
           userId: user.id,
           accountType,
           bankName,
-          accountNumber,
-          accountName,
-          isDefault: false
+          accountNumber
         }
       });
-    }
 
-    // Create withdrawal request
-    const withdrawal = await prisma.withdrawal.create({
-      data: {
-        userId: user.id,
-        bankAccountId: bankAccount.id,
-        amount,
-        status: 'pending'
-      },
-      include: {
-        bankAccount: true
+      // If not exists, create new bank account
+      if (!bankAccount) {
+        bankAccount = await tx.bankAccount.create({
+          data: {
+            userId: user.id,
+            accountType,
+            bankName,
+            accountNumber,
+            accountName,
+            isDefault: false
+          }
+        });
       }
-    });
 
-    // Deduct from user's total earnings
-    await prisma.user.update({
-      where: { id: user.id },
-      data: {
-        totalEarnings: {
-          decrement: amount
+      // Create withdrawal request
+      const created = await tx.withdrawal.create({
+        data: {
+          userId: user.id,
+          bankAccountId: bankAccount.id,
+          amount,
+          status: 'pending'
+        },
+        include: {
+          bankAccount: true
         }
-      }
+      });
+
+      // Deduct from user's total earnings
+      await queueBalanceDelta(tx, user.id, { earnings: -Number(amount), transactionId: created.id });
+
+      return created;
     });
 
+    if (!withdrawal) {
+      return NextResponse.json({ error: 'Saldo komisi tidak mencukupi' }, { status: 400 });
+    }
+
     console.log(`[WITHDRAWAL] New request created: ${withdrawal.id} - ${amount} for user ${user.email}`);
 
     return NextResponse.json({
@@ -0,0 +1,8 @@
+// Runs once when a Next.js server process starts
+export async function register() {
+  // Fold pending balance deltas (src/lib/balances.ts) on a timer; not during `next build`
+  if (process.env.NEXT_RUNTIME === 'nodejs' && process.env.NEXT_PHASE !== 'phase-production-build') {
+    const { startBalanceFolder } = await import('./lib/balances');
+    startBalanceFolder();
+  }
+}
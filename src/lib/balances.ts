@@ -0,0 +1,152 @@
+import { Prisma } from '@prisma/client';
+import { prisma } from '@/lib/prisma';
+
+/**
+ * Affiliate balances (totalEarnings, totalReferrals, points) live on the users
+ * row, but writers never update it directly: payouts, withdrawals and spending
+ * points append a user_balance_deltas row, so concurrent payouts for a big
+ * team code don't queue on one row lock. foldBalanceDeltas() moves pending
+ * deltas into users in batches (the same query and advisory lock as
+ * scripts/earnings_ledger.py), and readers go through the user_balances view,
+ * which adds the deltas that are still pending.
+ */
+
+type Db = Prisma.TransactionClient | typeof prisma;
+
+export interface Balance {
+  totalEarnings: Prisma.Decimal;
+  totalReferrals: number;
+  points: number;
+}
+
+export interface BalanceDelta {
+  earnings?: number;
+  referrals?: number;
+  points?: number;
+  transactionId?: string;
+}
+
+// Same key as FOLD_LOCK_KEY in scripts/earnings_ledger.py
+const FOLD_LOCK_KEY = 0x6c656467;
+const FOLD_BATCH = 10_000;
+// Two-key advisory locks don't overlap the single-key fold lock
+const BALANCE_LOCK_CLASS = 0x62616c;
+
+/**
+ * Queue a balance change; it is visible through the user_balances view at
+ * once and applied to users by the next fold.
+ */
+export async function queueBalanceDelta(db: Db, userId: string, delta: BalanceDelta): Promise<void> {
+  await db.userBalanceDelta.create({
+    data: {
+      userId,
+      earnings: delta.earnings ?? 0,
+      referrals: delta.referrals ?? 0,
+      points: delta.points ?? 0,
+      transactionId: delta.transactionId ?? null
+    }
+  });
+}
+
+/**
+ * Current balances (stored counters + pending deltas), keyed by user id
+ */
+export async function getBalances(db: Db, userIds: string[]): Promise<Map<string, Balance>> {
+  if (userIds.length === 0) {
+    return new Map();
+  }
+  const rows = await db.$queryRaw<(Balance & { id: string })[]>`
+    SELECT id, "totalEarnings", "totalReferrals", points
+    FROM user_balances
+    WHERE id = ANY(${userIds})
+  `;
+  return new Map(rows.map(({ id, ...balance }) => [id, balance]));
+}
+
+export async function getBalance(db: Db, userId: string): Promise<Balance | null> {
+  return (await getBalances(db, [userId])).get(userId) ?? null;
+}
+
+/**
+ * Serialize balance checks for one user until the transaction ends, so two
+ * withdrawals can't both spend the same earnings. Payouts only add and don't
+ * need it.
+ */
+export async function lockBalance(tx: Prisma.TransactionClient, userId: string): Promise<void> {
+  await tx.$executeRaw`SELECT pg_advisory_xact_lock(${BALANCE_LOCK_CLASS}::INTEGER, hashtext(${userId}))`;
+}
+
+/**
+ * Apply pending deltas to users until none are left; returns the number of
+ * deltas folded, or 0 if another fold (here or in a script) is running.
+ */
+export async function foldBalanceDeltas(batchSize: number = FOLD_BATCH): Promise<number> {
+  let folded = 0;
+  for (;;) {
+    const deltas = await prisma.$transaction(async (tx) => {
+      const [{ locked }] = await tx.$queryRaw<{ locked: boolean }[]>`
+        SELECT pg_try_advisory_xact_lock(${FOLD_LOCK_KEY}::BIGINT) AS locked
+      `;
+      if (!locked) {
+        return 0;
+      }
+      const [result] = await tx.$queryRaw<{ deltas: bigint }[]>`
+        WITH claimed AS (
+          SELECT id
+          FROM user_balance_deltas
+          ORDER BY id
+          LIMIT ${batchSize}::INTEGER
+          FOR UPDATE SKIP LOCKED
+        ),
+        taken AS (
+          DELETE FROM user_balance_deltas d
+          USING claimed c
+          WHERE d.id = c.id
+          RETURNING d."userId", d.earnings, d.referrals, d.points
+        ),
+        folded AS (
+          UPDATE users u
+          SET "totalEarnings" = u."totalEarnings" + t.earnings,
+              "totalReferrals" = u."totalReferrals" + t.referrals,
+              points = u.points + t.points
+          FROM (
+            SELECT "userId", SUM(earnings) AS earnings, SUM(referrals) AS referrals, SUM(points) AS points
+            FROM taken
+            GROUP BY "userId"
+          ) t
+          WHERE u.id = t."userId"
+          RETURNING u.id
+        )
+        SELECT (SELECT COUNT(*) FROM taken) AS deltas, (SELECT COUNT(*) FROM folded) AS users
+      `;
+      return Number(result.deltas);
+    }, { timeout: 60_000 });
+    folded += deltas;
+    if (deltas < batchSize) {
+      return folded;
+    }
+  }
+}
+
+let folder: ReturnType<typeof setInterval> | undefined;
+
+/**
+ * Fold every BALANCE_FOLD_SECONDS (default 60, 0 disables) in this server
+ * process. Each app instance runs one; the advisory lock lets only one fold at
+ * a time, so extra instances just skip.
+ */
+export function startBalanceFolder(): void {
+  const seconds = Number(process.env.BALANCE_FOLD_SECONDS ?? 60);
+  if (folder || !(seconds > 0)) {
+    return;
+  }
+  folder = setInterval(() => {
+    foldBalanceDeltas()
+      .then((deltas) => {
+        if (deltas) {
+          console.log(`[BALANCES] Folded ${deltas} balance deltas`);
+        }
+      })
+      .catch((error) => console.error('[BALANCES] Error folding balance deltas:', error));
+  }, seconds * 1000);
+}